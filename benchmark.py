@@ -0,0 +1,527 @@
+# localshare 性能测试脚本
+# 在临时目录中启动服务器并测量吞吐量、请求延迟（p50/p99）、峰值内存和 CPU 时间：
+#   download: 比较 sendfile 与逐块读取两种下载方式
+#   ranges:   多个客户端并行下载同一大文件的不同区间（模拟下载加速器/视频播放器）
+#   workers:  不同工作线程数下的并发下载与上传吞吐量
+#   upload:   并发上传大文件，以及按批合并上传大量小文件
+#   listing:  大目录下的完整列表、分页浏览、带 ETag 的轮询和增量列表
+#   mixed:    上传、完整下载、区间下载和列表轮询同时进行
+#   writes:   multipart 上传的同步写盘与后写队列对比，以及各持久化方式（--durability）的开销
+#   all:      依次运行以上全部场景
+# 用法: python benchmark.py download --size-mb 1024 --clients 8
+#       python benchmark.py ranges --size-mb 1024 --clients 8
+#       python benchmark.py workers --size-mb 256 --clients 16 --workers 1,4,16,32
+#       python benchmark.py listing --files 50000 --clients 8
+#       python benchmark.py writes --size-mb 512 --clients 2
+#       python benchmark.py all --size-mb 128 --json results.json --server-args "--server dev"
+# --json 把结果连同当前提交、参数和机器信息写入文件，便于比较不同提交
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import platform
+import argparse
+import shutil
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'localshare.py')
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# 所有场景都附加的服务器参数（--server-args）
+SERVER_ARGS = []
+
+def start_server(folder, extra_args=()):
+    port = free_port()
+    # 关闭实例发现，避免被测实例与本机或局域网中的其他实例互相同步而干扰结果
+    cmd = [sys.executable, SCRIPT, '--host', '127.0.0.1', '--port', str(port),
+           '--folder', folder, '--events-port', '0', '--no-discovery', *SERVER_ARGS, *extra_args]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('服务器启动超时')
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def process_stats(pid):
+    # 返回 (峰值 RSS 字节, CPU 秒)；优先使用 psutil，其次读取 /proc
+    try:
+        import psutil
+        p = psutil.Process(pid)
+        mem = p.memory_info()
+        cpu = p.cpu_times()
+        return getattr(mem, 'peak_wset', None) or mem.rss, cpu.user + cpu.system
+    except ImportError:
+        pass
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        peak = int(status['VmHWM'].split()[0]) * 1024
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        return peak, cpu
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def make_file(path, size):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+def download(port, path, headers=None):
+    # 读取完整响应体并丢弃，返回收到的字节数
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', path, headers=headers or {})
+        resp = conn.getresponse()
+        buf = bytearray(1024 * 1024)
+        view = memoryview(buf)
+        total = 0
+        while True:
+            n = resp.readinto(view)
+            if not n:
+                break
+            total += n
+        return total
+    finally:
+        conn.close()
+
+def fetch(port, path, headers=None):
+    # 返回 (状态码, 响应头, 响应体)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', path, headers=headers or {})
+        resp = conn.getresponse()
+        return resp.status, resp, resp.read()
+    finally:
+        conn.close()
+
+def upload(port, name, size, count=1):
+    # 以 multipart 流式上传 count 个各 size 字节、内容互不相同的文件（name 中的 {i} 替换为序号），返回发送的文件字节数
+    boundary = 'benchmarkboundary'
+    heads = [(f'--{boundary}\r\nContent-Disposition: form-data; name="files"; '
+              f'filename="{name.format(i=i)}"\r\nContent-Type: application/octet-stream\r\n\r\n').encode()
+             for i in range(count)]
+    tail = f'--{boundary}--\r\n'.encode()
+    block = os.urandom(min(size, 1024 * 1024))
+
+    def body():
+        for head in heads:
+            yield head
+            # 每个文件开头换成不同的随机字节，同一批的文件内容各不相同，不会被服务器去重为硬链接
+            seed = os.urandom(min(size, 16))
+            yield seed + block[len(seed):size]
+            remaining = size - len(block)
+            while remaining > 0:
+                yield block[:remaining]
+                remaining -= len(block)
+            yield b'\r\n'
+        yield tail
+
+    length = sum(len(head) + size + 2 for head in heads) + len(tail)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        conn.request('POST', '/upload', body=body(), headers={
+            'Content-Type': f'multipart/form-data; boundary={boundary}',
+            'Content-Length': str(length)
+        })
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status != 200:
+            raise RuntimeError(f'上传失败: HTTP {resp.status}')
+        return size * count
+    finally:
+        conn.close()
+
+def warm_up(port, name):
+    # 先请求一次，让服务器计算并缓存文件摘要，避免计入测量时间
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    try:
+        conn.request('HEAD', f'/download/{name}')
+        conn.getresponse().read()
+    finally:
+        conn.close()
+
+def timed(latencies, func, *args, **kwargs):
+    # 调用 func 并把耗时（秒）追加到 latencies
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    latencies.append(time.perf_counter() - start)
+    return result
+
+def run_clients(clients, func):
+    # func(i, latencies) 返回该客户端传输的字节数，并把每个请求的耗时追加到 latencies；
+    # 返回 (总字节数, 总耗时, 全部请求耗时)
+    results = [0] * clients
+    latencies = [[] for _ in range(clients)]
+    errors = []
+
+    def worker(i):
+        try:
+            results[i] = func(i, latencies[i])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return sum(results), elapsed, [t for values in latencies for t in values]
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def summarize(total, elapsed, pid, latencies=(), cpu_start=0):
+    # cpu_start 为本阶段开始前服务器已用的 CPU 秒数，同一服务器上依次测量多个阶段时扣除
+    peak_rss, cpu = process_stats(pid)
+    p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+    return {
+        'bytes': total,
+        'seconds': elapsed,
+        'mb_per_s': total / elapsed / 1e6,
+        'requests': len(latencies),
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': p50 * 1000 if p50 is not None else None,
+        'p99_ms': p99 * 1000 if p99 is not None else None,
+        'peak_rss_mb': peak_rss / 1e6 if peak_rss else None,
+        'cpu_seconds': cpu - (cpu_start or 0) if cpu is not None else None
+    }
+
+def cpu_seconds(pid):
+    return process_stats(pid)[1] or 0
+
+def bench_download(folder, name, clients, rounds, extra_args):
+    proc, port = start_server(folder, extra_args)
+    try:
+        warm_up(port, name)
+        cpu = cpu_seconds(proc.pid)
+        total, elapsed, latencies = run_clients(
+            clients, lambda i, lat: sum(timed(lat, download, port, f'/download/{name}') for _ in range(rounds)))
+        result = summarize(total, elapsed, proc.pid, latencies, cpu)
+    finally:
+        stop_server(proc)
+    return result
+
+def bench_ranges(folder, name, size, connections):
+    # 把文件切成 connections 段，每个连接用 Range 请求下载其中一段
+    proc, port = start_server(folder)
+    try:
+        warm_up(port, name)
+        segment = -(-size // connections)
+
+        def fetch_range(i, lat):
+            start = i * segment
+            end = min(size, start + segment) - 1
+            if start > end:
+                return 0
+            return timed(lat, download, port, f'/download/{name}', {'Range': f'bytes={start}-{end}'})
+
+        cpu = cpu_seconds(proc.pid)
+        total, elapsed, latencies = run_clients(connections, fetch_range)
+        if total != size:
+            raise RuntimeError(f'区间下载总字节数不符: {total} != {size}')
+        result = summarize(total, elapsed, proc.pid, latencies, cpu)
+    finally:
+        stop_server(proc)
+    return result
+
+def bench_workers(folder, name, size, clients, workers):
+    # 同一工作线程数下依次测量并发下载与并发上传，上传文件大小为下载文件的 1/4
+    proc, port = start_server(folder, ('--workers', str(workers), '--no-access-log'))
+    try:
+        warm_up(port, name)
+        cpu = cpu_seconds(proc.pid)
+        total, elapsed, latencies = run_clients(clients, lambda i, lat: timed(lat, download, port, f'/download/{name}'))
+        down = summarize(total, elapsed, proc.pid, latencies, cpu)
+        upload_size = max(1, size // 4)
+        cpu = cpu_seconds(proc.pid)
+        total, elapsed, latencies = run_clients(
+            clients, lambda i, lat: timed(lat, upload, port, f'up_{workers}_{i}.bin', upload_size))
+        up = summarize(total, elapsed, proc.pid, latencies, cpu)
+    finally:
+        stop_server(proc)
+    return down, up
+
+# 小文件合并上传时每个请求包含的文件数（与网页端分批上传相近）
+SMALL_BATCH = 100
+
+def bench_upload(folder, size, clients, rounds, files, file_size):
+    # 大文件：每个客户端上传 rounds 个 size 字节的文件；小文件：files 个 file_size 字节的文件按批分给各客户端
+    proc, port = start_server(folder, ('--no-access-log',))
+    try:
+        cpu = cpu_seconds(proc.pid)
+        total, elapsed, latencies = run_clients(clients, lambda i, lat: sum(
+            timed(lat, upload, port, f'upload/large_{i}_{r}.bin', size) for r in range(rounds)))
+        large = summarize(total, elapsed, proc.pid, latencies, cpu)
+
+        batches = [(start, min(SMALL_BATCH, files - start)) for start in range(0, files, SMALL_BATCH)]
+
+        def send_small(i, lat):
+            return sum(timed(lat, upload, port, f'upload/small/{start}_{{i}}.bin', file_size, count)
+                       for start, count in batches[i::clients])
+
+        cpu = cpu_seconds(proc.pid)
+        total, elapsed, latencies = run_clients(clients, send_small)
+        small = summarize(total, elapsed, proc.pid, latencies, cpu)
+    finally:
+        stop_server(proc)
+    return large, small
+
+# writes 场景比较的服务器配置
+WRITE_MODES = (
+    ('sync', ('--write-behind', '0')),
+    ('behind', ()),
+    ('commit', ('--durability', 'commit')),
+    ('periodic', ('--durability', 'periodic')),
+)
+
+def bench_writes(folder, size, clients, rounds, extra_args):
+    # 每种配置使用单独的空目录，测完即删除，磁盘占用不随配置数增加
+    path = tempfile.mkdtemp(dir=folder)
+    proc, port = start_server(path, ('--no-access-log', *extra_args))
+    try:
+        cpu = cpu_seconds(proc.pid)
+        total, elapsed, latencies = run_clients(clients, lambda i, lat: sum(
+            timed(lat, upload, port, f'write_{i}_{r}.bin', size) for r in range(rounds)))
+        result = summarize(total, elapsed, proc.pid, latencies, cpu)
+    finally:
+        stop_server(proc)
+        shutil.rmtree(path, ignore_errors=True)
+    return result
+
+def make_listing(folder, files):
+    # 在 listing 子目录中建立 files 个 1 字节的文件
+    path = os.path.join(folder, 'listing')
+    os.makedirs(path, exist_ok=True)
+    for i in range(files):
+        with open(os.path.join(path, f'file_{i:07d}.txt'), 'wb') as f:
+            f.write(b'x')
+
+def bench_listing(folder, clients, rounds):
+    # 完整列表、分页浏览 listing 目录、带 If-None-Match 的轮询（304）和增量列表（?since=）
+    proc, port = start_server(folder, ('--no-access-log',))
+    try:
+        # 第一次请求会等待服务器建立索引，不计入测量
+        status, resp, body = fetch(port, '/files')
+        if status != 200:
+            raise RuntimeError(f'列表失败: HTTP {status}')
+        etag = resp.getheader('ETag')
+        listing = json.loads(fetch(port, '/files?since=0')[2])
+        since = f"/files?since={listing['generation']}&epoch={urllib.parse.quote(str(listing['epoch']))}"
+        results = {}
+
+        def full(i, lat):
+            return sum(len(timed(lat, fetch, port, '/files')[2]) for _ in range(rounds))
+
+        def paged(i, lat):
+            total = 0
+            for _ in range(rounds):
+                cursor = ''
+                while True:
+                    status, resp, body = timed(lat, fetch, port, f'/files?dir=listing&cursor={cursor}')
+                    if status != 200:
+                        raise RuntimeError(f'分页列表失败: HTTP {status}')
+                    total += len(body)
+                    cursor = json.loads(body).get('next_cursor')
+                    if not cursor:
+                        break
+            return total
+
+        def poll(i, lat):
+            for _ in range(rounds * 20):
+                status = timed(lat, fetch, port, '/files', {'If-None-Match': etag})[0]
+                if status != 304:
+                    raise RuntimeError(f'轮询应返回 304，实际为 HTTP {status}')
+            return 0
+
+        def delta(i, lat):
+            return sum(len(timed(lat, fetch, port, since)[2]) for _ in range(rounds * 20))
+
+        for label, func in (('full', full), ('paged', paged), ('poll 304', poll), ('since', delta)):
+            cpu = cpu_seconds(proc.pid)
+            total, elapsed, latencies = run_clients(clients, func)
+            results[label] = summarize(total, elapsed, proc.pid, latencies, cpu)
+    finally:
+        stop_server(proc)
+    return results
+
+def bench_mixed(folder, name, size, clients, rounds):
+    # 客户端按序号轮流承担四种角色：完整下载、区间下载、上传、列表轮询，同时运行
+    proc, port = start_server(folder, ('--no-access-log',))
+    roles = ('download', 'range', 'upload', 'poll')
+    stats = {role: ([], []) for role in roles}
+    try:
+        warm_up(port, name)
+        segment = max(1, size // max(1, clients))
+
+        def client(i, lat):
+            role = roles[i % len(roles)]
+            sizes, latencies = stats[role]
+            for r in range(rounds):
+                if role == 'download':
+                    sizes.append(timed(latencies, download, port, f'/download/{name}'))
+                elif role == 'range':
+                    start = (i * segment + r * 4096) % size
+                    end = min(size, start + segment) - 1
+                    sizes.append(timed(latencies, download, port, f'/download/{name}',
+                                       {'Range': f'bytes={start}-{end}'}))
+                elif role == 'upload':
+                    sizes.append(timed(latencies, upload, port, f'mixed/up_{i}_{r}.bin', max(1, size // 4)))
+                else:
+                    for _ in range(20):
+                        timed(latencies, fetch, port, '/files')
+                        time.sleep(0.05)
+            return 0
+
+        cpu = cpu_seconds(proc.pid)
+        _, elapsed, _ = run_clients(clients, client)
+        results = {role: summarize(sum(sizes), elapsed, proc.pid, latencies, cpu)
+                   for role, (sizes, latencies) in stats.items() if latencies}
+    finally:
+        stop_server(proc)
+    return results
+
+def format_row(label, result):
+    rss = f"{result['peak_rss_mb']:.1f}" if result['peak_rss_mb'] else 'n/a'
+    cpu = f"{result['cpu_seconds']:.2f}" if result['cpu_seconds'] is not None else 'n/a'
+    p50 = f"{result['p50_ms']:.1f}" if result['p50_ms'] is not None else 'n/a'
+    p99 = f"{result['p99_ms']:.1f}" if result['p99_ms'] is not None else 'n/a'
+    return (f"{label:<12}{result['mb_per_s']:>12.1f}{result['requests_per_s']:>10.1f}"
+            f"{p50:>10}{p99:>10}{rss:>14}{cpu:>10}")
+
+HEADER = (f"{'方式':<12}{'吞吐 MB/s':>12}{'请求/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'峰值RSS MB':>14}{'CPU 秒':>10}")
+
+def run_info(args):
+    # 记录运行环境，便于比较不同提交的结果
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(SCRIPT),
+                                capture_output=True, text=True).stdout.strip() or None
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    cwd=os.path.dirname(SCRIPT), capture_output=True, text=True).stdout.strip())
+    except OSError:
+        commit, dirty = None, None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'dirty': dirty,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': vars(args)
+    }
+
+def main():
+    global SERVER_ARGS
+    parser = argparse.ArgumentParser(description='localshare 性能测试')
+    parser.add_argument('scenario', nargs='?', default='download',
+                        choices=['download', 'ranges', 'workers', 'upload', 'listing', 'mixed', 'writes', 'all'],
+                        help='测试场景')
+    parser.add_argument('--size-mb', type=int, default=512, help='测试文件大小 (MB)')
+    parser.add_argument('--clients', type=int, default=4, help='并发客户端/连接数')
+    parser.add_argument('--rounds', type=int, default=2, help='每个客户端重复的次数')
+    parser.add_argument('--workers', default='1,2,4,8,16,32', help='逗号分隔的工作线程数（workers 场景）')
+    parser.add_argument('--files', type=int, default=10000, help='小文件上传和列表场景的文件数')
+    parser.add_argument('--file-kb', type=int, default=64, help='小文件上传场景每个文件的大小 (KB)')
+    parser.add_argument('--server-args', default='', help='附加给服务器的命令行参数，例如 "--server dev --no-sendfile"')
+    parser.add_argument('--json', help='把结果写入该 JSON 文件')
+    args = parser.parse_args()
+    SERVER_ARGS = shlex.split(args.server_args)
+    scenarios = ['download', 'ranges', 'workers', 'upload', 'listing', 'mixed', 'writes'] if args.scenario == 'all' \
+        else [args.scenario]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        name = 'bench.bin'
+        size = args.size_mb * 1024 * 1024
+        make_file(os.path.join(folder, name), size)
+        for scenario in scenarios:
+            rows = results[scenario] = {}
+            if scenario == 'download':
+                print(f"文件 {args.size_mb} MB，{args.clients} 个并发客户端，每个下载 {args.rounds} 次")
+                print(HEADER)
+                for label, extra in (('sendfile', ()), ('generator', ('--no-sendfile',))):
+                    rows[label] = bench_download(folder, name, args.clients, args.rounds, extra)
+                    print(format_row(label, rows[label]))
+            elif scenario == 'workers':
+                print(f"文件 {args.size_mb} MB，{args.clients} 个并发客户端；上传每个 {args.size_mb / 4:g} MB")
+                print(f"{'线程数':<8}{'下载 MB/s':>12}{'上传 MB/s':>12}{'峰值RSS MB':>14}")
+                for workers in [int(w) for w in args.workers.split(',')]:
+                    down, up = bench_workers(folder, name, size, args.clients, workers)
+                    rows[str(workers)] = {'download': down, 'upload': up}
+                    rss = f"{up['peak_rss_mb']:.1f}" if up['peak_rss_mb'] else 'n/a'
+                    print(f"{workers:<8}{down['mb_per_s']:>12.1f}{up['mb_per_s']:>12.1f}{rss:>14}")
+            elif scenario == 'ranges':
+                print(f"文件 {args.size_mb} MB，单连接与 {args.clients} 个并行区间连接对比")
+                print(HEADER)
+                for connections in sorted({1, args.clients}):
+                    label = f'{connections} 连接'
+                    rows[label] = bench_ranges(folder, name, size, connections)
+                    print(format_row(label, rows[label]))
+            elif scenario == 'upload':
+                print(f"{args.clients} 个并发客户端：每个上传 {args.rounds} 个 {args.size_mb} MB 文件；"
+                      f"{args.files} 个 {args.file_kb} KB 小文件每 {SMALL_BATCH} 个一批")
+                print(HEADER)
+                rows['large'], rows['small'] = bench_upload(folder, size, args.clients, args.rounds,
+                                                            args.files, args.file_kb * 1024)
+                for label in ('large', 'small'):
+                    print(format_row(label, rows[label]))
+            elif scenario == 'listing':
+                print(f"目录中 {args.files} 个文件，{args.clients} 个并发客户端")
+                make_listing(folder, args.files)
+                print(HEADER)
+                rows.update(bench_listing(folder, args.clients, args.rounds))
+                for label, result in rows.items():
+                    print(format_row(label, result))
+            elif scenario == 'writes':
+                print(f"{args.clients} 个并发客户端，每个上传 {args.rounds} 个 {args.size_mb} MB 文件")
+                print(HEADER)
+                for label, extra in WRITE_MODES:
+                    rows[label] = bench_writes(folder, size, args.clients, args.rounds, extra)
+                    print(format_row(label, rows[label]))
+            else:
+                print(f"文件 {args.size_mb} MB，{args.clients} 个客户端同时下载、区间下载、上传和轮询列表")
+                print(HEADER)
+                rows.update(bench_mixed(folder, name, size, args.clients, args.rounds))
+                for label, result in rows.items():
+                    print(format_row(label, result))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({**run_info(args), 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+if __name__ == '__main__':
+    main()
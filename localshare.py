@@ -1,197 +1,3699 @@
-from flask import Flask, request, send_file, jsonify, render_template_string, Response
+from flask import Flask, request, send_file, jsonify, Response
 import os
+import sys
 import time
+import json
+import base64
+import bisect
+import heapq
+import datetime
+import collections
 import socket
+import selectors
+import struct
 import hashlib
+import shutil
+import subprocess
+import argparse
+import functools
+import concurrent.futures
+import threading
+import mimetypes
+import zlib
+import zipfile
 import urllib.parse
+import http.client
+from stat import S_ISREG
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import http_date, quote_etag
+from werkzeug.sansio.multipart import MultipartDecoder, Data, Epilogue, Field, File, NeedData
+
+# 可选的压缩库：安装后下载可协商 zstd / br 编码
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+# 可选的预览工具：Pillow 生成图片缩略图，ffmpeg 截取视频第一帧（没有 Pillow 时也用于图片）
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+FFMPEG = shutil.which('ffmpeg')
 
 app = Flask(__name__)
 
-def get_local_ip():
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+# 本机各网卡的 IPv4 地址，不依赖外部地址或默认路由（离线网络中也能立即返回）。
+# Linux 上逐个网卡用 ioctl(SIOCGIFADDR) 查询，其他平台解析本机主机名
+def local_addresses():
+    addresses = []
     try:
-        s.connect(('8.8.8.8', 80))
-        ip = s.getsockname()[0]
-    finally:
-        s.close()
-    return ip
+        import fcntl
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            for _, name in socket.if_nameindex():
+                try:
+                    ifreq = fcntl.ioctl(s.fileno(), 0x8915, struct.pack('256s', name.encode()[:15]))
+                except OSError:
+                    # 网卡没有 IPv4 地址
+                    continue
+                addresses.append(socket.inet_ntoa(ifreq[20:24]))
+    except (ImportError, AttributeError, OSError):
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+                addresses.append(info[4][0])
+        except OSError:
+            pass
+    # 回环地址放在最后
+    addresses = sorted(set(addresses), key=lambda ip: (ip.startswith('127.'), socket.inet_aton(ip)))
+    if not any(ip.startswith('127.') for ip in addresses):
+        addresses.append('127.0.0.1')
+    return addresses
 
 # 配置文件上传目录
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-# 扫描本地文件
-def scan_local_files():
-    files = []
-    try:
-        for filename in os.listdir(UPLOAD_FOLDER):
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            if os.path.isfile(file_path):
-                # 获取文件信息
-                stat = os.stat(file_path)
-                files.append({
-                    'id': filename,
-                    'name': filename,
-                    'path': file_path,
-                    'size': stat.st_size,
-                    'timestamp': int(stat.st_mtime * 1000),
-                    'exists': True
-                })
-    except Exception as e:
-        print(f"扫描本地文件失败: {e}")
-    return files
+# 未启用 inotify 时，两次目录 mtime 检查之间的最短间隔（秒）
+MTIME_CHECK_INTERVAL = 1.0
+# 保留的最近变更条数，更早的 since 游标会退回完整列表
+CHANGE_LOG_SIZE = 10000
+# 目录浏览：每页默认条数、单页上限及支持的排序方式
+LIST_PAGE_SIZE = 200
+LIST_PAGE_MAX = 1000
+LIST_SORTS = ('time', 'name', 'size')
+# 搜索结果每页默认条数
+SEARCH_PAGE_SIZE = 50
+# 候选文件不超过该数量时整体排序并给出准确总数；更多时按排序顺序遍历，取满一页即停止
+SEARCH_SORT_LIMIT = 5000
+# SSE 事件推送端口，None 表示使用 HTTP 端口 + 1，0 表示不启用
+EVENTS_PORT = None
+# SSE 心跳间隔（秒），用于保持连接并发现已断开的订阅者
+SSE_HEARTBEAT = 15
+# 单个订阅者允许积压的最大字节数，超过后断开，由浏览器重连并补齐
+SSE_MAX_BACKLOG = 1024 * 1024
+# 下载时优先使用服务器的 wsgi.file_wrapper（内置服务器上为 sendfile 零拷贝）
+SENDFILE_ENABLED = True
+# 上传目录中存放内部状态（分块上传会话等）的隐藏目录，不出现在文件列表中
+STATE_DIR_NAME = '.localshare'
+# 分块上传的默认块大小及客户端可请求的范围
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_CHUNK_MIN = 1024 * 1024
+UPLOAD_CHUNK_MAX = 64 * 1024 * 1024
+# 未完成的分块上传会话保留时间（秒），过期后由后台线程清理（启动时也检查一次）
+UPLOAD_SESSION_TTL = 7 * 24 * 3600
+# multipart 上传每次从连接读取的字节数
+UPLOAD_READ_SIZE = 4 * 1024 * 1024
+# 单个 multipart 请求允许的最大部分数
+UPLOAD_MAX_PARTS = 10000
+# multipart 上传的写盘队列上限（字节）：网络接收与写盘在两个线程中同时进行，0 为在请求线程中同步写入
+WRITE_BEHIND_BYTES = 32 * 1024 * 1024
+# 上传文件的持久化方式：none 交给操作系统回写；commit 在发布前 fsync 文件、发布后 fsync 目录；
+# periodic 由后台线程每 SYNC_INTERVAL 秒 fsync 一次期间写入或发布的文件，断电最多丢失这段时间的数据
+DURABILITY = 'none'
+DURABILITY_MODES = ('none', 'commit', 'periodic')
+SYNC_INTERVAL = 5
+# multipart 上传的大文件边收边预分配：每次最多领先已收到的数据 PREALLOCATE_AHEAD 字节（且不超过已收到的量），
+# 声明了很大的 Content-Length 却不发送数据的请求不会占用磁盘
+PREALLOCATE_AHEAD = 64 * 1024 * 1024
+# 按内容去重：上传文件按 SHA-256 存入 .localshare/blobs，重复内容只保存一份（硬链接）
+DEDUP_ENABLED = True
+# 删除文件后延迟多久清理不再被引用的 blob（秒）
+BLOB_GC_DELAY = 10
+# 存储配额：上传目录中文件的总大小上限和单个文件大小上限（字节），0 为不限；上传前检查
+QUOTA_TOTAL = 0
+QUOTA_FILE = 0
+# 上传文件的默认保留时间（秒），0 为永久；上传时可用 ttl 参数单独指定
+FILE_TTL = 0
+# 总大小超过配额的该比例时，后台按最近下载时间淘汰文件，直到降到低水位以下
+REAPER_HIGH_WATER = 0.9
+REAPER_LOW_WATER = 0.8
+# 后台清理的检查间隔（秒）及线程优先级（nice 值）
+REAPER_INTERVAL = 60
+REAPER_NICE = 19
+# 下载时摘要缓存未命中的文件，不超过该大小时同步计算，否则在后台计算并暂用弱 ETag
+HASH_SYNC_LIMIT = 64 * 1024 * 1024
+# 摘要缓存最多保存的条目数
+HASH_CACHE_MAX = 200000
+# 分块摘要清单：计算文件摘要时同时按固定大小分块计算各块的 SHA-256，供 fetch 客户端并行下载并逐块校验
+MANIFEST_ENABLED = True
+MANIFEST_CHUNK_SIZE = 4 * 1024 * 1024
+# 清单缓存（.localshare/manifests）的大小上限，超过时删除最久未使用的
+MANIFEST_CACHE_MAX = 64 * 1024 * 1024
+# fetch 客户端的默认并行连接数及每块的最大重试次数
+FETCH_CONNECTIONS = 4
+FETCH_RETRIES = 8
+# 发现局域网中的其他实例：定期向 DISCOVERY_PORT 发送 UDP 广播和组播（组播经回环也能送达，便于同机多实例）
+DISCOVERY_ENABLED = True
+DISCOVERY_PORT = 50505
+DISCOVERY_GROUP = '239.255.77.77'
+DISCOVERY_INTERVAL = 5
+# 同步其他实例文件列表的间隔（秒）；超过 PEER_TIMEOUT 秒没有音讯的实例移出列表
+PEER_SYNC_INTERVAL = 5
+PEER_TIMEOUT = 30
+# 在后台把其他实例上本机没有的文件镜像过来；速率上限（字节/秒，0 为不限）及每个文件的并行连接数
+MIRROR_ENABLED = False
+MIRROR_RATE_LIMIT = 0
+MIRROR_CONNECTIONS = 2
+# 单个 Range 请求最多接受的区间数，超过时忽略 Range 返回完整文件
+MAX_RANGES = 64
+# 服务模式：threaded 为内置线程池服务器，dev 为 Flask 开发服务器，waitress 需另行安装
+SERVER_MODE = 'threaded'
+# 线程池大小，即同时处理的请求数
+SERVER_WORKERS = 32
+# 最多同时保持的连接数，达到后暂停 accept，由内核监听队列形成背压
+SERVER_MAX_CONNECTIONS = 256
+# 监听队列长度
+SERVER_BACKLOG = 512
+# 连接 socket 的发送/接收缓冲区大小（字节），0 表示使用系统默认值
+SOCKET_SNDBUF = 0
+SOCKET_RCVBUF = 0
+# 单次 socket 读写的超时时间（秒）
+REQUEST_TIMEOUT = 60
+# 是否逐条输出访问日志
+ACCESS_LOG = True
+# 下载压缩：只压缩可压缩类型且不小于该大小的文件
+COMPRESS_ENABLED = True
+COMPRESS_MIN_SIZE = 1024
+# 压缩结果缓存目录的大小上限，超过后按最近使用时间淘汰
+COMPRESS_CACHE_MAX = 1024 * 1024 * 1024
+# 打包下载时可压缩文件使用的 DEFLATE 级别
+ZIP_COMPRESS_LEVEL = 6
+# 预览：缩略图最长边像素，后台生成线程数（限制预览占用的 CPU）及其 nice 值，
+# 排队上限（超出的文件在首次请求预览时再生成）和磁盘缓存上限
+THUMB_ENABLED = True
+THUMB_SIZE = 256
+THUMB_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+THUMB_NICE = 10
+THUMB_QUEUE_MAX = 1000
+THUMB_CACHE_MAX = 256 * 1024 * 1024
+# 超过该大小的图片不生成缩略图
+THUMB_IMAGE_MAX = 64 * 1024 * 1024
+# 文本预览取开头的行数和最多读取的字节数
+THUMB_TEXT_LINES = 20
+THUMB_TEXT_BYTES = 4096
+# 请求预览时等待生成的最长时间（秒）
+THUMB_WAIT = 10
+# 限速（字节/秒，0 为不限）：全部下载/上传合计的总速率，以及单个客户端的速率。
+# 运行中可通过本机访问 /admin/limits 修改
+RATE_LIMIT_DOWN = 0
+RATE_LIMIT_UP = 0
+CLIENT_RATE_LIMIT_DOWN = 0
+CLIENT_RATE_LIMIT_UP = 0
+# 令牌桶允许的突发量（按速率计的秒数）
+RATE_BURST = 0.1
+# 首页的浏览器缓存时间（秒）；过期后凭 ETag 重新验证，页面未变时返回 304
+INDEX_MAX_AGE = 86400
+# 在 /metrics 输出 Prometheus 格式的统计；关闭后热路径上只剩一次全局变量判断
+METRICS_ENABLED = True
+# /transfers 中保留的最近完成的传输数
+TRANSFER_HISTORY = 100
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+def join_path(folder, name):
+    return f'{folder}/{name}' if folder else name
+
+# 文件 id 是相对上传目录、以 / 分隔的路径；name 为最后一段，dir 为所在目录（根目录为空串）
+def file_info(folder, filename, stat):
+    parent, _, name = filename.rpartition('/')
+    return {
+        'id': filename,
+        'name': name,
+        'dir': parent,
+        'type': 'file',
+        'path': os.path.join(folder, filename),
+        'size': stat.st_size,
+        'timestamp': int(stat.st_mtime * 1000),
+        'exists': True
+    }
+
+def dir_info(path, node):
+    parent, _, name = path.rpartition('/')
+    return {
+        'id': path,
+        'name': name,
+        'dir': parent,
+        'type': 'dir',
+        'items': len(node.files) + len(node.subdirs)
+    }
+
+# 目录页的排序键：子目录排在文件之前并按名称排序；文件按所选字段排序，相同时按名称
+def entry_sort_key(sort, name, info=None):
+    if info is None:
+        return (0, name.casefold(), name)
+    if sort == 'time':
+        return (1, -info['timestamp'], name)
+    if sort == 'size':
+        return (1, -info['size'], name)
+    return (1, name.casefold(), name)
+
+# 索引中的一个目录：每种排序方式各维护一个有序的子项键列表，分页时直接二分定位
+class DirNode:
+    def __init__(self):
+        self.files = set()
+        self.subdirs = set()
+        self.keys = {sort: [] for sort in LIST_SORTS}
+        self.mtime = None
+
+    def insert(self, name, info=None):
+        for sort, keys in self.keys.items():
+            bisect.insort(keys, entry_sort_key(sort, name, info))
+
+    def delete(self, name, info=None):
+        for sort, keys in self.keys.items():
+            key = entry_sort_key(sort, name, info)
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+# 常驻内存的文件索引，维护上传目录树中的全部文件。
+# files/order 是按时间倒序的扁平视图（完整列表和 since 增量使用），dirs 按目录组织（目录浏览使用）。
+# 上传直接更新索引；目录外部的改动通过 inotify（可用时）
+# 或节流的目录 mtime 检查发现，/files 只从索引读取，不访问文件系统。
+class FileIndex:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.files = {}          # 相对路径 -> 文件信息
+        self.order = []          # (-timestamp, 相对路径)，始终有序
+        self.dirs = {'': DirNode()}
+        self.dirty = True
+        self.last_check = 0
+        self.watching = False
+        self.listing_json = None
+        # 列表代数：每次增删递增；epoch 区分不同进程，避免重启后游标混淆
+        self.epoch = os.urandom(4).hex()
+        self.generation = 0
+        self.changes = collections.deque(maxlen=CHANGE_LOG_SIZE)
+        # 去重时链接到已有内容的文件与其他同内容文件共用 inode，修改时间也共用，
+        # 它们的发布时间（毫秒）单独记录并保存在 .localshare/timestamps.json
+        self.timestamps = {}
+        self.timestamps_lock = threading.Lock()
+        # 变更回调，在持有锁时调用，必须立即返回
+        self.listeners = []
+
+    def hidden(self, path):
+        return path.split('/', 1)[0] == STATE_DIR_NAME
+
+    def local_path(self, path):
+        return os.path.join(self.folder, path) if path else self.folder
+
+    def _sort_key(self, info):
+        return (-info['timestamp'], info['id'])
+
+    def _insert(self, info):
+        name = info['id']
+        old = self.files.get(name)
+        if old is not None:
+            if old['size'] == info['size'] and old['timestamp'] == info['timestamp']:
+                return False
+            self._remove(name)
+        self._ensure_dir(info['dir'])
+        self.files[name] = info
+        bisect.insort(self.order, self._sort_key(info))
+        node = self.dirs[info['dir']]
+        node.files.add(info['name'])
+        node.insert(info['name'], info)
+        return True
+
+    def _remove(self, name):
+        info = self.files.pop(name, None)
+        if info is None:
+            return False
+        key = self._sort_key(info)
+        i = bisect.bisect_left(self.order, key)
+        if i < len(self.order) and self.order[i] == key:
+            del self.order[i]
+        node = self.dirs[info['dir']]
+        node.files.discard(info['name'])
+        node.delete(info['name'], info)
+        return True
+
+    def _ensure_dir(self, path):
+        if path in self.dirs:
+            return
+        parent, _, name = path.rpartition('/')
+        self._ensure_dir(parent)
+        # 同名文件已被目录取代
+        if self._remove(path):
+            self._changed('remove', path, None)
+        node = self.dirs[path] = DirNode()
+        self.dirs[parent].subdirs.add(name)
+        self.dirs[parent].insert(name)
+        self._changed('mkdir', path, dir_info(path, node))
+
+    def _remove_dir(self, path):
+        node = self.dirs.get(path)
+        if node is None or not path:
+            return
+        for name in list(node.subdirs):
+            self._remove_dir(join_path(path, name))
+        for name in list(node.files):
+            child = join_path(path, name)
+            self._remove(child)
+            self._changed('remove', child, None)
+        del self.dirs[path]
+        parent, _, name = path.rpartition('/')
+        self.dirs[parent].subdirs.discard(name)
+        self.dirs[parent].delete(name)
+        self._changed('rmdir', path, None)
+
+    def _changed(self, op, name, info):
+        self.listing_json = None
+        self.generation += 1
+        self.changes.append((self.generation, op, name, info))
+        for listener in self.listeners:
+            listener(self.generation, op, name, info)
+
+    def add(self, filename):
+        if self.hidden(filename):
+            return
+        try:
+            stat = os.stat(self.local_path(filename))
+        except OSError:
+            self.remove(filename)
+            return
+        if not S_ISREG(stat.st_mode):
+            return
+        info = file_info(self.folder, filename, stat)
+        # 内容在发布之后被修改过时以修改时间为准
+        published = self.timestamps.get(filename)
+        if published is not None and published > info['timestamp']:
+            info['timestamp'] = published
+        with self.lock:
+            if self._insert(info):
+                self._changed('add', filename, info)
+
+    def remove(self, filename):
+        with self.lock:
+            self.timestamps.pop(filename, None)
+            if self._remove(filename):
+                self._changed('remove', filename, None)
+
+    def load_timestamps(self):
+        try:
+            with open(os.path.join(self.folder, STATE_DIR_NAME, 'timestamps.json'), encoding='utf-8') as f:
+                self.timestamps.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"读取发布时间失败: {e}")
+
+    def set_timestamp(self, filename, timestamp):
+        with self.lock:
+            self.timestamps[filename] = int(timestamp * 1000)
+            data = dict(self.timestamps)
+        with self.timestamps_lock:
+            path = os.path.join(self.folder, STATE_DIR_NAME, 'timestamps.json')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(f'{path}.tmp', path)
+        self.add(filename)
+
+    def add_dir(self, path):
+        if self.hidden(path):
+            return
+        with self.lock:
+            self._ensure_dir(path)
+
+    def remove_dir(self, path):
+        # 目录被删除或移走时，其下所有文件和子目录一并移出索引
+        with self.lock:
+            self._remove_dir(path)
+
+    def subtree(self, path):
+        with self.lock:
+            result = []
+            pending = [path] if path in self.dirs else []
+            while pending:
+                current = pending.pop()
+                result.append(current)
+                pending.extend(join_path(current, name) for name in self.dirs[current].subdirs)
+            return result
+
+    def rescan(self, path=''):
+        # 逐个比较目录的 mtime，只重新列出有变化的目录；已在索引中的文件不再 stat
+        pending = [path]
+        dirty = False
+        while pending:
+            current = pending.pop()
+            try:
+                dir_mtime = os.stat(self.local_path(current)).st_mtime_ns
+            except OSError as e:
+                if current:
+                    self.remove_dir(current)
+                else:
+                    print(f"扫描本地文件失败: {e}")
+                continue
+            with self.lock:
+                node = self.dirs.get(current)
+                if node is not None and node.mtime == dir_mtime:
+                    pending.extend(join_path(current, name) for name in node.subdirs)
+                    continue
+            files = set()
+            subdirs = set()
+            try:
+                with os.scandir(self.local_path(current)) as entries:
+                    for entry in entries:
+                        if not current and entry.name == STATE_DIR_NAME:
+                            continue
+                        # 不跟随指向目录的符号链接，避免循环和越出上传目录
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.add(entry.name)
+                        else:
+                            files.add(entry.name)
+            except OSError as e:
+                print(f"扫描本地文件失败: {e}")
+                continue
+            self.add_dir(current)
+            with self.lock:
+                node = self.dirs[current]
+                known_files = set(node.files)
+                known_dirs = set(node.subdirs)
+            for name in known_dirs - subdirs:
+                self.remove_dir(join_path(current, name))
+            for name in known_files - files:
+                self.remove(join_path(current, name))
+            for name in files - known_files:
+                self.add(join_path(current, name))
+            for name in subdirs:
+                self.add_dir(join_path(current, name))
+                pending.append(join_path(current, name))
+            with self.lock:
+                node = self.dirs.get(current)
+                if node is not None:
+                    # 粗粒度时间戳的文件系统上，刚发生的改动可能与扫描落在同一个 mtime 内
+                    if time.time() - dir_mtime / 1e9 > 2:
+                        node.mtime = dir_mtime
+                    else:
+                        node.mtime = None
+                        dirty = True
+        self.dirty = dirty or (self.dirty and bool(path))
+        self.last_check = time.monotonic()
+
+    def refresh(self):
+        if self.watching:
+            return
+        if not self.dirty and time.monotonic() - self.last_check < MTIME_CHECK_INTERVAL:
+            return
+        self.last_check = time.monotonic()
+        self.rescan()
+
+    def etag(self):
+        return f'"{self.epoch}-{self.generation}"'
+
+    def listing(self):
+        # 返回 (JSON 字节, 代数)，两者取自同一时刻的索引
+        self.refresh()
+        with self.lock:
+            if self.listing_json is None:
+                files = [self.files[name] for _, name in self.order]
+                self.listing_json = json.dumps(files, ensure_ascii=False).encode('utf-8')
+            return self.listing_json, self.generation
+
+    def page(self, path, sort, after=None, limit=LIST_PAGE_SIZE):
+        # 返回目录中排在 after（上一页最后一项的排序键）之后的 limit 项；目录不存在时返回 None
+        self.refresh()
+        with self.lock:
+            node = self.dirs.get(path)
+            if node is None:
+                return None
+            keys = node.keys[sort]
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            chunk = keys[start:start + limit]
+            items = []
+            for key in chunk:
+                child = join_path(path, key[2])
+                items.append(dir_info(child, self.dirs[child]) if key[0] == 0 else self.files[child])
+            return {
+                'epoch': self.epoch,
+                'generation': self.generation,
+                'dir': path,
+                'sort': sort,
+                'total': len(keys),
+                'items': items,
+                'next': chunk[-1] if start + limit < len(keys) else None
+            }
+
+    def _collect(self, path, result):
+        for key in self.dirs[path].keys['name']:
+            child = join_path(path, key[2])
+            if key[0] == 0:
+                self._collect(child, result)
+            else:
+                result[child] = None
+
+    def select(self, names):
+        # 把文件和目录展开为文件列表（目录包含其下全部文件），按给定顺序去重；
+        # 不存在的名称忽略，未指定时返回全部文件
+        self.refresh()
+        with self.lock:
+            if not names:
+                return [name for _, name in self.order]
+            result = {}
+            for name in names:
+                if name in self.files:
+                    result[name] = None
+                elif name in self.dirs:
+                    self._collect(name, result)
+            return list(result)
+
+    def delta(self, since):
+        # 返回 since 之后新增/删除的文件；变更日志已不覆盖该游标时返回 None
+        self.refresh()
+        with self.lock:
+            if since > self.generation:
+                return None
+            if since < self.generation and (not self.changes or self.changes[0][0] > since + 1):
+                return None
+            latest = {}
+            touched = set()
+            for generation, op, name, info in reversed(self.changes):
+                if generation <= since:
+                    break
+                if op in ('add', 'remove'):
+                    latest.setdefault(name, (op, info))
+                else:
+                    touched.add(name)
+                touched.add(name.rpartition('/')[0])
+            added = [info for op, info in latest.values() if op == 'add']
+            added.sort(key=self._sort_key)
+            removed = [name for name, (op, _) in latest.items() if op == 'remove']
+            # 子项有变化的目录的当前信息（已删除的为 null），目录浏览据此更新子目录条目
+            dirs = {path: dir_info(path, self.dirs[path]) if path in self.dirs else None for path in touched}
+            return {
+                'epoch': self.epoch,
+                'generation': self.generation,
+                'full': False,
+                'added': added,
+                'removed': removed,
+                'dirs': dirs
+            }
+
+    def start(self):
+        self.load_timestamps()
+        self.rescan()
+        self.watching = start_inotify_watcher(self)
+
+# 每个目录一个 inotify 监视；新建或移入的目录随即加入监视并扫描，删除或移出的目录整棵移出索引。
+# 监视数达到上限（fs.inotify.max_user_watches）时停止监视，退回目录 mtime 检查
+def start_inotify_watcher(index):
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            return False
+    except (OSError, AttributeError) as e:
+        print(f"inotify 不可用，改用目录 mtime 检查: {e}")
+        return False
+    mask = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+    watches = {}         # 监视描述符 -> 目录相对路径
+
+    def add_watch(path):
+        wd = libc.inotify_add_watch(fd, os.fsencode(index.local_path(path)), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'无法监视目录 {path or "/"}: {os.strerror(errno)}')
+        watches[wd] = path
+
+    def watch_tree(path):
+        # 先扫描再加监视，之后再扫描一遍，补上加监视之前发生的改动，直到没有新目录出现
+        watched = set()
+        while True:
+            index.rescan(path)
+            added = [d for d in index.subtree(path) if d not in watched]
+            if not added:
+                return
+            for d in added:
+                add_watch(d)
+                watched.add(d)
+
+    def unwatch_tree(path):
+        prefix = path + '/'
+        for wd, watched in list(watches.items()):
+            if watched == path or watched.startswith(prefix):
+                del watches[wd]
+                libc.inotify_rm_watch(fd, wd)
+
+    try:
+        watch_tree('')
+    except OSError as e:
+        print(f"inotify 不可用，改用目录 mtime 检查: {e}")
+        os.close(fd)
+        return False
+
+    def watch():
+        header = struct.Struct('iIII')
+        try:
+            while True:
+                data = os.read(fd, 64 * 1024)
+                pos = 0
+                while pos < len(data):
+                    wd, event_mask, _, length = header.unpack_from(data, pos)
+                    name = data[pos + header.size:pos + header.size + length].rstrip(b'\0')
+                    pos += header.size + length
+                    if event_mask & IN_Q_OVERFLOW:
+                        watch_tree('')
+                        continue
+                    folder = watches.get(wd)
+                    if folder is None:
+                        continue
+                    if event_mask & (IN_DELETE_SELF | IN_IGNORED):
+                        if not folder:
+                            raise OSError('上传目录已被删除或移动')
+                        if event_mask & IN_IGNORED:
+                            del watches[wd]
+                        continue
+                    if not name:
+                        continue
+                    path = join_path(folder, os.fsdecode(name))
+                    if index.hidden(path):
+                        continue
+                    if event_mask & IN_ISDIR:
+                        if event_mask & (IN_DELETE | IN_MOVED_FROM):
+                            unwatch_tree(path)
+                            index.remove_dir(path)
+                        elif event_mask & (IN_CREATE | IN_MOVED_TO):
+                            watch_tree(path)
+                    elif event_mask & (IN_DELETE | IN_MOVED_FROM):
+                        index.remove(path)
+                    else:
+                        index.add(path)
+        except OSError as e:
+            print(f"文件监视已停止，改用目录 mtime 检查: {e}")
+        finally:
+            index.watching = False
+            os.close(fd)
+
+    threading.Thread(target=watch, name='inotify-watcher', daemon=True).start()
+    return True
+
+file_index = FileIndex(UPLOAD_FOLDER)
+
+# SSE 事件推送：单个 selectors 线程管理全部订阅连接，
+# 数百个空闲订阅者不会各自占用一个 Flask 工作线程。
+class EventHub:
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.clients = {}        # socket -> {'request': bytearray, 'buffer': bytearray, 'ready': bool}
+        self.pending = collections.deque()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.listener = None
+        self.port = None
+
+    def start(self, host, port):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(128)
+        listener.setblocking(False)
+        self.listener = listener
+        self.port = listener.getsockname()[1]
+        self.selector.register(listener, selectors.EVENT_READ, 'accept')
+        self.selector.register(self.wake_r, selectors.EVENT_READ, 'wake')
+        threading.Thread(target=self._loop, name='event-hub', daemon=True).start()
+
+    def publish(self, event, data):
+        if self.listener is None:
+            return
+        payload = json.dumps(data, ensure_ascii=False)
+        self.pending.append(f'event: {event}\ndata: {payload}\n\n'.encode('utf-8'))
+        try:
+            self.wake_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _loop(self):
+        last_heartbeat = time.monotonic()
+        while True:
+            timeout = max(0, last_heartbeat + SSE_HEARTBEAT - time.monotonic())
+            for key, mask in self.selector.select(timeout):
+                if key.data == 'accept':
+                    self._accept()
+                elif key.data == 'wake':
+                    self._broadcast()
+                elif key.fileobj in self.clients:
+                    if mask & selectors.EVENT_READ:
+                        self._read(key.fileobj)
+                    if mask & selectors.EVENT_WRITE and key.fileobj in self.clients:
+                        self._flush(key.fileobj)
+            if time.monotonic() - last_heartbeat >= SSE_HEARTBEAT:
+                last_heartbeat = time.monotonic()
+                self._send_all(b': ping\n\n')
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"事件连接接受失败: {e}")
+                return
+            conn.setblocking(False)
+            self.clients[conn] = {'request': bytearray(), 'buffer': bytearray(), 'ready': False}
+            self.selector.register(conn, selectors.EVENT_READ, 'client')
+
+    def _read(self, conn):
+        try:
+            data = conn.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        client = self.clients[conn]
+        if client['ready']:
+            return
+        client['request'] += data
+        if b'\r\n\r\n' not in client['request']:
+            if len(client['request']) > 8192:
+                self._close(conn)
+            return
+        request_line = bytes(client['request']).split(b'\r\n', 1)[0].decode('latin-1')
+        method, _, rest = request_line.partition(' ')
+        path = rest.split(' ', 1)[0].split('?', 1)[0]
+        cors = ('Access-Control-Allow-Origin: *\r\n'
+                'Access-Control-Allow-Headers: Last-Event-ID, Cache-Control\r\n')
+        if method == 'OPTIONS':
+            self._respond_and_close(conn, f'HTTP/1.1 204 No Content\r\n{cors}Content-Length: 0\r\n\r\n')
+        elif method != 'GET' or path != '/events':
+            self._respond_and_close(conn, 'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+        else:
+            client['ready'] = True
+            client['request'] = None
+            head = ('HTTP/1.1 200 OK\r\n'
+                    'Content-Type: text/event-stream; charset=utf-8\r\n'
+                    'Cache-Control: no-cache\r\n'
+                    f'{cors}'
+                    'Connection: keep-alive\r\n\r\n'
+                    'retry: 3000\n\n')
+            self._queue(conn, head.encode('utf-8'))
+
+    def _respond_and_close(self, conn, response):
+        try:
+            conn.send(response.encode('latin-1'))
+        except OSError:
+            pass
+        self._close(conn)
+
+    def _broadcast(self):
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self.pending:
+            self._send_all(self.pending.popleft())
+
+    def _send_all(self, message):
+        for conn, client in list(self.clients.items()):
+            if client['ready']:
+                self._queue(conn, message)
+
+    def _queue(self, conn, message):
+        client = self.clients[conn]
+        was_empty = not client['buffer']
+        client['buffer'] += message
+        if len(client['buffer']) > SSE_MAX_BACKLOG:
+            self._close(conn)
+            return
+        if was_empty:
+            self._flush(conn)
+
+    def _flush(self, conn):
+        client = self.clients[conn]
+        try:
+            sent = conn.send(client['buffer'])
+            del client['buffer'][:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._close(conn)
+            return
+        events = selectors.EVENT_READ
+        if client['buffer']:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(conn, events, 'client')
+
+    def _close(self, conn):
+        if self.clients.pop(conn, None) is not None:
+            self.selector.unregister(conn)
+        conn.close()
+
+event_hub = EventHub()
+
+def publish_file_change(generation, op, name, info):
+    event_hub.publish('change', {
+        'epoch': file_index.epoch,
+        'generation': generation,
+        'op': op,
+        'id': name,
+        'file': info
+    })
+
+file_index.listeners.append(publish_file_change)
+
+def search_sort_key(sort, info):
+    if sort == 'time':
+        return (1, -info['timestamp'], info['id'])
+    if sort == 'size':
+        return (1, -info['size'], info['id'])
+    return (1, info['name'].casefold(), info['id'])
+
+# 文件名搜索索引，随 file_index 的变更增量维护。
+# 文件名（忽略大小写）的每个三字符片段对应包含它的文件集合，
+# 查询词不短于 3 个字符时取各片段集合的交集作为候选，再逐个确认子串匹配；
+# 扩展名单独建索引，大小和时间范围在候选上过滤
+class SearchIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.docs = {}           # 文件 id -> (文件信息, 小写文件名)
+        self.grams = {}          # 三字符片段 -> 文件 id 集合
+        self.exts = {}           # 小写扩展名 -> 文件 id 集合
+        # 各排序方式下的有序键列表；首次查询时才整体排序建立，避免启动扫描时逐个插入
+        self.order = dict.fromkeys(LIST_SORTS)
+
+    def grams_of(self, text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def ext_of(self, name):
+        return os.path.splitext(name)[1][1:].casefold()
+
+    def on_change(self, generation, op, name, info):
+        if op == 'add':
+            self.add(info)
+        elif op == 'remove':
+            self.remove(name)
+
+    def add(self, info):
+        with self.lock:
+            self._remove(info['id'])
+            folded = info['name'].casefold()
+            self.docs[info['id']] = (info, folded)
+            for gram in self.grams_of(folded):
+                self.grams.setdefault(gram, set()).add(info['id'])
+            self.exts.setdefault(self.ext_of(folded), set()).add(info['id'])
+            for sort, keys in self.order.items():
+                if keys is not None:
+                    bisect.insort(keys, search_sort_key(sort, info))
+
+    def remove(self, name):
+        with self.lock:
+            self._remove(name)
+
+    def _remove(self, name):
+        doc = self.docs.pop(name, None)
+        if doc is None:
+            return
+        for gram in self.grams_of(doc[1]):
+            ids = self.grams[gram]
+            ids.discard(name)
+            if not ids:
+                del self.grams[gram]
+        ext = self.ext_of(doc[1])
+        self.exts[ext].discard(name)
+        if not self.exts[ext]:
+            del self.exts[ext]
+        for sort, keys in self.order.items():
+            if keys is None:
+                continue
+            key = search_sort_key(sort, doc[0])
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def _candidates(self, terms, exts):
+        # 返回候选 id 集合；没有可用于缩小范围的条件时返回 None（全部文件）
+        candidates = None
+        for term in terms:
+            if len(term) < 3:
+                continue
+            postings = sorted((self.grams.get(gram, set()) for gram in self.grams_of(term)), key=len)
+            ids = postings[0].intersection(*postings[1:])
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return candidates
+        if exts:
+            ids = set().union(*(self.exts.get(ext, ()) for ext in exts))
+            candidates = ids if candidates is None else candidates & ids
+        return candidates
+
+    def search(self, terms, exts=(), min_size=None, max_size=None, after=None, before=None,
+               folder='', sort='time', cursor=None, limit=SEARCH_PAGE_SIZE):
+        # 返回 (匹配总数, 本页文件, 下一页游标键)；cursor 为上一页最后一项的排序键。
+        # 按排序顺序遍历且提前停止时不知道总数，返回 None
+        prefix = folder + '/' if folder else ''
+
+        def matches(file_id):
+            info, folded = self.docs[file_id]
+            return ((not prefix or file_id.startswith(prefix)) and
+                    (min_size is None or info['size'] >= min_size) and
+                    (max_size is None or info['size'] <= max_size) and
+                    (after is None or info['timestamp'] >= after) and
+                    (before is None or info['timestamp'] < before) and
+                    all(term in folded for term in terms))
+
+        with self.lock:
+            candidates = self._candidates(terms, exts)
+            if candidates is not None and len(candidates) <= SEARCH_SORT_LIMIT:
+                found = [(search_sort_key(sort, self.docs[file_id][0]), self.docs[file_id][0])
+                         for file_id in candidates if matches(file_id)]
+                remaining = [match for match in found if cursor is None or match[0] > cursor]
+                page = heapq.nsmallest(limit + 1, remaining, key=lambda match: match[0])
+                next_key = page[limit - 1][0] if len(page) > limit else None
+                return len(found), [info for _, info in page[:limit]], next_key
+
+            keys = self.order[sort]
+            if keys is None:
+                keys = self.order[sort] = sorted(search_sort_key(sort, info) for info, _ in self.docs.values())
+            i = bisect.bisect_right(keys, cursor) if cursor is not None else 0
+            page = []
+            while i < len(keys) and len(page) <= limit:
+                file_id = keys[i][2]
+                if (candidates is None or file_id in candidates) and matches(file_id):
+                    page.append((keys[i], self.docs[file_id][0]))
+                i += 1
+        if len(page) > limit:
+            return None, [info for _, info in page[:limit]], page[limit - 1][0]
+        return len(page) if cursor is None else None, [info for _, info in page], None
+
+search_index = SearchIndex()
+file_index.listeners.append(search_index.on_change)
+
+# 最简的 Prometheus 指标：counter / gauge / histogram，按标签值元组分别计数。
+# 所有指标共用一把锁，每次更新只是一次字典操作，传输中按块（至少数百 KB）更新
+class Metric:
+    def __init__(self, registry, name, help_text, kind, labels=(), buckets=None):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        registry.metrics.append(self)
+
+    def inc(self, amount=1, labels=()):
+        with self.registry.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def observe(self, value, labels=()):
+        with self.registry.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # 各桶计数（不累积）、总和、次数
+                state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def label_text(self, labels, extra=''):
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labels, labels)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self, lines):
+        lines.append(f'# HELP {self.name} {self.help}')
+        lines.append(f'# TYPE {self.name} {self.kind}')
+        for labels, value in sorted(self.values.items()):
+            if self.kind != 'histogram':
+                lines.append(f'{self.name}{self.label_text(labels)} {value}')
+                continue
+            total = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], value):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{self.label_text(labels, le)} {total}')
+            lines.append(f'{self.name}_sum{self.label_text(labels)} {value[-2]}')
+            lines.append(f'{self.name}_count{self.label_text(labels)} {value[-1]}')
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+THROUGHPUT_BUCKETS = (1e5, 1e6, 1e7, 5e7, 1e8, 2.5e8, 5e8, 1e9, 2.5e9, 1e10)
+
+metrics = MetricsRegistry()
+requests_total = Metric(metrics, 'localshare_requests_total', '按端点和状态码统计的请求数', 'counter',
+                        ('endpoint', 'code'))
+request_duration = Metric(metrics, 'localshare_request_duration_seconds',
+                          '请求耗时（含响应体发送）', 'histogram', ('endpoint',), LATENCY_BUCKETS)
+time_to_first_byte = Metric(metrics, 'localshare_time_to_first_byte_seconds',
+                            '从收到请求到开始发送响应的时间', 'histogram', ('endpoint',), LATENCY_BUCKETS)
+bytes_sent = Metric(metrics, 'localshare_bytes_sent_total', '发送的响应体字节数', 'counter')
+bytes_received = Metric(metrics, 'localshare_bytes_received_total', '接收的上传数据字节数', 'counter')
+active_transfers = Metric(metrics, 'localshare_active_transfers', '进行中的传输', 'gauge', ('direction',))
+transfer_throughput = Metric(metrics, 'localshare_transfer_throughput_bytes_per_second',
+                             '单次传输的平均速率', 'histogram', ('direction',), THROUGHPUT_BUCKETS)
+disk_seconds = Metric(metrics, 'localshare_disk_seconds_total',
+                      '读写文件内容的耗时（sendfile 发送不计入）', 'counter', ('op',))
+disk_bytes = Metric(metrics, 'localshare_disk_bytes_total', '读写的文件内容字节数', 'counter', ('op',))
+indexed_files = Metric(metrics, 'localshare_indexed_files', '索引中的文件数', 'gauge')
+
+def record_disk(op, size, started):
+    disk_seconds.inc(time.perf_counter() - started, (op,))
+    disk_bytes.inc(size, (op,))
+
+# 传输登记：每个进行中的上传/下载一条记录。已传输字节数只由处理该请求的线程累加，
+# 读取方不加锁也能拿到一致的整数；速率和剩余时间在 /transfers 查询时计算
+class Transfer:
+    def __init__(self, transfer_id, direction, client, name, progress_id, total):
+        self.id = transfer_id
+        self.direction = direction
+        self.client = client
+        self.name = name
+        self.progress_id = progress_id
+        self.total = total
+        self.done = 0
+        self.started = time.time()
+        self.finished = None
+        self.state = 'active'
+        # 速率取两次查询之间的平均值，查询间隔不足 1 秒时沿用上次的值
+        self.sample = (time.monotonic(), 0)
+        self.rate = 0.0
+
+    def update_rate(self, now):
+        sample_time, sample_done = self.sample
+        if self.finished is not None:
+            self.rate = self.done / max(self.finished - self.started, 1e-6)
+        elif now - sample_time >= 1:
+            self.rate = (self.done - sample_done) / (now - sample_time)
+            self.sample = (now, self.done)
+        elif not sample_done and not self.rate:
+            self.rate = self.done / max(time.time() - self.started, 1e-6)
+
+    def to_dict(self):
+        eta = None
+        if self.total and self.rate > 0 and self.finished is None:
+            eta = max(0, self.total - self.done) / self.rate
+        return {
+            'id': self.id,
+            'direction': self.direction,
+            'client': self.client,
+            'name': self.name,
+            'progress_id': self.progress_id,
+            'state': self.state,
+            'bytes': self.done,
+            'total': self.total,
+            'rate': round(self.rate),
+            'eta': round(eta, 1) if eta is not None else None,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+class TransferRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.active = {}
+        self.recent = collections.deque(maxlen=TRANSFER_HISTORY)
+
+    def begin(self, direction, client, name, progress_id=None, total=None):
+        with self.lock:
+            transfer = Transfer(self.next_id, direction, client, name, progress_id, total)
+            self.next_id += 1
+            self.active[transfer.id] = transfer
+        return transfer
+
+    def end(self, transfer, ok):
+        with self.lock:
+            transfer.finished = time.time()
+            transfer.state = 'done' if ok else 'failed'
+            self.active.pop(transfer.id, None)
+            self.recent.append(transfer)
+
+    # client 为 None 时返回全部传输，否则只返回该客户端的
+    def snapshot(self, client=None, progress_id=None):
+        now = time.monotonic()
+        result = {'active': [], 'recent': []}
+        totals = {direction: {'count': 0, 'rate': 0} for direction in ('download', 'upload')}
+        with self.lock:
+            for key, transfers in (('active', self.active.values()), ('recent', reversed(self.recent))):
+                for transfer in transfers:
+                    if client is not None and transfer.client != client:
+                        continue
+                    if progress_id is not None and transfer.progress_id != progress_id:
+                        continue
+                    transfer.update_rate(now)
+                    info = transfer.to_dict()
+                    result[key].append(info)
+                    if key == 'active':
+                        totals[transfer.direction]['count'] += 1
+                        totals[transfer.direction]['rate'] += info['rate']
+        result['active'].sort(key=lambda info: -info['rate'])
+        result['totals'] = totals
+        return result
+
+transfers = TransferRegistry()
+
+# 当前请求对应的传输记录；不是上传/下载请求时为 None
+def current_transfer():
+    return request.environ.get('localshare.transfer')
+
+# 以路径第一段区分端点，标签取值固定，不随文件名增长
+METRIC_ENDPOINTS = {'files', 'upload', 'download', 'download-zip', 'search', 'thumb', 'check', 'events',
+                    'metrics', 'admin', 'transfers'}
+
+# WSGI 中间件：为上传/下载登记传输记录，并统计请求数、耗时、首字节时间和传输速率。
+# 响应体经过这里时计数；sendfile 发送的字节由 SendfileFileWrapper、上传数据由 ShapedReader 计入传输记录
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '/')
+        endpoint = path.split('/')[1] or 'index'
+        endpoint = endpoint if endpoint in METRIC_ENDPOINTS else 'other'
+        method = environ.get('REQUEST_METHOD')
+        direction = None
+        if endpoint == 'download-zip' or endpoint == 'download' and method == 'GET':
+            direction = 'download'
+        elif endpoint == 'upload' and method in ('POST', 'PUT'):
+            direction = 'upload'
+        if not direction and not METRICS_ENABLED:
+            return self.app(environ, start_response)
+
+        started = time.perf_counter()
+        transfer = None
+        if direction:
+            total = None
+            if direction == 'upload' and environ.get('CONTENT_LENGTH', '').isdigit():
+                total = int(environ['CONTENT_LENGTH'])
+            # PATH_INFO 是按 latin-1 解码的原始字节；上传的文件名在解析请求体时再填入
+            name = path[len(endpoint) + 2:].encode('latin-1').decode('utf-8', 'replace') or endpoint
+            transfer = transfers.begin(direction, environ.get('REMOTE_ADDR'), name,
+                                       environ.get('HTTP_X_PROGRESS_ID'), total)
+            environ['localshare.transfer'] = transfer
+            if METRICS_ENABLED:
+                active_transfers.inc(1, (direction,))
+        status = ['500']
+
+        def metrics_start_response(status_line, headers, exc_info=None):
+            status[0] = status_line.split(' ', 1)[0]
+            if direction == 'download':
+                for name, value in headers:
+                    if name.lower() == 'content-length':
+                        transfer.total = int(value)
+            return start_response(status_line, headers, exc_info)
+
+        try:
+            result = self.app(environ, metrics_start_response)
+        except BaseException:
+            self.finish(endpoint, transfer, status[0], started)
+            raise
+        return self.iterate(result, endpoint, transfer, status, started)
+
+    def iterate(self, result, endpoint, transfer, status, started):
+        first = True
+        counting = transfer is not None and transfer.direction == 'download'
+        complete = False
+        try:
+            for chunk in result:
+                if first:
+                    first = False
+                    if METRICS_ENABLED:
+                        time_to_first_byte.observe(time.perf_counter() - started, (endpoint,))
+                if chunk:
+                    if counting:
+                        transfer.done += len(chunk)
+                    if METRICS_ENABLED:
+                        bytes_sent.inc(len(chunk))
+                yield chunk
+            complete = True
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+            self.finish(endpoint, transfer, status[0], started, complete)
+
+    def finish(self, endpoint, transfer, code, started, complete=False):
+        elapsed = time.perf_counter() - started
+        if transfer is not None:
+            ok = complete and code < '400' and (transfer.total is None or transfer.done >= transfer.total)
+            transfers.end(transfer, ok)
+        if not METRICS_ENABLED:
+            return
+        requests_total.inc(1, (endpoint, code))
+        request_duration.observe(elapsed, (endpoint,))
+        if transfer is not None:
+            active_transfers.dec(1, (transfer.direction,))
+            if transfer.done and elapsed > 0:
+                transfer_throughput.observe(transfer.done / elapsed, (transfer.direction,))
+
+app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        return jsonify({'error': '统计未启用'}), 404
+    with file_index.lock:
+        indexed_files.values[()] = len(file_index.files)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# 进行中和最近完成的传输。本机可以看到全部客户端，其他客户端只能看到自己的；
+# ?id= 只返回请求头 X-Progress-ID 为该值的传输（同一次批量上传的各个请求）
+@app.route('/transfers')
+def list_transfers():
+    client = None if request.remote_addr in ('127.0.0.1', '::1') else request.remote_addr
+    return jsonify(transfers.snapshot(client, request.args.get('id') or None))
+
+# 首页没有模板变量，启动时一次性生成页面字节及各压缩编码的版本，请求时直接发送
+class StaticPage:
+    def __init__(self, html):
+        body = html.encode('utf-8')
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+        self.bodies = {None: body}
+        for encoding in available_encodings():
+            if encoding == 'zstd':
+                data = zstandard.ZstdCompressor(level=19).compress(body)
+            elif encoding == 'br':
+                data = brotli.compress(body, quality=11)
+            else:
+                data = zlib.compressobj(9, zlib.DEFLATED, 31)
+                data = data.compress(body) + data.flush()
+            if len(data) < len(body):
+                self.bodies[encoding] = data
+
+    def response(self):
+        accept = request.accept_encodings
+        candidates = [e for e in self.bodies if e and accept.quality(e) > 0]
+        encoding = max(candidates, key=accept.quality) if candidates else None
+        etag = f'{self.etag}-{encoding}' if encoding else self.etag
+        headers = {
+            'ETag': quote_etag(etag),
+            'Cache-Control': f'public, max-age={INDEX_MAX_AGE}',
+            'Vary': 'Accept-Encoding'
+        }
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return Response(self.bodies[encoding], mimetype='text/html', headers=headers)
 
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    return index_page.response()
+
+def state_path(*parts):
+    path = os.path.join(UPLOAD_FOLDER, STATE_DIR_NAME, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+# 处理重名文件：返回上传目录中尚未被占用的文件名
+def unique_filename(filename):
+    candidate = filename
+    counter = 1
+    base_name, ext = os.path.splitext(filename)
+    while os.path.exists(os.path.join(UPLOAD_FOLDER, candidate)):
+        candidate = f"{base_name}_{counter}{ext}"
+        counter += 1
+    return candidate
+
+publish_lock = threading.Lock()
+
+# 同时计算整个文件的 SHA-256 和按 MANIFEST_CHUNK_SIZE 切分的各块 SHA-256；
+# 根摘要是各块摘要（二进制）顺序拼接后的 SHA-256
+class ContentHasher:
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.chunks = []
+        self.chunk = hashlib.sha256() if MANIFEST_ENABLED else None
+        self.chunk_fill = 0
+
+    def update(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        if self.chunk is None:
+            return
+        view = memoryview(data)
+        while view:
+            n = min(len(view), MANIFEST_CHUNK_SIZE - self.chunk_fill)
+            self.chunk.update(view[:n])
+            self.chunk_fill += n
+            view = view[n:]
+            if self.chunk_fill == MANIFEST_CHUNK_SIZE:
+                self.chunks.append(self.chunk.hexdigest())
+                self.chunk = hashlib.sha256()
+                self.chunk_fill = 0
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def manifest(self):
+        if self.chunk is None:
+            return None
+        chunks = list(self.chunks)
+        if self.chunk_fill or not chunks:
+            chunks.append(self.chunk.hexdigest())
+        return {
+            'sha256': self.hexdigest(),
+            'size': self.size,
+            'chunk_size': MANIFEST_CHUNK_SIZE,
+            'root': manifest_root(chunks),
+            'chunks': chunks
+        }
+
+def manifest_root(chunks):
+    return hashlib.sha256(b''.join(bytes.fromhex(chunk) for chunk in chunks)).hexdigest()
+
+def manifest_path(digest):
+    return state_path('manifests', f'{digest}.json')
+
+# 清单按内容摘要保存，内容相同的文件共用一份
+def save_manifest(manifest):
+    if manifest is None:
+        return
+    path = manifest_path(manifest['sha256'])
+    tmp = f'{path}.{os.urandom(6).hex()}.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"保存分块清单失败: {e}")
+        discard_file(tmp)
 
+def load_manifest(digest):
+    path = manifest_path(digest)
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('chunk_size') != MANIFEST_CHUNK_SIZE:
+        return None
+    return manifest
+
+def hash_file(path):
+    hasher = ContentHasher()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            hasher.update(block)
+    save_manifest(hasher.manifest())
+    return hasher.hexdigest()
+
+def blob_path(digest):
+    return state_path('blobs', digest[:2], digest)
+
+def is_sha256(value):
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+# 内容摘要缓存：以 (设备, inode, 大小, mtime) 为键，持久化到 .localshare/hashes.json，
+# 文件内容不变时只计算一次；文件被替换或修改后键随之变化，自然失效
+class HashCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.loaded = False
+        self.save_timer = None
+        self.pending = set()
+        self.queue = collections.deque()
+        self.worker = None
+        self.computing = {}
+
+    def key(self, stat):
+        return f'{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            try:
+                with open(os.path.join(UPLOAD_FOLDER, STATE_DIR_NAME, 'hashes.json'), encoding='utf-8') as f:
+                    self.entries.update(json.load(f))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"读取摘要缓存失败: {e}")
+
+    def get(self, stat):
+        self.load()
+        return self.entries.get(self.key(stat))
+
+    def put(self, stat, digest):
+        self.load()
+        with self.lock:
+            self.entries[self.key(stat)] = digest
+            while len(self.entries) > HASH_CACHE_MAX:
+                del self.entries[next(iter(self.entries))]
+            # 合并短时间内的多次写入
+            if self.save_timer is None:
+                self.save_timer = threading.Timer(2, self.save)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+
+    def save(self):
+        with self.lock:
+            self.save_timer = None
+            data = json.dumps(self.entries)
+        try:
+            path = state_path('hashes.json')
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"保存摘要缓存失败: {e}")
+
+    def digest(self, path, stat):
+        # 返回文件内容的 SHA-256；大文件未缓存时转入后台计算并返回 None
+        digest = self.get(stat)
+        if digest is not None:
+            return digest
+        if stat.st_size > HASH_SYNC_LIMIT:
+            self.schedule(path)
+            return None
+        # 同一文件的并发请求只计算一次，其余请求等待结果
+        key = self.key(stat)
+        with self.lock:
+            event = self.computing.get(key)
+            owner = event is None
+            if owner:
+                event = self.computing[key] = threading.Event()
+        if not owner:
+            event.wait()
+            return self.get(stat) or hash_file(path)
+        try:
+            digest = hash_file(path)
+            if self.key(os.stat(path)) == key:
+                self.put(stat, digest)
+        finally:
+            with self.lock:
+                del self.computing[key]
+            event.set()
+        return digest
+
+    def schedule(self, path):
+        with self.lock:
+            if path in self.pending:
+                return
+            self.pending.add(path)
+            self.queue.append(path)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._work, name='hash-worker', daemon=True)
+                self.worker.start()
+
+    def _work(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.worker = None
+                    return
+                path = self.queue.popleft()
+            try:
+                stat = os.stat(path)
+                digest = self.get(stat)
+                # 摘要已缓存但清单缺失（如清单被淘汰）时也重新计算
+                if digest is None or MANIFEST_ENABLED and not os.path.exists(manifest_path(digest)):
+                    digest = hash_file(path)
+                    # 计算期间文件未被修改才写入缓存
+                    if self.key(os.stat(path)) == self.key(stat):
+                        self.put(stat, digest)
+            except OSError as e:
+                print(f"计算文件摘要失败: {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard(path)
+
+hash_cache = HashCache()
+
+# 把写好的临时文件原子地移动到上传目录，返回最终文件名。
+# 给出内容摘要时按内容去重：已有相同内容的 blob 则丢弃临时文件并硬链接到 blob，
+# 若同名文件本身就是该 blob 则不再生成 name_1 副本。
+# 临时文件写完后原子重命名到上传目录，列表中不会出现写了一半的文件
+def publish_file(tmp_path, filename, digest=None, ttl=None):
+    if DURABILITY == 'commit':
+        # 内容先落盘，再让新文件名可见
+        sync_file(tmp_path)
+    dedup = digest and DEDUP_ENABLED and verify_blob(digest)
+    with publish_lock:
+        ensure_parent(filename)
+        final_name = None
+        reused = False
+        if dedup:
+            reused = os.path.exists(blob_path(digest))
+            final_name = link_blob(digest, filename, tmp_path)
+        if final_name is None:
+            final_name = unique_filename(filename)
+            os.replace(tmp_path, os.path.join(UPLOAD_FOLDER, final_name))
+        final_path = os.path.join(UPLOAD_FOLDER, final_name)
+    now = time.time()
+    if reused and os.stat(final_path).st_nlink > 1:
+        # 与其他文件共用 inode，不能改修改时间，发布时间记在索引中
+        file_index.set_timestamp(final_name, now)
+    else:
+        # 设置文件修改时间为当前时间
+        os.utime(final_path, (now, now))
+    if DURABILITY == 'commit':
+        sync_file(os.path.dirname(final_path))
+    elif DURABILITY == 'periodic':
+        file_syncer.add(final_path)
+    if digest:
+        # 上传时已算出的摘要直接写入缓存，下载时无需再次计算
+        hash_cache.put(os.stat(final_path), digest)
+    file_index.add(final_name)
+    storage.uploaded(final_name, ttl)
+    return final_name
+
+# blob 与上传目录中同内容的文件共用 inode，其中任一文件被原地修改，blob 的内容也随之改变。
+# 链接前按摘要缓存（以 inode、大小和修改时间为键，修改后即失效）核对内容，不符时丢弃 blob。
+# 未缓存的大文件转入后台计算并返回 False，本次不去重
+def verify_blob(digest):
+    blob = blob_path(digest)
+    try:
+        stat = os.stat(blob)
+    except OSError:
+        return True
+    actual = hash_cache.digest(blob, stat)
+    if actual is None:
+        return False
+    if actual != digest:
+        print(f"blob 内容已被修改，不再复用: {digest}")
+        with publish_lock:
+            discard_file(blob)
+    return True
+
+# 调用方持有 publish_lock。tmp_path 为 None 时只复用已有 blob。
+# 返回发布后的文件名；没有可用的 blob 且没有临时文件时返回 None
+def link_blob(digest, filename, tmp_path=None):
+    blob = blob_path(digest)
+    try:
+        blob_stat = os.stat(blob)
+    except OSError:
+        blob_stat = None
+    if blob_stat is not None and tmp_path is not None and blob_stat.st_size != os.path.getsize(tmp_path):
+        # blob 被外部改动过，内容已不可信
+        discard_file(blob)
+        blob_stat = None
+    if blob_stat is None:
+        if tmp_path is None:
+            return None
+        os.replace(tmp_path, blob)
+        tmp_path = None
+
+    existing = os.path.join(UPLOAD_FOLDER, filename)
+    try:
+        if os.path.samefile(existing, blob):
+            if tmp_path is not None:
+                discard_file(tmp_path)
+            return filename
+    except OSError:
+        pass
+
+    final_name = unique_filename(filename)
+    try:
+        os.link(blob, os.path.join(UPLOAD_FOLDER, final_name))
+    except OSError as e:
+        # 不支持硬链接时退回普通文件，不再使用 blob 存储
+        print(f"创建硬链接失败，不进行去重: {e}")
+        if tmp_path is None:
+            os.replace(blob, os.path.join(UPLOAD_FOLDER, final_name))
+        else:
+            os.replace(tmp_path, os.path.join(UPLOAD_FOLDER, final_name))
+        return final_name
+    if tmp_path is not None:
+        discard_file(tmp_path)
+    return final_name
+
+# 清理链接数为 1（上传目录中已没有文件引用）的 blob
+def collect_blobs():
+    folder = os.path.join(UPLOAD_FOLDER, STATE_DIR_NAME, 'blobs')
+    if not os.path.isdir(folder):
+        return
+    with publish_lock:
+        for prefix in os.scandir(folder):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    if entry.stat().st_nlink <= 1:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+blob_gc_timer = None
+blob_gc_lock = threading.Lock()
+
+def schedule_blob_gc(generation, op, name, info):
+    global blob_gc_timer
+    if op != 'remove' or not DEDUP_ENABLED:
+        return
+    with blob_gc_lock:
+        if blob_gc_timer is None:
+            blob_gc_timer = threading.Timer(BLOB_GC_DELAY, run_blob_gc)
+            blob_gc_timer.daemon = True
+            blob_gc_timer.start()
+
+def run_blob_gc():
+    global blob_gc_timer
+    with blob_gc_lock:
+        blob_gc_timer = None
+    try:
+        collect_blobs()
+    except OSError as e:
+        print(f"清理 blob 失败: {e}")
+    trim_cache('manifests', MANIFEST_CACHE_MAX)
+
+file_index.listeners.append(schedule_blob_gc)
+
+class StorageFull(Exception):
+    pass
+
+# 存储管理：随 file_index 的变更维护文件总大小和每个文件的访问记录（最近下载时间、下载次数、到期时间），
+# 总大小按 inode 计算，去重产生的多个硬链接名字只计一次；上传前按配额预留空间；后台线程删除到期的文件，总大小超过高水位时淘汰最久未下载的文件，不再遍历目录。
+# 访问记录保存在 .localshare/storage.json，只记录下载过或设有到期时间的文件
+class StorageManager:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sizes = {}          # 文件 id -> 大小
+        self.inodes = {}         # 文件 id -> (设备, inode)
+        self.links = {}          # (设备, inode) -> [指向它的文件 id 数, 大小]
+        self.total = 0
+        self.reserved = 0        # 上传中已预留、尚未发布的字节数
+        self.stats = {}          # 文件 id -> [最近访问时间, 下载次数, 到期时间或 None]
+        self.saved = {}          # 启动时读入、尚未出现在索引中的访问记录
+        self.expiry = []         # (到期时间, 文件 id) 小顶堆，已删除或改期的条目弹出时跳过
+        self.dirty = False
+        self.expired = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.wakeup = threading.Event()
+
+    @property
+    def path(self):
+        return state_path('storage.json')
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                files = json.load(f)['files']
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            print(f"读取访问记录失败: {e}")
+            return
+        with self.lock:
+            for name, stats in files.items():
+                if name in self.stats:
+                    self._set_stats(name, list(stats))
+                else:
+                    self.saved[name] = list(stats)
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            files = {name: stats for name, stats in self.stats.items() if stats[1] or stats[2]}
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'files': files}, f)
+        os.replace(tmp, self.path)
+
+    def _set_stats(self, name, stats):
+        self.stats[name] = stats
+        if stats[2]:
+            heapq.heappush(self.expiry, (stats[2], name))
+
+    def on_change(self, generation, op, name, info):
+        if op not in ('add', 'remove'):
+            return
+        inode = None
+        if op == 'add':
+            try:
+                stat = os.stat(info['path'])
+                inode = (stat.st_dev, stat.st_ino)
+            except OSError:
+                inode = name
+        with self.lock:
+            self._unlink(name)
+            if op == 'add':
+                self.sizes[name] = info['size']
+                self.inodes[name] = inode
+                link = self.links.get(inode)
+                if link is None:
+                    self.links[inode] = [1, info['size']]
+                    self.total += info['size']
+                else:
+                    link[0] += 1
+                    self.total += info['size'] - link[1]
+                    link[1] = info['size']
+                if name not in self.stats:
+                    self._set_stats(name, self.saved.pop(name, None) or [info['timestamp'] / 1000, 0, None])
+            elif self.stats.pop(name, None) is not None:
+                self.dirty = True
+            over = QUOTA_TOTAL and self.total > QUOTA_TOTAL * REAPER_HIGH_WATER
+        if over:
+            self.wakeup.set()
+
+    def _unlink(self, name):
+        if self.sizes.pop(name, None) is None:
+            return
+        inode = self.inodes.pop(name)
+        link = self.links[inode]
+        link[0] -= 1
+        if not link[0]:
+            del self.links[inode]
+            self.total -= link[1]
+
+    # 删除该名字后释放的字节数：还有其他硬链接时为 0
+    def freed_by(self, name):
+        with self.lock:
+            link = self.links.get(self.inodes.get(name))
+            return link[1] if link and link[0] == 1 else 0
+
+    # 超过单个文件大小上限时抛出 RequestEntityTooLarge
+    def check_file_size(self, size):
+        if QUOTA_FILE and size > QUOTA_FILE:
+            raise RequestEntityTooLarge()
+
+    # 预留上传空间，总大小将超过配额时抛出 StorageFull；force 用于恢复重启前已创建的上传会话
+    def reserve(self, size, force=False):
+        with self.lock:
+            if not force and QUOTA_TOTAL and self.total + self.reserved + size > QUOTA_TOTAL:
+                self.wakeup.set()
+                raise StorageFull()
+            self.reserved += size
+
+    def release(self, size):
+        with self.lock:
+            self.reserved -= size
+
+    # 新发布的上传文件：记为刚访问过，并按 ttl（未指定时用默认值）设置到期时间
+    def uploaded(self, name, ttl=None):
+        ttl = ttl or FILE_TTL
+        now = time.time()
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                return
+            stats[0] = now
+            stats[2] = now + ttl if ttl else None
+            self.dirty = True
+            if not stats[2]:
+                return
+            heapq.heappush(self.expiry, (stats[2], name))
+            earliest = self.expiry[0][1] == name
+        # 比已有的都早到期时唤醒后台线程重新计算等待时间
+        if earliest:
+            self.wakeup.set()
+
+    def touch(self, name):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is not None:
+                stats[0] = time.time()
+                stats[1] += 1
+                self.dirty = True
+
+    def start(self):
+        threading.Thread(target=self._run, name='storage-reaper', daemon=True).start()
+
+    def _run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), REAPER_NICE)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            with self.lock:
+                timeout = REAPER_INTERVAL
+                if self.expiry:
+                    timeout = max(0, min(timeout, self.expiry[0][0] - time.time()))
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            try:
+                self.reap()
+                expire_upload_sessions()
+                self.save()
+            except OSError as e:
+                print(f"清理文件失败: {e}")
+
+    def reap(self):
+        now = time.time()
+        expired = []
+        with self.lock:
+            while self.expiry and self.expiry[0][0] <= now:
+                expires, name = heapq.heappop(self.expiry)
+                stats = self.stats.get(name)
+                if stats is not None and stats[2] == expires:
+                    expired.append(name)
+        for name in expired:
+            if self.delete(name):
+                self.expired += 1
+        with self.lock:
+            if not QUOTA_TOTAL or self.total <= QUOTA_TOTAL * REAPER_HIGH_WATER:
+                return
+            excess = self.total - QUOTA_TOTAL * REAPER_LOW_WATER
+            # 最久未下载的文件在前
+            candidates = sorted((stats[0], name) for name, stats in self.stats.items())
+        for _, name in candidates:
+            if excess <= 0:
+                break
+            size = self.freed_by(name)
+            if self.delete(name):
+                self.evicted += 1
+                self.evicted_bytes += size
+                excess -= size
+
+    def delete(self, name):
+        try:
+            os.remove(file_index.local_path(name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"删除文件失败: {name}: {e}")
+            return False
+        file_index.remove(name)
+        return True
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'quota': QUOTA_TOTAL,
+                'file_quota': QUOTA_FILE,
+                'ttl': FILE_TTL,
+                'used': self.total,
+                'reserved': self.reserved,
+                'files': len(self.sizes),
+                'expiring': sum(1 for stats in self.stats.values() if stats[2]),
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'evicted_bytes': self.evicted_bytes
+            }
+
+storage = StorageManager()
+file_index.listeners.append(storage.on_change)
+
+def parse_duration(value):
+    # 解析 3600、30m、12h、7d 这样的时长（秒），0 表示永久
+    value = str(value).strip().lower()
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value and value[-1] in units:
+        seconds = int(float(value[:-1]) * units[value[-1]])
+    else:
+        seconds = int(float(value))
+    if seconds < 0:
+        raise ValueError(value)
+    return seconds
+
+# 上传前检查：HEAD/GET 返回服务器是否已有该内容；
+# POST 时若已有则直接以给定文件名发布，客户端无需再发送数据
+@app.route('/check/<digest>', methods=['HEAD', 'GET', 'POST'])
+def check_blob(digest):
+    digest = digest.lower()
+    if not is_sha256(digest):
+        return jsonify({'error': '无效的摘要'}), 400
+    if not DEDUP_ENABLED:
+        return jsonify({'exists': False}), 404
+    if request.method != 'POST':
+        exists = os.path.exists(blob_path(digest))
+        return jsonify({'exists': exists}), 200 if exists else 404
+    data = request.get_json(silent=True) or {}
+    filename = safe_path(str(data.get('name', '')))
+    if not filename:
+        return jsonify({'error': '无效的文件名'}), 400
+    try:
+        ttl = parse_duration(data['ttl']) if data.get('ttl') else None
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'error': '无效的保留时间'}), 400
+    try:
+        final_name = publish_blob(digest, filename, ttl)
+    except RequestEntityTooLarge:
+        return jsonify({'error': '文件超过大小上限'}), 413
+    except StorageFull:
+        return jsonify({'error': '存储空间不足'}), 507
+    except OSError as e:
+        print(f"保存文件失败: {e}")
+        return jsonify({'error': '文件保存失败'}), 500
+    if final_name is None:
+        return jsonify({'exists': False}), 404
+    return jsonify({'exists': True, 'name': final_name})
+
+# 批量询问：{"files": [{"digest": ..., "name": ...}], "ttl": ...}，按顺序返回每个文件是否已直接发布。
+# 出错的文件记为不存在，由客户端正常上传
+@app.route('/check', methods=['POST'])
+def check_blobs():
+    data = request.get_json(silent=True) or {}
+    files = data.get('files')
+    if not isinstance(files, list) or len(files) > UPLOAD_MAX_PARTS:
+        return jsonify({'error': '无效的请求'}), 400
+    try:
+        ttl = parse_duration(data['ttl']) if data.get('ttl') else None
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'error': '无效的保留时间'}), 400
+    results = []
+    for entry in files:
+        entry = entry if isinstance(entry, dict) else {}
+        digest = str(entry.get('digest', '')).lower()
+        filename = safe_path(str(entry.get('name', '')))
+        final_name = None
+        if DEDUP_ENABLED and is_sha256(digest) and filename:
+            try:
+                final_name = publish_blob(digest, filename, ttl)
+            except (RequestEntityTooLarge, StorageFull, OSError):
+                pass
+        results.append({'exists': True, 'name': final_name} if final_name else {'exists': False})
+    return jsonify({'results': results})
+
+# 把已有的 blob 发布为 filename；没有可用的 blob 时返回 None
+def publish_blob(digest, filename, ttl=None):
+    if not verify_blob(digest):
+        return None
+    try:
+        size = os.path.getsize(blob_path(digest))
+    except OSError:
+        return None
+    storage.check_file_size(size)
+    storage.reserve(size)
+    try:
+        with publish_lock:
+            ensure_parent(filename)
+            final_name = link_blob(digest, filename)
+            if final_name is None:
+                return None
+            final_path = os.path.join(UPLOAD_FOLDER, final_name)
+        # 与其他文件共用 inode，发布时间记在索引中
+        hash_cache.put(os.stat(final_path), digest)
+        file_index.set_timestamp(final_name, time.time())
+        storage.uploaded(final_name, ttl)
+    finally:
+        storage.release(size)
+    return final_name
+
+def safe_path(filename):
+    # 规范化客户端给出的相对路径（文件夹上传时带目录）：统一分隔符，去掉空段和 '.'；
+    # 含 '..'、盘符、NUL 或指向状态目录时返回 None
+    parts = [part for part in filename.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or parts[0] == STATE_DIR_NAME or '\0' in filename:
+        return None
+    if any(os.path.splitdrive(part)[0] or len(os.fsencode(part)) > 255 for part in parts):
+        return None
+    return '/'.join(parts)
+
+# 创建文件所在的目录，并确认其没有经符号链接指向上传目录之外
+def ensure_parent(filename):
+    parent = os.path.dirname(os.path.join(UPLOAD_FOLDER, filename))
+    os.makedirs(parent, exist_ok=True)
+    root = os.path.realpath(UPLOAD_FOLDER)
+    if os.path.commonpath([root, os.path.realpath(parent)]) != root:
+        raise OSError(f'路径超出上传目录: {filename}')
+
+# 上传请求体按 Content-Encoding 解压；每次 read 的输出有上限，避免压缩炸弹占满内存
+class DecodedStream:
+    def __init__(self, raw, decompressor):
+        self.raw = raw
+        self.decompressor = decompressor
+        self.eof = False
+
+    def read(self, size):
+        while True:
+            if self.decompressor.unconsumed_tail:
+                data = self.decompressor.decompress(self.decompressor.unconsumed_tail, size)
+            elif self.eof or self.decompressor.eof:
+                return b''
+            else:
+                chunk = self.raw.read(64 * 1024)
+                if not chunk:
+                    self.eof = True
+                    return self.decompressor.flush()
+                data = self.decompressor.decompress(chunk, size)
+            if data:
+                return data
+
+# 返回请求体的读取流（按上传限速读取网络数据）；不支持的 Content-Encoding 返回 None
+def request_body_stream():
+    encoding = request.headers.get('Content-Encoding', 'identity').strip().lower()
+    raw = ShapedReader(request.stream, upload_shaper, request.remote_addr, current_transfer())
+    if encoding in ('', 'identity'):
+        return raw
+    if encoding in ('gzip', 'x-gzip'):
+        return DecodedStream(raw, zlib.decompressobj(zlib.MAX_WBITS | 32))
+    if encoding == 'deflate':
+        return DecodedStream(raw, zlib.decompressobj())
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    return None
+
+def discard_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# 流式解析 multipart 请求体：每个文件部分直接写入上传目录旁的临时文件，
+# 结束后原子重命名，不经过 Werkzeug 的临时文件或内存缓冲，内存占用与批量大小无关
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    if 'files' not in request.files:
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
         return jsonify({'error': '没有文件'}), 400
-    
-    uploaded_files = request.files.getlist('files')
-    
-    for file in uploaded_files:
-        if file.filename:
-            original_filename = file.filename
-            file_path = os.path.join(UPLOAD_FOLDER, original_filename)
-            
-            # 处理重名文件
-            counter = 1
-            base_name, ext = os.path.splitext(original_filename)
-            while os.path.exists(file_path):
-                new_filename = f"{base_name}_{counter}{ext}"
-                file_path = os.path.join(UPLOAD_FOLDER, new_filename)
-                original_filename = new_filename
-                counter += 1
-            
+
+    try:
+        ttl = parse_duration(request.args['ttl']) if request.args.get('ttl') else None
+    except (ValueError, OverflowError):
+        return jsonify({'error': '无效的保留时间'}), 400
+    stream = request_body_stream()
+    if stream is None:
+        return jsonify({'error': '不支持的 Content-Encoding'}), 415
+    # 解析器缓冲区只需容纳一次读取的数据加上未处理的尾部
+    decoder = MultipartDecoder(boundary.encode('latin-1'), 2 * UPLOAD_READ_SIZE,
+                               max_parts=UPLOAD_MAX_PARTS)
+    saved = []
+    current = None      # (临时文件描述符, 临时路径, 文件名, 内容摘要)
+    part_size = 0
+    transfer = current_transfer()
+    writer = WriteBehind(WRITE_BEHIND_BYTES)
+    # 未压缩的请求体中尚未读取的字节数是当前文件大小的上限，预分配不超过它
+    identity = request.headers.get('Content-Encoding', 'identity').strip().lower() in ('', 'identity')
+    remaining = request.content_length or 0
+    allocated = 0
+    # 按 Content-Length 预先占用配额，超出时在写入任何数据前拒绝；
+    # 压缩的请求体解压后超出预留的部分在写入时追加预留。written 为已写入、尚未发布的字节数
+    reserved = 0
+    written = 0
+
+    try:
+        if request.content_length:
+            storage.reserve(request.content_length)
+            reserved = request.content_length
+        while True:
+            chunk = stream.read(UPLOAD_READ_SIZE)
+            decoder.receive_data(chunk or None)
+            if chunk:
+                remaining -= len(chunk)
+
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File):
+                    filename = safe_path(event.filename) if event.name == 'files' else None
+                    if filename:
+                        if transfer is not None:
+                            transfer.name = filename
+                        part_size = 0
+                        allocated = 0
+                        tmp_path = state_path('tmp', os.urandom(12).hex())
+                        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+                        current = (fd, tmp_path, filename, ContentHasher())
+                    else:
+                        current = None
+                elif isinstance(event, Field):
+                    current = None
+                elif isinstance(event, Data) and current is not None:
+                    fd, tmp_path, filename, digest = current
+                    if event.data:
+                        offset = part_size
+                        part_size += len(event.data)
+                        written += len(event.data)
+                        storage.check_file_size(part_size)
+                        if written > reserved:
+                            storage.reserve(written - reserved)
+                            reserved = written
+                        # 一次读取装不下的文件才预分配，批量上传的小文件不受影响；
+                        # 已分配的空间快用完时按已收到的量加倍，最多领先 PREALLOCATE_AHEAD
+                        if (identity and event.more_data and part_size >= UPLOAD_READ_SIZE and
+                                part_size + UPLOAD_READ_SIZE > allocated):
+                            ahead = min(part_size, PREALLOCATE_AHEAD, remaining)
+                            if ahead > 0:
+                                allocated = part_size + ahead
+                                writer.submit(preallocate, fd, allocated)
+                        writer.submit(write_at, fd, event.data, offset)
+                        digest.update(event.data)
+                    if not event.more_data:
+                        # 等待该文件的数据全部写完；预分配多出的部分截掉
+                        writer.drain()
+                        if allocated > part_size:
+                            os.ftruncate(fd, part_size)
+                        # 文件已关闭，发布失败时仍由 finally 删除临时文件
+                        current = (None, tmp_path, filename, digest)
+                        os.close(fd)
+                        save_manifest(digest.manifest())
+                        saved.append(publish_file(tmp_path, filename, digest.hexdigest(), ttl))
+                        current = None
+                        # 发布后文件已计入总大小，不再占用预留
+                        storage.release(part_size)
+                        reserved -= part_size
+                        written -= part_size
+                event = decoder.next_event()
+            if isinstance(event, Epilogue):
+                break
+    except ValueError:
+        return jsonify({'error': '无效的上传请求'}), 400
+    except RequestEntityTooLarge:
+        return jsonify({'error': '上传请求过大'}), 413
+    except StorageFull:
+        return jsonify({'error': '存储空间不足'}), 507
+    except Exception as e:
+        print(f"保存文件失败: {e}")
+        return jsonify({'error': '文件保存失败'}), 500
+    finally:
+        writer.close()
+        storage.release(reserved)
+        if current is not None:
+            if current[0] is not None:
+                os.close(current[0])
+            discard_file(current[1])
+
+    if not saved:
+        return jsonify({'error': '没有文件'}), 400
+    return jsonify({'message': '上传成功', 'files': saved})
+
+# 分块上传：init 创建会话并预分配文件，各块用 pwrite 写到各自偏移处，
+# 可并行、可重传；commit 时直接重命名，不需要再拼接复制。
+# 会话状态保存在 .localshare/uploads 下，服务器重启后也能续传。
+class UploadSession:
+    def __init__(self, upload_id, name, size, chunk_size, key, received=(), created=None, ttl=None):
+        self.id = upload_id
+        self.name = name
+        self.size = size
+        self.chunk_size = chunk_size
+        self.key = key
+        self.received = set(received)
+        self.created = created or time.time()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    @property
+    def chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    @property
+    def part_path(self):
+        return state_path('uploads', f'{self.id}.part')
+
+    @property
+    def meta_path(self):
+        return state_path('uploads', f'{self.id}.json')
+
+    def chunk_length(self, index):
+        return max(0, min(self.chunk_size, self.size - index * self.chunk_size))
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'name': self.name,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunks': self.chunks,
+            'received': sorted(self.received)
+        }
+
+    def save(self):
+        data = self.to_dict()
+        data.update({'key': self.key, 'created': self.created, 'ttl': self.ttl})
+        tmp = self.meta_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.meta_path)
+
+    def discard(self):
+        discard_file(self.part_path)
+        discard_file(self.meta_path)
+
+upload_sessions = {}
+upload_sessions_lock = threading.Lock()
+upload_sessions_loaded = False
+
+def load_upload_sessions():
+    global upload_sessions_loaded
+    with upload_sessions_lock:
+        if upload_sessions_loaded:
+            return
+        upload_sessions_loaded = True
+        folder = os.path.join(UPLOAD_FOLDER, STATE_DIR_NAME, 'uploads')
+        if not os.path.isdir(folder):
+            return
+        for entry in os.listdir(folder):
+            if not entry.endswith('.json'):
+                continue
             try:
-                # 使用流式写入，不限制速度
-                chunk_size = 4 * 1024 * 1024  # 4MB
-                total_size = 0
-                
-                with open(file_path, 'wb') as f:
-                    while True:
-                        chunk = file.stream.read(chunk_size)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                        total_size += len(chunk)
-                        # 发送进度到客户端
-                        if request.headers.get('X-Progress-ID'):
-                            progress = total_size / int(request.headers['Content-Length'])
-                            print(f"上传进度: {progress:.2%}")  # 调试信息
-                
-                # 设置文件修改时间为当前时间
-                os.utime(file_path, (time.time(), time.time()))
+                with open(os.path.join(folder, entry), encoding='utf-8') as f:
+                    data = json.load(f)
+                session = UploadSession(data['upload_id'], data['name'], data['size'],
+                                        data['chunk_size'], data.get('key'),
+                                        data['received'], data['created'], data.get('ttl'))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"读取上传会话失败: {entry}: {e}")
+                continue
+            if time.time() - session.created > UPLOAD_SESSION_TTL or not os.path.exists(session.part_path):
+                session.discard()
+                continue
+            # 会话的文件已预分配，继续占用配额
+            storage.reserve(session.size, force=True)
+            upload_sessions[session.id] = session
+
+# 删除超过保留时间的上传会话的预分配文件，释放其占用的配额
+def expire_upload_sessions():
+    now = time.time()
+    with upload_sessions_lock:
+        expired = [session for session in upload_sessions.values()
+                   if now - session.created > UPLOAD_SESSION_TTL]
+        for session in expired:
+            del upload_sessions[session.id]
+    for session in expired:
+        with session.lock:
+            session.discard()
+        storage.release(session.size)
+
+def get_upload_session(upload_id):
+    load_upload_sessions()
+    with upload_sessions_lock:
+        return upload_sessions.get(upload_id)
+
+def preallocate(fd, size):
+    # 预分配磁盘空间，减少碎片；不支持时退回稀疏文件
+    if size <= 0:
+        return
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+def pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+# 没有 os.pwrite 的平台（Windows）用 seek + write，按文件描述符加锁
+pwrite_lock = threading.Lock()
+
+def write_at(fd, data, offset):
+    if hasattr(os, 'pwrite'):
+        pwrite_all(fd, data, offset)
+    else:
+        with pwrite_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+def sync_fd(fd):
+    started = time.perf_counter()
+    (os.fdatasync if hasattr(os, 'fdatasync') else os.fsync)(fd)
+    if METRICS_ENABLED:
+        record_disk('fsync', 0, started)
+
+# fsync 文件或目录（目录的 fsync 使其中的重命名落盘）；Windows 上不能打开目录，跳过
+def sync_file(path):
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    except OSError:
+        return
+    try:
+        if os.path.isdir(path):
+            os.fsync(fd)
+        else:
+            sync_fd(fd)
+    finally:
+        os.close(fd)
+
+# 后写队列：请求线程接收、解析和计算摘要，写盘在单独的线程中按提交顺序进行；
+# 排队的数据超过 limit 字节时 submit 阻塞，内存占用有上限。写盘出错时在下一次 submit 或 drain 时抛出
+class WriteBehind:
+    def __init__(self, limit):
+        self.limit = limit
+        self.cond = threading.Condition()
+        self.queue = collections.deque()
+        self.pending = 0
+        self.busy = False
+        self.stopping = False
+        self.error = None
+        self.thread = None
+
+    def submit(self, func, fd, *args):
+        size = len(args[0]) if isinstance(args[0], bytes) else 0
+        if not self.limit:
+            self._run(func, fd, args, size)
+            return
+        with self.cond:
+            while self.pending and self.pending + size > self.limit and self.error is None:
+                self.cond.wait()
+            if self.error is not None:
+                raise self.error
+            self.queue.append((func, fd, args, size))
+            self.pending += size
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._worker, name='write-behind', daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def _run(self, func, fd, args, size):
+        if METRICS_ENABLED and size:
+            started = time.perf_counter()
+            func(fd, *args)
+            record_disk('write', size, started)
+        else:
+            func(fd, *args)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.stopping:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                func, fd, args, size = self.queue[0]
+                self.busy = True
+            try:
+                if self.error is None:
+                    self._run(func, fd, args, size)
             except Exception as e:
-                print(f"保存文件失败: {e}")
+                self.error = e
+            with self.cond:
+                self.queue.popleft()
+                self.pending -= size
+                self.busy = False
+                self.cond.notify_all()
+
+    def drain(self):
+        with self.cond:
+            while self.queue or self.busy:
+                self.cond.wait()
+            if self.error is not None:
+                raise self.error
+
+    def close(self):
+        # 放弃尚未写入的数据（请求出错时），并结束写盘线程；正在写入的一项由写盘线程完成后出队
+        with self.cond:
+            if self.thread is None:
+                return
+            while len(self.queue) > (1 if self.busy else 0):
+                self.pending -= self.queue.pop()[3]
+            self.stopping = True
+            self.cond.notify_all()
+        self.thread.join()
+
+# periodic 模式：记录写入或发布过的文件，每 SYNC_INTERVAL 秒统一 fsync 一次（连同所在目录），
+# 多个上传共用一次落盘
+class FileSyncer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = set()
+        self.thread = None
+
+    def add(self, path):
+        with self.lock:
+            self.paths.add(path)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='file-syncer', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(SYNC_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            paths, self.paths = self.paths, set()
+        for path in paths | {os.path.dirname(path) for path in paths}:
+            try:
+                sync_file(path)
+            except OSError as e:
+                print(f"同步文件失败: {path}: {e}")
+
+file_syncer = FileSyncer()
+
+@app.route('/upload/init', methods=['POST'])
+def upload_init():
+    data = request.get_json(silent=True) or {}
+    name = safe_path(str(data.get('name', '')))
+    size = data.get('size')
+    if not name or not isinstance(size, int) or size < 0:
+        return jsonify({'error': '无效的上传参数'}), 400
+    chunk_size = data.get('chunk_size') or UPLOAD_CHUNK_SIZE
+    if not isinstance(chunk_size, int):
+        return jsonify({'error': '无效的上传参数'}), 400
+    chunk_size = min(max(chunk_size, UPLOAD_CHUNK_MIN), UPLOAD_CHUNK_MAX)
+    key = data.get('key')
+    try:
+        ttl = parse_duration(data['ttl']) if data.get('ttl') else None
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'error': '无效的保留时间'}), 400
+
+    load_upload_sessions()
+    with upload_sessions_lock:
+        # 同一文件再次 init 时返回已有会话，客户端只需补传缺少的块
+        if key:
+            for session in upload_sessions.values():
+                if session.key == key and session.name == name and session.size == size:
+                    return jsonify(session.to_dict())
+        # 会话存续期间一直占用配额，提交或取消时释放
+        try:
+            storage.check_file_size(size)
+            storage.reserve(size)
+        except RequestEntityTooLarge:
+            return jsonify({'error': '文件超过大小上限'}), 413
+        except StorageFull:
+            return jsonify({'error': '存储空间不足'}), 507
+        session = UploadSession(os.urandom(12).hex(), name, size, chunk_size, key, ttl=ttl)
+        upload_sessions[session.id] = session
+
+    try:
+        fd = os.open(session.part_path, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            preallocate(fd, size)
+        finally:
+            os.close(fd)
+        session.save()
+    except OSError as e:
+        print(f"创建上传会话失败: {e}")
+        with upload_sessions_lock:
+            upload_sessions.pop(session.id, None)
+        session.discard()
+        storage.release(size)
+        return jsonify({'error': '创建上传会话失败'}), 500
+    return jsonify(session.to_dict())
+
+@app.route('/upload/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    session = get_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    with session.lock:
+        return jsonify(session.to_dict())
+
+@app.route('/upload/<upload_id>/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    session = get_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    if index >= session.chunks:
+        return jsonify({'error': '无效的块序号'}), 400
+    stream = request_body_stream()
+    if stream is None:
+        return jsonify({'error': '不支持的 Content-Encoding'}), 415
+    expected = session.chunk_length(index)
+    offset = index * session.chunk_size
+    transfer = current_transfer()
+    if transfer is not None:
+        transfer.name = session.name
+    # 重传已收到的块会原地覆盖其内容：写入前先记为未收到，完整写入后再记回，
+    # 重传中断或长度不符时不会把残缺的内容提交出去
+    with session.lock:
+        if index in session.received:
+            session.received.discard(index)
+            try:
+                session.save()
+            except OSError as e:
+                print(f"保存上传会话失败: {e}")
                 return jsonify({'error': '文件保存失败'}), 500
-    
-    return jsonify({'message': '上传成功'})
+    written = 0
+    try:
+        fd = os.open(session.part_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            while written < expected:
+                data = stream.read(min(1024 * 1024, expected - written))
+                if not data:
+                    break
+                if METRICS_ENABLED:
+                    started = time.perf_counter()
+                    write_at(fd, data, offset + written)
+                    record_disk('write', len(data), started)
+                else:
+                    write_at(fd, data, offset + written)
+                written += len(data)
+            # 块记为已收到之前先落盘，避免断电后会话记录与文件内容不符
+            if DURABILITY == 'commit' and written == expected:
+                sync_fd(fd)
+        finally:
+            os.close(fd)
+        if DURABILITY == 'periodic':
+            file_syncer.add(session.part_path)
+    except OSError as e:
+        print(f"写入分块失败: {e}")
+        return jsonify({'error': '文件保存失败'}), 500
+    if written != expected or stream.read(1):
+        return jsonify({'error': f'块长度不符，应为 {expected} 字节'}), 400
+    with session.lock:
+        session.received.add(index)
+        session.save()
+    return jsonify({'index': index, 'received': len(session.received), 'chunks': session.chunks})
+
+@app.route('/upload/<upload_id>/commit', methods=['POST'])
+def upload_commit(upload_id):
+    session = get_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    with session.lock:
+        missing = [i for i in range(session.chunks) if i not in session.received]
+        if missing:
+            return jsonify({'error': '还有未上传的块', 'missing': missing}), 409
+        with upload_sessions_lock:
+            if upload_sessions.pop(session.id, None) is None:
+                return jsonify({'error': '上传会话不存在'}), 404
+        try:
+            # 各块乱序到达，摘要在提交时统一计算
+            digest = hash_file(session.part_path) if DEDUP_ENABLED else None
+            final_name = publish_file(session.part_path, session.name, digest, session.ttl)
+        except OSError as e:
+            print(f"保存文件失败: {e}")
+            with upload_sessions_lock:
+                upload_sessions[session.id] = session
+            return jsonify({'error': '文件保存失败'}), 500
+        session.discard()
+    storage.release(session.size)
+    return jsonify({'message': '上传成功', 'name': final_name})
+
+@app.route('/upload/<upload_id>', methods=['DELETE'])
+def upload_abort(upload_id):
+    session = get_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    with upload_sessions_lock:
+        if upload_sessions.pop(session.id, None) is None:
+            return jsonify({'error': '上传会话不存在'}), 404
+    with session.lock:
+        session.discard()
+    storage.release(session.size)
+    return jsonify({'message': '已取消'})
 
 @app.route('/files')
 def list_files():
-    files = scan_local_files()
-    # 按时间排序
-    files.sort(key=lambda x: x['timestamp'], reverse=True)
-    return jsonify(files)
+    file_index.refresh()
+    etag = file_index.etag()
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    # 列表未变化时直接返回 304
+    if request.if_none_match.contains(etag.strip('"')):
+        return Response(status=304, headers=headers)
+
+    if 'dir' in request.args:
+        return list_directory(request.args['dir'], headers)
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        # 增量模式：只返回 since 之后的变化；游标失效时返回完整列表。
+        # files=0 时（网页分页浏览）只告知需要重新加载，不发送完整列表
+        delta = None
+        if request.args.get('epoch', file_index.epoch) == file_index.epoch:
+            delta = file_index.delta(since)
+        if delta is None and request.args.get('files') == '0':
+            generation = file_index.generation
+            headers['ETag'] = f'"{file_index.epoch}-{generation}"'
+            return jsonify({'epoch': file_index.epoch, 'generation': generation, 'full': True}), 200, headers
+        if delta is None:
+            # 复用缓存好的列表 JSON，不再重新序列化
+            body, generation = file_index.listing()
+            head = json.dumps({'epoch': file_index.epoch, 'generation': generation, 'full': True})
+            headers['ETag'] = f'"{file_index.epoch}-{generation}"'
+            return Response(head[:-1].encode() + b', "files": ' + body + b'}',
+                            mimetype='application/json', headers=headers)
+        headers['ETag'] = f'"{file_index.epoch}-{delta["generation"]}"'
+        return Response(json.dumps(delta, ensure_ascii=False), mimetype='application/json', headers=headers)
+
+    # 直接返回索引中按时间排序好的列表
+    body, generation = file_index.listing()
+    headers['ETag'] = f'"{file_index.epoch}-{generation}"'
+    headers['X-Files-Epoch'] = file_index.epoch
+    headers['X-Files-Generation'] = str(generation)
+    return Response(body, mimetype='application/json', headers=headers)
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, ensure_ascii=False).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, sort):
+    key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if not isinstance(key, list) or len(key) != 3 or key[0] not in (0, 1) or not isinstance(key[2], str):
+        raise ValueError(cursor)
+    # 排序键的第二项：目录和按名称排序时为字符串，否则为整数
+    expected = str if key[0] == 0 or sort == 'name' else int
+    if type(key[1]) is not expected:
+        raise ValueError(cursor)
+    return tuple(key)
+
+# 目录浏览：?dir=路径&sort=time|name|size&limit=N&cursor=...，子目录在前。
+# 游标是上一页最后一项的排序键，翻页期间有增删也不会重复或跳过未变化的项
+def list_directory(path, headers):
+    path = safe_path(path) if path.strip('/') else ''
+    sort = request.args.get('sort', 'time')
+    limit = request.args.get('limit', LIST_PAGE_SIZE, type=int)
+    if path is None or sort not in LIST_SORTS or limit <= 0:
+        return jsonify({'error': '无效的列表参数'}), 400
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'], sort)
+        except ValueError:
+            return jsonify({'error': '无效的分页游标'}), 400
+    page = file_index.page(path, sort, after, min(limit, LIST_PAGE_MAX))
+    if page is None:
+        return jsonify({'error': '目录不存在'}), 404
+    after = page.pop('next')
+    page['next_cursor'] = encode_cursor(after) if after is not None else None
+    headers['ETag'] = f'"{page["epoch"]}-{page["generation"]}"'
+    return Response(json.dumps(page, ensure_ascii=False), mimetype='application/json', headers=headers)
 
-@app.route('/download/<file_id>')
+# 时间参数：毫秒时间戳或 ISO 日期/时间（本地时间）
+def parse_time_param(value):
+    if value is None or value == '':
+        return None
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return int(datetime.datetime.fromisoformat(value).timestamp() * 1000)
+
+# 搜索：/search?q=词语&ext=jpg,png&min_size=&max_size=&after=&before=&dir=&sort=&limit=&cursor=
+# q 按空白分词，每个词都须出现在文件名中（忽略大小写），也可写 ext:jpg；
+# before 不含当天（按日期给出时即 before 那天 0 点之前）。结果分页方式与目录浏览相同
+@app.route('/search')
+def search_files():
+    file_index.refresh()
+    etag = file_index.etag()
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains(etag.strip('"')):
+        return Response(status=304, headers=headers)
+
+    terms = []
+    exts = {ext.strip().lstrip('.').casefold() for ext in request.args.get('ext', '').split(',') if ext.strip()}
+    for word in request.args.get('q', '').casefold().split():
+        if word.startswith('ext:'):
+            exts.update(ext.lstrip('.') for ext in word[4:].split(',') if ext)
+        else:
+            terms.append(word)
+    folder = request.args.get('dir', '')
+    folder = safe_path(folder) if folder.strip('/') else ''
+    sort = request.args.get('sort', 'time')
+    limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+    try:
+        min_size = request.args.get('min_size', type=int)
+        max_size = request.args.get('max_size', type=int)
+        after = parse_time_param(request.args.get('after'))
+        before = parse_time_param(request.args.get('before'))
+        cursor = request.args.get('cursor')
+        cursor = decode_cursor(cursor, sort) if cursor else None
+    except (ValueError, OverflowError, OSError):
+        return jsonify({'error': '无效的搜索参数'}), 400
+    if folder is None or sort not in LIST_SORTS or limit <= 0:
+        return jsonify({'error': '无效的搜索参数'}), 400
+
+    total, items, next_key = search_index.search(
+        terms, exts, min_size, max_size, after, before, folder, sort, cursor, min(limit, LIST_PAGE_MAX))
+    return Response(json.dumps({
+        'epoch': file_index.epoch,
+        'generation': file_index.generation,
+        'total': total,
+        'items': items,
+        'next_cursor': encode_cursor(next_key) if next_key is not None else None
+    }, ensure_ascii=False), mimetype='application/json', headers=headers)
+
+@app.route('/events')
+def events():
+    # 事件流由独立端口上的 EventHub 提供，这里只负责重定向
+    if event_hub.port is None:
+        return jsonify({'error': '事件推送未启用'}), 503
+    host = urllib.parse.urlsplit('//' + request.host).hostname
+    if ':' in host:
+        host = f'[{host}]'
+    return Response(status=307, headers={
+        'Location': f'http://{host}:{event_hub.port}/events',
+        'Cache-Control': 'no-store'
+    })
+
+@app.route('/download/<path:file_id>')
 def download_file(file_id):
     try:
-        # 解码文件名
-        file_name = file_id
+        # 文件 id 是相对上传目录的路径，拒绝 '..' 等越出上传目录的路径
+        file_name = safe_path(file_id)
+        if file_name is None:
+            return jsonify({'error': '文件不存在'}), 404
         file_path = os.path.join(UPLOAD_FOLDER, file_name)
         
-        print(f"下载文件路径: {file_path}")  # 调试信息
-        
-        if not os.path.exists(file_path):
-            print(f"文件不存在: {file_path}")  # 调试信息
+        if not os.path.isfile(file_path):
             return jsonify({'error': '文件不存在'}), 404
         
         # 获取文件信息
-        file_size = os.path.getsize(file_path)
-        print(f"文件大小: {file_size} bytes")  # 调试信息
+        stat = os.stat(file_path)
+        file_size = stat.st_size
+
+        # ETag 取自文件内容摘要；大文件摘要尚未算出时暂用基于大小和 mtime 的弱 ETag
+        digest = hash_cache.digest(file_path, stat)
+        etag_value = digest or f'{file_size:x}-{stat.st_mtime_ns:x}'
+
+        # 完整下载时按 Accept-Encoding 协商压缩；压缩后的表示使用单独的 ETag
+        encoding = None
+        if 'Range' not in request.headers:
+            encoding = negotiate_encoding(file_path, file_name, stat)
+            if encoding:
+                etag_value = f'{etag_value}-{encoding}'
+        etag = quote_etag(etag_value, weak=digest is None)
         
-        # 设置响应头
+        # 设置响应头；no-cache 要求客户端每次用 ETag 重新验证，文件被替换后不会读到旧内容
         response_headers = {
             'Content-Type': 'application/octet-stream',
-            'Content-Disposition': f'attachment; filename="{urllib.parse.quote(file_name)}"',
+            'Content-Disposition': f'attachment; filename="{urllib.parse.quote(os.path.basename(file_name))}"',
             'Content-Length': str(file_size),
-            'Cache-Control': 'public, max-age=3600',
+            'Cache-Control': 'no-cache',
             'Accept-Ranges': 'bytes',
-            'ETag': hashlib.md5(file_name.encode()).hexdigest()
+            'ETag': etag,
+            'Last-Modified': http_date(stat.st_mtime),
+            'Vary': 'Accept-Encoding'
         }
 
-        # 支持断点续传
+        if not_modified(etag_value, stat):
+            del response_headers['Content-Length']
+            return Response(status=304, headers=response_headers)
+
+        # 支持断点续传；If-Range 不匹配（文件已变化）时忽略 Range，返回完整文件
+        ranges = None
         range_header = request.headers.get('Range')
-        if range_header:
-            start, end = range_header.replace('bytes=', '').split('-')
-            start = int(start)
-            end = int(end) if end else file_size - 1
-            
-            if start >= file_size:
-                return jsonify({'error': '无效的Range请求'}), 416
-                
-            length = end - start + 1
-            response_headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
-            response_headers['Content-Length'] = str(length)
-            
+        if range_header and if_range_matches(digest, stat):
+            ranges = parse_ranges(range_header, file_size)
+
+        # 每次传输只记一次访问：续传和分段下载中不从开头开始的请求不计入
+        if request.method == 'GET' and (ranges is None or any(start == 0 for start, _ in ranges)):
+            storage.touch(file_name)
+
+        if encoding:
+            return compressed_response(file_path, digest, encoding, response_headers)
+
+        if ranges is None:
+            # 完整文件下载
             return Response(
-                file_sender(file_path, start, end),
-                206,
+                file_body(file_path, 0, file_size - 1),
                 headers=response_headers,
                 direct_passthrough=True
             )
-        else:
-            # 完整文件下载
+
+        if not ranges:
+            del response_headers['Content-Length']
+            response_headers['Content-Range'] = f'bytes */{file_size}'
+            return Response(status=416, headers=response_headers)
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response_headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+            response_headers['Content-Length'] = str(end - start + 1)
             return Response(
-                file_sender(file_path, 0, file_size - 1),
+                file_body(file_path, start, end),
+                206,
                 headers=response_headers,
                 direct_passthrough=True
             )
+
+        # 多个区间：multipart/byteranges，各部分依次从文件流式发送
+        boundary = os.urandom(12).hex()
+        parts = [(multipart_range_header(boundary, start, end, file_size), start, end)
+                 for start, end in ranges]
+        closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+        length = sum(len(head) + end - start + 1 for head, start, end in parts) + len(closing)
+        response_headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+        response_headers['Content-Length'] = str(length)
+        return Response(
+            multipart_range_sender(file_path, parts, closing, request.remote_addr),
+            206,
+            headers=response_headers,
+            direct_passthrough=True
+        )
             
     except Exception as e:
         print(f"下载文件出错: {str(e)}")
         return jsonify({'error': '文件下载失败'}), 500
 
-def file_sender(file_path, start, end):
+# 解析 Range 头（RFC 7233）：支持 start-end、start-、-suffix 及多个区间，
+# end 超出文件末尾时截断到末尾。返回按起点排序并合并了重叠/相邻区间的 (start, end) 列表；
+# 语法无效或区间过多时返回 None（忽略 Range），没有可满足的区间时返回 []（416）
+# 只接受 ASCII 数字：str.isdigit() 对 '²' 等字符也返回 True，int() 却会抛出 ValueError
+def is_digits(value):
+    return value.isascii() and value.isdigit()
+
+def parse_ranges(header, size):
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    specs = [part.strip() for part in spec.split(',') if part.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for part in specs:
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep:
+            return None
+        if not first:
+            # 后缀区间：最后 N 个字节
+            if not is_digits(last):
+                return None
+            suffix = int(last)
+            if suffix > 0 and size > 0:
+                ranges.append((max(0, size - suffix), size - 1))
+            continue
+        if not is_digits(first) or (last and not is_digits(last)):
+            return None
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def multipart_range_header(boundary, start, end, size):
+    return (f'\r\n--{boundary}\r\n'
+            'Content-Type: application/octet-stream\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode('ascii')
+
+def multipart_range_sender(file_path, parts, closing, client=None):
+    for head, start, end in parts:
+        yield head
+        yield from file_sender(file_path, start, end, client)
+    yield closing
+
+# 已经压缩过的格式（按文件头识别），再次压缩没有收益
+COMPRESSED_MAGIC = (
+    b'PK\x03\x04', b'\x1f\x8b', b'\x28\xb5\x2f\xfd', b'\xfd7zXZ\x00', b'BZh', b'7z\xbc\xaf',
+    b'Rar!', b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF', b'\x1a\x45\xdf\xa3', b'OggS',
+    b'ID3', b'fLaC', b'%PDF', b'\x04\x22\x4d\x18', b'wOF2', b'wOFF'
+)
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/xml', 'application/javascript', 'application/x-javascript',
+    'application/x-sh', 'application/x-tar', 'application/sql', 'application/x-sql',
+    'application/rtf', 'application/x-ndjson', 'image/svg+xml', 'image/bmp'
+)
+
+compressible_cache = {}
+
+def is_compressible(file_path, file_name, stat):
+    key = hash_cache.key(stat)
+    result = compressible_cache.get(key)
+    if result is not None:
+        return result
     try:
-        print(f"开始发送文件: {file_path}")  # 调试信息
         with open(file_path, 'rb') as f:
-            f.seek(start)
-            remaining = end - start + 1
-            chunk_size = 16 * 1024 * 1024  # 16MB chunks
-            
-            while remaining > 0:
-                read_size = min(chunk_size, remaining)
-                try:
-                    chunk = f.read(read_size)
-                    if not chunk:
-                        print("文件读取完成")  # 调试信息
-                        break
-                    yield chunk
-                    remaining -= read_size
-                except Exception as e:
-                    print(f"文件读取出错: {str(e)}")  # 调试信息
-                    raise
-    except Exception as e:
-        print(f"文件发送出错: {str(e)}")  # 调试信息
-        raise
+            head = f.read(4096)
+    except OSError:
+        return False
+    mime = mimetypes.guess_type(file_name)[0]
+    if any(head.startswith(magic) for magic in COMPRESSED_MAGIC) or head[4:8] == b'ftyp':
+        result = False
+    elif mime and (mime.startswith('text/') or mime in COMPRESSIBLE_TYPES or mime.endswith(('+xml', '+json'))):
+        result = True
+    elif mime is None or mime == 'application/octet-stream':
+        # 未知类型：开头没有 NUL 且能按 UTF-8 解码时视为文本（如 .log 文件）
+        result = b'\0' not in head
+        try:
+            head.decode('utf-8')
+        except UnicodeDecodeError as e:
+            # 只允许末尾被截断的多字节字符
+            result = result and e.start >= len(head) - 3 and len(head) == 4096
+    else:
+        result = False
+    if len(compressible_cache) > 100000:
+        compressible_cache.clear()
+    compressible_cache[key] = result
+    return result
+
+def available_encodings():
+    # 服务器偏好顺序
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
 
-def rate_limited_stream(stream, max_speed, chunk_size=4*1024*1024):
-    buffer = b''
+def negotiate_encoding(file_path, file_name, stat):
+    if not COMPRESS_ENABLED or stat.st_size < COMPRESS_MIN_SIZE:
+        return None
+    accept = request.accept_encodings
+    candidates = [e for e in available_encodings() if accept.quality(e) > 0]
+    if not candidates or not is_compressible(file_path, file_name, stat):
+        return None
+    return max(candidates, key=accept.quality)
+
+class StreamCompressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'zstd':
+            self.obj = zstandard.ZstdCompressor(level=3).compressobj()
+        elif encoding == 'br':
+            self.obj = brotli.Compressor(quality=4)
+        else:
+            self.obj = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self.obj.process(data)
+        return self.obj.compress(data)
+
+    def flush(self):
+        if self.encoding == 'br':
+            return self.obj.finish()
+        return self.obj.flush()
+
+def compressed_response(file_path, digest, encoding, headers):
+    headers = dict(headers)
+    headers['Content-Encoding'] = encoding
+    del headers['Content-Length']
+    # 摘要已知时缓存压缩结果，同一内容的后续下载直接发送缓存文件
+    cache_path = state_path('compressed', f'{digest}.{encoding}') if digest else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            os.utime(cache_path)
+            size = os.path.getsize(cache_path)
+            headers['Content-Length'] = str(size)
+            return Response(file_body(cache_path, 0, size - 1), headers=headers, direct_passthrough=True)
+        except OSError:
+            pass
+    return Response(rate_limited_stream(compress_sender(file_path, encoding, cache_path), request.remote_addr),
+                    headers=headers, direct_passthrough=True)
+
+def compress_sender(file_path, encoding, cache_path):
+    compressor = StreamCompressor(encoding)
+    tmp_path = f'{cache_path}.{os.urandom(6).hex()}.tmp' if cache_path else None
+    cache = open(tmp_path, 'wb') if tmp_path else None
+    complete = False
+    try:
+        with open(file_path, 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block:
+                    break
+                out = compressor.compress(block)
+                if out:
+                    if cache:
+                        cache.write(out)
+                    yield out
+        out = compressor.flush()
+        if cache:
+            cache.write(out)
+        complete = True
+        yield out
+    finally:
+        if cache:
+            cache.close()
+            # 客户端中途断开时缓存不完整，直接丢弃
+            if complete:
+                os.replace(tmp_path, cache_path)
+                trim_cache('compressed', COMPRESS_CACHE_MAX)
+            else:
+                discard_file(tmp_path)
+
+# 按最近使用时间（命中时会更新 mtime）淘汰缓存目录中的文件，直到总大小不超过 limit；返回剩余总大小
+def trim_cache(name, limit):
+    folder = os.path.join(UPLOAD_FOLDER, STATE_DIR_NAME, name)
+    try:
+        entries = [(entry.stat(), entry.path) for entry in os.scandir(folder)
+                   if not entry.name.endswith('.tmp')]
+    except OSError:
+        return 0
+    total = sum(stat.st_size for stat, _ in entries)
+    for stat, path in sorted(entries, key=lambda entry: entry[0].st_mtime):
+        if total <= limit:
+            break
+        total -= stat.st_size
+        discard_file(path)
+    return total
+
+# zipfile 的输出目标：只追加、不可回写（没有 seek），
+# zipfile 因此对每个条目使用数据描述符，写入的数据由生成器随时取走
+class ZipStreamBuffer:
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+# 边读文件边生成 ZIP：不在内存或磁盘上预先构建归档，首字节立即发出，内存占用与归档大小无关。
+# 已压缩格式使用存储模式，大文件由 zipfile 自动使用 ZIP64
+def zip_sender(names):
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True, compresslevel=ZIP_COMPRESS_LEVEL) as archive:
+        for name in names:
+            path = os.path.join(UPLOAD_FOLDER, name)
+            try:
+                stat = os.stat(path)
+                src = open(path, 'rb')
+            except OSError as e:
+                print(f"打包时跳过文件 {name}: {e}")
+                continue
+            storage.touch(name)
+            with src:
+                info = zipfile.ZipInfo.from_file(path, arcname=name)
+                info.compress_type = (zipfile.ZIP_DEFLATED if is_compressible(path, name, stat)
+                                      else zipfile.ZIP_STORED)
+                with archive.open(info, 'w') as dst:
+                    while True:
+                        block = src.read(1024 * 1024)
+                        if not block:
+                            break
+                        dst.write(block)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            yield buffer.drain()
+    yield buffer.drain()
+
+@app.route('/download-zip', methods=['GET', 'POST'])
+def download_zip():
+    # 选中的目录打包其下全部文件并保留目录结构；未指定时打包全部文件
+    names = file_index.select(request.values.getlist('files'))
+    if not names:
+        return jsonify({'error': '文件不存在'}), 404
+    archive_name = f"localshare-{time.strftime('%Y%m%d-%H%M%S')}.zip"
+    return Response(rate_limited_stream(zip_sender(names), request.remote_addr), headers={
+        'Content-Type': 'application/zip',
+        'Content-Disposition': f'attachment; filename="{archive_name}"',
+        'Cache-Control': 'no-store'
+    }, direct_passthrough=True)
+
+TEXT_PREVIEW_TYPES = {'application/json', 'application/xml', 'application/javascript', 'application/x-sh'}
+TEXT_PREVIEW_EXTENSIONS = {'.log', '.ini', '.cfg', '.conf', '.yaml', '.yml', '.toml', '.md', '.rst'}
+
+# 按文件名判断预览类型：image / video / text，不支持时返回 None
+def preview_kind(file_name):
+    mime = mimetypes.guess_type(file_name)[0] or ''
+    if mime.startswith('image/') and mime != 'image/svg+xml':
+        return 'image' if Image is not None or FFMPEG else None
+    if mime.startswith('video/'):
+        return 'video' if FFMPEG else None
+    if (mime.startswith('text/') or mime in TEXT_PREVIEW_TYPES or
+            os.path.splitext(file_name)[1].lower() in TEXT_PREVIEW_EXTENSIONS):
+        return 'text'
+    return None
+
+def image_thumbnail(file_path, out_path):
+    if Image is None:
+        video_thumbnail(file_path, out_path)
+        return
+    with Image.open(file_path) as img:
+        # JPEG 可直接按缩小后的尺寸解码，省去大部分解码开销
+        img.draft('RGB', (THUMB_SIZE, THUMB_SIZE))
+        thumb = ImageOps.exif_transpose(img)
+        thumb.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        if thumb.mode not in ('RGB', 'L'):
+            thumb = thumb.convert('RGB')
+        thumb.save(out_path, 'JPEG', quality=80)
+
+def video_thumbnail(file_path, out_path):
+    scale = f'scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease'
+    subprocess.run([FFMPEG, '-nostdin', '-loglevel', 'error', '-threads', '1', '-i', file_path,
+                    '-frames:v', '1', '-vf', scale, '-f', 'image2', '-c:v', 'mjpeg', '-y', out_path],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=60, check=True)
+
+def text_preview(file_path, out_path):
+    with open(file_path, 'rb') as f:
+        sample = f.read(THUMB_TEXT_BYTES)
+    if b'\0' in sample:
+        raise ValueError('不是文本文件')
+    lines = sample.decode('utf-8', errors='replace').splitlines()[:THUMB_TEXT_LINES]
+    with open(out_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+# 预览生成：固定数量的低优先级后台线程依次处理队列，上传和列表请求只负责入队。
+# 结果按 (设备, inode, 大小, mtime) 缓存到 .localshare/thumbs，文件被替换后自然失效，
+# 缓存总大小超过上限时按最近使用时间淘汰
+class ThumbnailPool:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = collections.deque()
+        self.jobs = {}           # 文件名 -> 完成时触发的 Event（排队中或生成中）
+        self.failed = set()      # 生成失败的缓存路径，不再重试
+        self.workers = 0
+        self.cache_size = None
+
+    def cache_path(self, stat, kind):
+        name = hashlib.sha1(hash_cache.key(stat).encode()).hexdigest()
+        return state_path('thumbs', name + ('.txt' if kind == 'text' else '.jpg'))
+
+    def on_change(self, generation, op, name, info):
+        # 在 file_index 的锁内调用：只入队，不访问文件
+        if op == 'add' and THUMB_ENABLED and preview_kind(name):
+            self.schedule(name)
+
+    def schedule(self, name, urgent=False):
+        # 返回生成完成时触发的 Event；队列已满且不急需时放弃，返回 None
+        with self.lock:
+            event = self.jobs.get(name)
+            if event is not None:
+                if urgent and name in self.queue:
+                    self.queue.remove(name)
+                    self.queue.appendleft(name)
+                return event
+            if not urgent and len(self.queue) >= THUMB_QUEUE_MAX:
+                return None
+            event = self.jobs[name] = threading.Event()
+            if urgent:
+                self.queue.appendleft(name)
+            else:
+                self.queue.append(name)
+            if self.workers < THUMB_WORKERS:
+                self.workers += 1
+                threading.Thread(target=self._work, name='thumbnail-worker', daemon=True).start()
+            return event
+
+    def _work(self):
+        # 只降低本线程（及其启动的 ffmpeg）的优先级
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), THUMB_NICE)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.workers -= 1
+                    return
+                name = self.queue.popleft()
+            try:
+                self.generate(name)
+            except Exception as e:
+                print(f"生成预览失败: {name}: {e}")
+            finally:
+                with self.lock:
+                    event = self.jobs.pop(name)
+                event.set()
+
+    def generate(self, name):
+        file_path = os.path.join(UPLOAD_FOLDER, name)
+        kind = preview_kind(name)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        cache_path = self.cache_path(stat, kind)
+        if kind is None or cache_path in self.failed or os.path.exists(cache_path):
+            return
+        tmp_path = f'{cache_path}.{os.urandom(6).hex()}.tmp'
+        try:
+            if kind == 'image' and stat.st_size > THUMB_IMAGE_MAX:
+                raise ValueError('图片过大')
+            if kind == 'image':
+                image_thumbnail(file_path, tmp_path)
+            elif kind == 'video':
+                video_thumbnail(file_path, tmp_path)
+            else:
+                text_preview(file_path, tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            with self.lock:
+                self.failed.add(cache_path)
+            discard_file(tmp_path)
+            raise
+        with self.lock:
+            if self.cache_size is not None:
+                self.cache_size += size
+            trim = self.cache_size is None or self.cache_size > THUMB_CACHE_MAX
+        if trim:
+            total = trim_cache('thumbs', THUMB_CACHE_MAX)
+            with self.lock:
+                self.cache_size = total
+
+thumbnail_pool = ThumbnailPool()
+file_index.listeners.append(thumbnail_pool.on_change)
+
+# 预览：图片和视频返回 JPEG 缩略图，文本返回开头若干行。
+# 带 ?v=（文件大小与时间）请求时内容不会变化，允许长期缓存
+@app.route('/thumb/<path:file_id>')
+def thumbnail(file_id):
+    file_name = safe_path(file_id)
+    kind = preview_kind(file_name) if file_name and THUMB_ENABLED else None
+    if kind is None:
+        return jsonify({'error': '无法预览'}), 404
+    try:
+        stat = os.stat(os.path.join(UPLOAD_FOLDER, file_name))
+    except OSError:
+        return jsonify({'error': '文件不存在'}), 404
+    if not S_ISREG(stat.st_mode):
+        return jsonify({'error': '文件不存在'}), 404
+
+    cache_path = thumbnail_pool.cache_path(stat, kind)
+    etag = os.path.splitext(os.path.basename(cache_path))[0]
+    headers = {
+        'Content-Type': 'text/plain; charset=utf-8' if kind == 'text' else 'image/jpeg',
+        'ETag': quote_etag(etag),
+        'Cache-Control': 'public, max-age=31536000, immutable' if 'v' in request.args else 'no-cache'
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    # 还没生成时插到队首，等待后台线程完成；生成的并发度仍由线程数限制。
+    # 正在进行的可能是文件改动前的任务，完成后仍没有结果时重新排队
+    deadline = time.monotonic() + THUMB_WAIT
+    while not os.path.exists(cache_path):
+        if cache_path in thumbnail_pool.failed:
+            return jsonify({'error': '无法预览'}), 404
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not thumbnail_pool.schedule(file_name, urgent=True).wait(remaining):
+            return jsonify({'error': '预览生成中'}), 503, {'Retry-After': '2'}
+    try:
+        os.utime(cache_path)
+        size = os.path.getsize(cache_path)
+    except OSError:
+        return jsonify({'error': '无法预览'}), 404
+    headers['Content-Length'] = str(size)
+    return Response(file_body(cache_path, 0, size - 1), headers=headers, direct_passthrough=True)
+
+# 文件的分块摘要清单，fetch 客户端据此并行下载各区间并逐块校验。
+# 清单在上传或计算文件摘要时一并生成；大文件尚未算出时转入后台计算并返回 503
+@app.route('/manifest/<path:file_id>')
+def file_manifest(file_id):
+    if not MANIFEST_ENABLED:
+        return jsonify({'error': '分块清单未启用'}), 404
+    file_name = safe_path(file_id)
+    if file_name is None:
+        return jsonify({'error': '文件不存在'}), 404
+    file_path = os.path.join(UPLOAD_FOLDER, file_name)
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return jsonify({'error': '文件不存在'}), 404
+    if not S_ISREG(stat.st_mode):
+        return jsonify({'error': '文件不存在'}), 404
+
+    digest = hash_cache.digest(file_path, stat)
+    manifest = load_manifest(digest) if digest else None
+    if manifest is None and digest and stat.st_size <= HASH_SYNC_LIMIT:
+        hash_file(file_path)
+        manifest = load_manifest(digest)
+    if manifest is None:
+        hash_cache.schedule(file_path)
+        return jsonify({'error': '清单计算中'}), 503, {'Retry-After': '5'}
+    headers = {'ETag': quote_etag(digest), 'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains(digest):
+        return Response(status=304, headers=headers)
+    manifest['name'] = file_name
+    return Response(json.dumps(manifest), mimetype='application/json', headers=headers)
+
+def not_modified(etag_value, stat):
+    # If-None-Match 优先于 If-Modified-Since，且使用弱比较
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag_value)
+    if request.if_modified_since:
+        return int(stat.st_mtime) <= request.if_modified_since.timestamp()
+    return False
+
+def if_range_matches(digest, stat):
+    if 'If-Range' not in request.headers:
+        return True
+    if_range = request.if_range
+    if if_range.etag is not None:
+        # If-Range 只接受强比较，弱 ETag 一律视为不匹配（Werkzeug 解析时会去掉 W/ 前缀，这里看原始请求头）
+        if request.headers['If-Range'].lstrip().startswith('W/'):
+            return False
+        return digest is not None and if_range.etag == digest
+    if if_range.date is not None:
+        return int(stat.st_mtime) == int(if_range.date.timestamp())
+    return False
+
+def file_body(file_path, start, end):
+    # 服务器提供 wsgi.file_wrapper 时由服务器发送（内置服务器走 sendfile），
+    # 文件位置即起点，长度由 Content-Length 限定；否则退回逐块读取的生成器
+    file_wrapper = request.environ.get('wsgi.file_wrapper') if SENDFILE_ENABLED else None
+    if file_wrapper is None:
+        return file_sender(file_path, start, end, request.remote_addr)
+    f = open(file_path, 'rb')
+    f.seek(start)
+    return file_wrapper(f, 1024 * 1024)
+
+def file_sender(file_path, start, end, client=None):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        chunk_size = 16 * 1024 * 1024  # 16MB chunks
+        
+        while remaining > 0:
+            # 限速时每次只读取一个配额，读到的块直接发送，不再切分
+            read_size = download_shaper.acquire(client, min(chunk_size, remaining))
+            if METRICS_ENABLED:
+                started = time.perf_counter()
+                chunk = f.read(read_size)
+                record_disk('read', len(chunk), started)
+            else:
+                chunk = f.read(read_size)
+            if not chunk:
+                # 文件在发送过程中被截断
+                break
+            yield chunk
+            remaining -= len(chunk)
+
+# 令牌桶：reserve 总是立即记账并返回需要等待的秒数，令牌可以为负（欠账）。
+# 后来的预留排在前面的欠账之后，各传输每次只预留一个配额，因此按到达顺序轮流发送，
+# 持续有数据的传输平分带宽，用不满份额的传输（如慢客户端）让出的部分由其他传输分享
+class TokenBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate * RATE_BURST
+        self.stamp = time.monotonic()
+
+    def reserve(self, size):
+        now = time.monotonic()
+        self.tokens = min(self.rate * RATE_BURST, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= size
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+# 一个方向（下载或上传）的流量整形：总速率一个令牌桶，每个客户端地址各一个令牌桶
+class TrafficShaper:
+    def __init__(self, rate=0, client_rate=0):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.client_rate = 0
+        self.bucket = None
+        self.clients = {}        # 客户端地址 -> TokenBucket
+        self.last_prune = time.monotonic()
+        self.configure(rate, client_rate)
+
+    def configure(self, rate, client_rate):
+        with self.lock:
+            self.rate = max(0, int(rate))
+            self.client_rate = max(0, int(client_rate))
+            self.bucket = TokenBucket(self.rate) if self.rate else None
+            for bucket in self.clients.values():
+                bucket.rate = self.client_rate
+                bucket.tokens = min(bucket.tokens, self.client_rate * RATE_BURST)
+            if not self.client_rate:
+                self.clients.clear()
+
+    def quantum(self):
+        # 每次预留的字节数：约 20 毫秒的流量，限制在 16KB 到 1MB 之间；不限速时为 0
+        rates = [rate for rate in (self.rate, self.client_rate) if rate]
+        if not rates:
+            return 0
+        return min(1024 * 1024, max(16 * 1024, min(rates) // 50))
+
+    def acquire(self, client, size):
+        # 等到可以发送时返回本次允许的字节数（不超过 size）；不限速时立即返回 size
+        quantum = self.quantum()
+        if not quantum:
+            return size
+        size = min(size, quantum)
+        # 先按客户端限速等待，再占用总带宽，避免被单个客户端的限速拖住的预留占着总带宽
+        delay = 0
+        with self.lock:
+            if self.client_rate:
+                bucket = self.clients.get(client)
+                if bucket is None:
+                    bucket = self.clients[client] = TokenBucket(self.client_rate)
+                delay = bucket.reserve(size)
+                self._prune()
+        if delay:
+            time.sleep(delay)
+        delay = 0
+        with self.lock:
+            if self.bucket is not None:
+                delay = self.bucket.reserve(size)
+        if delay:
+            time.sleep(delay)
+        return size
+
+    def _prune(self):
+        # 清理长时间没有流量的客户端令牌桶（它们早已恢复满额，与新建的等价）
+        now = time.monotonic()
+        if now - self.last_prune < 10:
+            return
+        self.last_prune = now
+        for client, bucket in list(self.clients.items()):
+            if now - bucket.stamp > 10:
+                del self.clients[client]
+
+    def to_dict(self):
+        with self.lock:
+            return {'rate': self.rate, 'client_rate': self.client_rate, 'clients': len(self.clients)}
+
+download_shaper = TrafficShaper(RATE_LIMIT_DOWN, CLIENT_RATE_LIMIT_DOWN)
+upload_shaper = TrafficShaper(RATE_LIMIT_UP, CLIENT_RATE_LIMIT_UP)
+
+# 按下载限速发送任意数据流：不超过配额的块原样发送，
+# 更大的块通过 memoryview 切片，每个字节只复制一次；不限速时不做任何处理
+def rate_limited_stream(stream, client, shaper=download_shaper):
     for chunk in stream:
-        buffer += chunk
-        while len(buffer) >= chunk_size:
-            yield buffer[:chunk_size]
-            buffer = buffer[chunk_size:]
-            time.sleep(chunk_size / max_speed)
-    if buffer:
-        yield buffer
+        view = memoryview(chunk)
+        while len(view):
+            size = shaper.acquire(client, len(view))
+            if size >= len(view):
+                yield chunk if len(view) == len(chunk) else bytes(view)
+                break
+            yield bytes(view[:size])
+            view = view[size:]
+
+# 按上传限速读取请求体，每次读取不超过一个配额
+class ShapedReader:
+    def __init__(self, raw, shaper, client, transfer=None):
+        self.raw = raw
+        self.shaper = shaper
+        self.client = client
+        self.transfer = transfer
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = UPLOAD_READ_SIZE
+        data = self.raw.read(self.shaper.acquire(self.client, size))
+        if data:
+            if self.transfer is not None:
+                self.transfer.done += len(data)
+            if METRICS_ENABLED:
+                bytes_received.inc(len(data))
+        return data
+
+def parse_rate(value):
+    # 解析 10M、512K、1.5G 这样的字节数（1K = 1024），0 表示不限
+    value = str(value).strip().upper().rstrip('B').rstrip('I')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+# 运行时查看和修改限速；只接受本机请求
+@app.route('/admin/limits', methods=['GET', 'POST'])
+def admin_limits():
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'error': '只允许本机访问'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': '无效的限速参数'}), 400
+        try:
+            for shaper, prefix in ((download_shaper, 'download'), (upload_shaper, 'upload')):
+                rate = parse_rate(data.get(prefix, shaper.rate))
+                client_rate = parse_rate(data.get(f'client_{prefix}', shaper.client_rate))
+                if rate < 0 or client_rate < 0:
+                    raise ValueError(rate)
+                shaper.configure(rate, client_rate)
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'error': '无效的限速参数'}), 400
+    return jsonify({'download': download_shaper.to_dict(), 'upload': upload_shaper.to_dict()})
+
+# 运行时查看存储用量、修改配额和默认保留时间；只接受本机请求
+@app.route('/admin/storage', methods=['GET', 'POST'])
+def admin_storage():
+    global QUOTA_TOTAL, QUOTA_FILE, FILE_TTL
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'error': '只允许本机访问'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': '无效的配额参数'}), 400
+        try:
+            quota = parse_rate(data.get('quota', QUOTA_TOTAL))
+            file_quota = parse_rate(data.get('file_quota', QUOTA_FILE))
+            ttl = parse_duration(data.get('ttl', FILE_TTL))
+            if quota < 0 or file_quota < 0:
+                raise ValueError(quota)
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'error': '无效的配额参数'}), 400
+        QUOTA_TOTAL, QUOTA_FILE, FILE_TTL = quota, file_quota, ttl
+        storage.wakeup.set()
+    return jsonify(storage.to_dict())
+
+# wsgi.file_wrapper 实现：响应头发出后由内核把文件直接写入 socket，
+# 不经过 Python 堆内存；socket.sendfile 在不支持的平台上自动退回 send
+class SendfileFileWrapper:
+    def __init__(self, handler, filelike, blksize=1024 * 1024):
+        self.handler = handler
+        self.filelike = filelike
+        self.blksize = blksize
+
+    def __iter__(self):
+        # 先产出空块，让 werkzeug 发送响应头
+        yield b''
+        count = self.handler.response_length
+        if not count:
+            return
+        # 分段调用 sendfile，每段前按下载限速等待；不限速时每段 64MB，运行中修改的限速也能及时生效
+        client = self.handler.client_address[0]
+        offset = self.filelike.tell()
+        transfer = self.handler.environ.get('localshare.transfer')
+        while count > 0:
+            size = download_shaper.acquire(client, min(count, 64 * 1024 * 1024))
+            sent = self.handler.connection.sendfile(self.filelike, offset, size)
+            if not sent:
+                break
+            if transfer is not None:
+                transfer.done += sent
+            if METRICS_ENABLED:
+                bytes_sent.inc(sent)
+            offset += sent
+            count -= sent
+        if count:
+            # 文件在发送过程中被截断，只能关闭连接让客户端察觉
+            self.handler.close_connection = True
+
+    def close(self):
+        self.filelike.close()
+
+class LocalShareRequestHandler(WSGIRequestHandler):
+    response_length = None
+    environ = {}
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ['wsgi.file_wrapper'] = functools.partial(SendfileFileWrapper, self)
+        self.environ = environ
+        return environ
+
+    def send_response(self, code, message=None):
+        self.response_length = None
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        # 记录 Content-Length，供 SendfileFileWrapper 确定发送长度
+        if keyword.lower() == 'content-length':
+            self.response_length = int(value)
+        super().send_header(keyword, value)
+
+    def log_request(self, code='-', size='-'):
+        if ACCESS_LOG:
+            super().log_request(code, size)
+
+# 内置生产服务器：固定大小的线程池处理连接，不再为每个连接新建线程；
+# 已接受的连接数达到上限时暂停 accept，新连接在内核监听队列中等待
+class PooledWSGIServer(BaseWSGIServer):
+    multithread = True
+
+    def __init__(self, host, port, app, workers, max_connections, backlog=SERVER_BACKLOG):
+        self.request_queue_size = backlog
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='http-worker')
+        self.slots = threading.BoundedSemaphore(max_connections)
+        LocalShareRequestHandler.timeout = REQUEST_TIMEOUT or None
+        super().__init__(host, port, app, handler=LocalShareRequestHandler)
+
+    def get_request(self):
+        self.slots.acquire()
+        try:
+            conn, addr = super().get_request()
+        except OSError:
+            self.slots.release()
+            raise
+        if SOCKET_SNDBUF:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF)
+        if SOCKET_RCVBUF:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+        return conn, addr
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def handle_error(self, request, client_address):
+        if not self.passthrough_errors:
+            super().handle_error(request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+def serve(host, port):
+    if SERVER_MODE == 'dev':
+        app.run(host=host, port=port, threaded=True, request_handler=LocalShareRequestHandler)
+    elif SERVER_MODE == 'waitress':
+        try:
+            import waitress
+        except ImportError:
+            print("未安装 waitress，请先执行 pip install waitress")
+            sys.exit(1)
+        # 缓冲区大小设置在监听 socket 上，由接受的连接继承
+        socket_options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)]
+        if SOCKET_SNDBUF:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF))
+        if SOCKET_RCVBUF:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF))
+        waitress.serve(app, host=host, port=port, threads=SERVER_WORKERS,
+                       connection_limit=SERVER_MAX_CONNECTIONS, backlog=SERVER_BACKLOG,
+                       channel_timeout=REQUEST_TIMEOUT or 120, socket_options=socket_options)
+    else:
+        server = PooledWSGIServer(host, port, app, SERVER_WORKERS, SERVER_MAX_CONNECTIONS)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
 
 # HTML模板保持不变，但移除用户ID相关的HTML部分
 HTML_TEMPLATE = '''
@@ -231,11 +3733,83 @@ HTML_TEMPLATE = '''
             padding: 15px;
             margin-bottom: 10px;
             display: flex;
+            flex-wrap: wrap;
             justify-content: space-between;
             align-items: center;
         }
-        .file-info {
-            flex-grow: 1;
+        .file-info {
+            flex-grow: 1;
+        }
+        .file-select {
+            margin-right: 12px;
+            width: 18px;
+            height: 18px;
+        }
+        .ttl-option {
+            margin: 10px 0;
+            color: #666;
+        }
+        .list-toolbar {
+            display: flex;
+            align-items: center;
+            justify-content: space-between;
+            gap: 10px;
+            margin-bottom: 10px;
+        }
+        .breadcrumbs {
+            margin-bottom: 10px;
+            word-break: break-all;
+        }
+        .breadcrumbs a {
+            color: #667eea;
+            cursor: pointer;
+            text-decoration: none;
+        }
+        .dir-link {
+            cursor: pointer;
+        }
+        .thumb {
+            width: 56px;
+            height: 56px;
+            object-fit: cover;
+            border-radius: 6px;
+            margin-right: 12px;
+            background: #f0f0f0;
+            flex-shrink: 0;
+        }
+        .text-preview {
+            flex-basis: 100%;
+            max-height: 240px;
+            overflow: auto;
+            margin: 10px 0 0;
+            padding: 10px;
+            background: #f7f7f9;
+            border-radius: 6px;
+            font-size: 12px;
+            white-space: pre-wrap;
+            word-break: break-all;
+        }
+        .search-input {
+            width: 100%;
+            box-sizing: border-box;
+            padding: 10px 14px;
+            margin-bottom: 10px;
+            border: 1px solid #ddd;
+            border-radius: 25px;
+            font-size: 14px;
+        }
+        .load-more {
+            display: none;
+            margin: 15px auto 0;
+        }
+        .zip-btn {
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            padding: 8px 18px;
+            border-radius: 25px;
+            border: none;
+            cursor: pointer;
+            font-size: 14px;
         }
         .download-btn {
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
@@ -252,6 +3826,11 @@ HTML_TEMPLATE = '''
             transform: translateY(-2px);
             box-shadow: 0 2px 8px rgba(0,0,0,0.1);
         }
+        .transfer-info {
+            margin-top: 6px;
+            color: #666;
+            font-size: 0.9em;
+        }
         .status {
             margin-top: 10px;
             padding: 10px;
@@ -450,21 +4029,50 @@ HTML_TEMPLATE = '''
             <h2>上传文件</h2>
             <div class="file-input-container">
                 <input type="file" id="fileInput" class="custom-file-input" multiple>
+                <input type="file" id="folderInput" class="custom-file-input" webkitdirectory multiple>
                 <button class="file-select-btn" onclick="document.getElementById('fileInput').click()">
                     选择文件
                 </button>
+                <button class="file-select-btn" onclick="document.getElementById('folderInput').click()">
+                    选择文件夹
+                </button>
                 <div class="selected-files" id="selectedFiles">未选择文件</div>
             </div>
+            <div class="ttl-option">
+                <label>保留时间
+                    <select id="ttlSelect">
+                        <option value="">默认</option>
+                        <option value="1h">1 小时</option>
+                        <option value="1d">1 天</option>
+                        <option value="7d">7 天</option>
+                        <option value="30d">30 天</option>
+                    </select>
+                </label>
+            </div>
             <button id="uploadBtn" onclick="uploadFiles()">上传</button>
             <div class="progress-container">
                 <div class="progress-bar" id="progressBar">0%</div>
             </div>
+            <div class="transfer-info" id="transferInfo"></div>
             <div class="status"></div>
         </div>
 
         <div class="file-list">
             <h2>共享文件列表</h2>
+            <input type="search" class="search-input" id="searchInput"
+                   placeholder="在当前目录中搜索文件名，可加 ext:pdf 按扩展名筛选">
+            <div class="breadcrumbs" id="breadcrumbs"></div>
+            <div class="list-toolbar">
+                <label><input type="checkbox" id="selectAll" onchange="toggleSelectAll(this.checked)"> 全选</label>
+                <select id="sortSelect" onchange="setSort(this.value)">
+                    <option value="time">按时间</option>
+                    <option value="name">按名称</option>
+                    <option value="size">按大小</option>
+                </select>
+                <button class="zip-btn" id="zipBtn" onclick="downloadZip()">打包下载当前目录</button>
+            </div>
             <div id="fileList"></div>
+            <button class="zip-btn load-more" id="loadMoreBtn" onclick="loadMore()">加载更多</button>
         </div>
     </div>
 
@@ -485,54 +4093,344 @@ HTML_TEMPLATE = '''
             return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
         }
 
-        async function uploadFiles() {
-            const fileInput = document.getElementById('fileInput');
-            const uploadBtn = document.getElementById('uploadBtn');
+        // 超过该大小的文件使用分块上传：断线后可续传，多个块并行发送
+        const CHUNKED_THRESHOLD = 32 * 1024 * 1024;
+        const PARALLEL_CHUNKS = 4;
+        const MAX_CHUNK_RETRIES = 8;
+
+        const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+        function setProgress(loaded, total) {
             const progressBar = document.getElementById('progressBar');
-            
-            if (fileInput.files.length === 0) return;
+            const percent = total ? Math.min(100, Math.floor(loaded / total * 100)) : 100;
+            progressBar.style.width = percent + '%';
+            progressBar.textContent = percent + '%';
+        }
 
-            uploadBtn.disabled = true;
-            uploadBtn.textContent = '上传中...';
-            progressBar.style.width = '0%';
-            progressBar.textContent = '0%';
-            
+        function sendRequest(method, url, body, onProgress, headers) {
+            return new Promise((resolve, reject) => {
+                const xhr = new XMLHttpRequest();
+                xhr.open(method, url);
+                for (const [name, value] of Object.entries(headers || {})) {
+                    xhr.setRequestHeader(name, value);
+                }
+                if (onProgress) {
+                    xhr.upload.addEventListener('progress', e => onProgress(e.loaded));
+                }
+                xhr.addEventListener('load', () => {
+                    if (xhr.status >= 200 && xhr.status < 300) {
+                        resolve(xhr.responseText ? JSON.parse(xhr.responseText) : null);
+                    } else {
+                        let message = '上传失败';
+                        try {
+                            message = JSON.parse(xhr.responseText).error || message;
+                        } catch (e) {}
+                        const error = new Error(message);
+                        error.status = xhr.status;
+                        reject(error);
+                    }
+                });
+                xhr.addEventListener('error', () => reject(new Error('网络错误')));
+                xhr.send(body);
+            });
+        }
+
+        // 上传后的相对路径：文件夹上传保留目录结构，并放到当前浏览的目录下
+        function uploadName(file) {
+            const name = file.webkitRelativePath || file.name;
+            return currentDir ? `${currentDir}/${name}` : name;
+        }
+
+        // 上传文件的保留时间，空串表示使用服务器的默认值
+        function uploadTtl() {
+            return document.getElementById('ttlSelect').value;
+        }
+
+        function uploadMultipart(files, onProgress, headers) {
             const formData = new FormData();
-            for (let file of fileInput.files) {
-                formData.append('files', file);
+            for (const file of files) {
+                formData.append('files', file, uploadName(file));
             }
+            const url = uploadTtl() ? `/upload?ttl=${uploadTtl()}` : '/upload';
+            return sendRequest('POST', url, formData, onProgress, headers);
+        }
 
-            try {
-                const xhr = new XMLHttpRequest();
-                
-                xhr.upload.addEventListener('progress', function(e) {
-                    if (e.lengthComputable) {
-                        const percent = Math.round((e.loaded / e.total) * 100);
-                        progressBar.style.width = percent + '%';
-                        progressBar.textContent = percent + '%';
+        // 小文件分批合并上传，避免单个请求的文件数或大小过大
+        const BATCH_MAX_FILES = 1000;
+        const BATCH_MAX_BYTES = 256 * 1024 * 1024;
+
+        function makeBatches(files) {
+            const batches = [];
+            let batch = [];
+            let bytes = 0;
+            for (const file of files) {
+                if (batch.length && (batch.length >= BATCH_MAX_FILES || bytes + file.size > BATCH_MAX_BYTES)) {
+                    batches.push(batch);
+                    batch = [];
+                    bytes = 0;
+                }
+                batch.push(file);
+                bytes += file.size;
+            }
+            if (batch.length) batches.push(batch);
+            return batches;
+        }
+
+        async function uploadChunked(file, onProgress, headers) {
+            // 同一文件（名称、大小、修改时间相同）再次上传时服务器返回已有会话，只补传缺少的块
+            const name = uploadName(file);
+            const session = await sendRequest('POST', '/upload/init', JSON.stringify({
+                name: name,
+                size: file.size,
+                key: `${name}:${file.size}:${file.lastModified}`,
+                ttl: uploadTtl()
+            }), null, {'Content-Type': 'application/json'});
+
+            const chunkBytes = index => Math.min(session.chunk_size, file.size - index * session.chunk_size);
+            const received = new Set(session.received);
+            const pending = [];
+            let doneBytes = 0;
+            for (let i = 0; i < session.chunks; i++) {
+                if (received.has(i)) {
+                    doneBytes += chunkBytes(i);
+                } else {
+                    pending.push(i);
+                }
+            }
+            const inflight = new Map();
+            const report = () => {
+                let loaded = doneBytes;
+                inflight.forEach(n => loaded += n);
+                onProgress(loaded);
+            };
+            report();
+
+            let failed = false;
+            async function worker() {
+                while (pending.length && !failed) {
+                    const index = pending.shift();
+                    const start = index * session.chunk_size;
+                    const blob = file.slice(start, start + chunkBytes(index));
+                    for (let attempt = 0; ; attempt++) {
+                        try {
+                            await sendRequest('PUT', `/upload/${session.upload_id}/${index}`, blob, loaded => {
+                                inflight.set(index, loaded);
+                                report();
+                            }, headers);
+                            break;
+                        } catch (error) {
+                            inflight.delete(index);
+                            if (error.status === 404 || attempt >= MAX_CHUNK_RETRIES || failed) {
+                                failed = true;
+                                throw error;
+                            }
+                            // 网络中断时退避后重试该块
+                            await sleep(Math.min(30000, 1000 * 2 ** attempt));
+                        }
                     }
+                    inflight.delete(index);
+                    doneBytes += chunkBytes(index);
+                    report();
+                }
+            }
+            await Promise.all(Array.from({length: PARALLEL_CHUNKS}, worker));
+            await sendRequest('POST', `/upload/${session.upload_id}/commit`);
+        }
+
+        // 大小在两者之间的文件先计算内容摘要，一次询问服务器，已有相同内容的直接发布，不再发送数据。
+        // 小文件直接上传更快；更大的文件计算摘要的时间与在局域网中直接上传相当，也直接上传
+        const DEDUP_CHECK_MIN = 4 * 1024 * 1024;
+        const DEDUP_CHECK_LIMIT = 256 * 1024 * 1024;
+
+        function dedupCandidate(file) {
+            return file.size >= DEDUP_CHECK_MIN && file.size <= DEDUP_CHECK_LIMIT;
+        }
+
+        // crypto.subtle 只在 HTTPS 或 localhost 页面中提供，且只能一次计算整块数据，只用于不大的文件；
+        // 其余情况用下面的 SHA-256 实现按片读取文件计算，内存占用与文件大小无关
+        const SUBTLE_HASH_MAX = 32 * 1024 * 1024;
+        const HASH_SLICE = 4 * 1024 * 1024;
+        const SHA256_K = new Int32Array([
+            0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+            0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+            0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+            0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+            0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+            0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+            0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+            0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+        ]);
+
+        // 处理 bytes 开头 length 字节（64 的整数倍）中的各个数据块
+        function sha256Blocks(state, w, bytes, length) {
+            for (let p = 0; p < length; p += 64) {
+                for (let i = 0; i < 16; i++) {
+                    const j = p + i * 4;
+                    w[i] = (bytes[j] << 24) | (bytes[j + 1] << 16) | (bytes[j + 2] << 8) | bytes[j + 3];
+                }
+                for (let i = 16; i < 64; i++) {
+                    const x = w[i - 15];
+                    const y = w[i - 2];
+                    const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+                    const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+                    w[i] = w[i - 16] + s0 + w[i - 7] + s1;
+                }
+                let a = state[0], b = state[1], c = state[2], d = state[3];
+                let e = state[4], f = state[5], g = state[6], h = state[7];
+                for (let i = 0; i < 64; i++) {
+                    const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+                    const t1 = (h + S1 + ((e & f) ^ (~e & g)) + SHA256_K[i] + w[i]) | 0;
+                    const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+                    const t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+                    h = g;
+                    g = f;
+                    f = e;
+                    e = (d + t1) | 0;
+                    d = c;
+                    c = b;
+                    b = a;
+                    a = (t1 + t2) | 0;
+                }
+                state[0] += a;
+                state[1] += b;
+                state[2] += c;
+                state[3] += d;
+                state[4] += e;
+                state[5] += f;
+                state[6] += g;
+                state[7] += h;
+            }
+        }
+
+        function toHex(bytes) {
+            return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+        }
+
+        async function sha256Hex(file) {
+            if (window.crypto && crypto.subtle && file.size <= SUBTLE_HASH_MAX) {
+                return toHex(new Uint8Array(await crypto.subtle.digest('SHA-256', await file.arrayBuffer())));
+            }
+            const state = new Int32Array([
+                0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19
+            ]);
+            const w = new Int32Array(64);
+            // 每片是 64 字节的整数倍，不足一块的尾部只出现在最后一片
+            let tail = new Uint8Array(0);
+            for (let pos = 0; pos < file.size; pos += HASH_SLICE) {
+                const bytes = new Uint8Array(await file.slice(pos, pos + HASH_SLICE).arrayBuffer());
+                const whole = bytes.length - bytes.length % 64;
+                sha256Blocks(state, w, bytes, whole);
+                tail = bytes.subarray(whole);
+            }
+            // 填充：0x80、若干 0 和 64 位大端的比特长度
+            const last = new Uint8Array(tail.length < 56 ? 64 : 128);
+            last.set(tail);
+            last[tail.length] = 0x80;
+            const view = new DataView(last.buffer);
+            view.setUint32(last.length - 8, Math.floor(file.size / 0x20000000));
+            view.setUint32(last.length - 4, (file.size % 0x20000000) * 8);
+            sha256Blocks(state, w, last, last.length);
+            const digest = new DataView(new ArrayBuffer(32));
+            state.forEach((word, i) => digest.setInt32(i * 4, word));
+            return toHex(new Uint8Array(digest.buffer));
+        }
+
+        // 返回服务器上没有相同内容、仍需上传的文件；出错时全部照常上传
+        async function publishExisting(files) {
+            if (!files.length) return files;
+            try {
+                const entries = [];
+                for (const file of files) {
+                    entries.push({digest: await sha256Hex(file), name: uploadName(file)});
+                }
+                const response = await fetch('/check', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({files: entries, ttl: uploadTtl()})
                 });
+                if (!response.ok) return files;
+                const results = (await response.json()).results;
+                return files.filter((file, i) => !results[i].exists);
+            } catch (error) {
+                return files;
+            }
+        }
 
-                xhr.addEventListener('load', function() {
-                    if (xhr.status === 200) {
-                        showStatus('上传成功！', 'success');
-                        fileInput.value = '';
-                        refreshFileList();
-                    } else {
-                        throw new Error('上传失败');
+        // 上传期间每秒查询服务器实际接收的速率（同一批上传的请求带相同的 X-Progress-ID），估算剩余时间
+        function watchUpload(progressId, remaining) {
+            const info = document.getElementById('transferInfo');
+            const timer = setInterval(async () => {
+                try {
+                    const response = await fetch(`/transfers?id=${encodeURIComponent(progressId)}`);
+                    const rate = (await response.json()).totals.upload.rate;
+                    if (rate > 0) {
+                        info.textContent = `服务器接收 ${formatFileSize(rate)}/s，剩余约 ${Math.ceil(remaining() / rate)} 秒`;
                     }
-                });
+                } catch (error) {}
+            }, 1000);
+            return () => {
+                clearInterval(timer);
+                info.textContent = '';
+            };
+        }
 
-                xhr.addEventListener('error', function() {
-                    throw new Error('上传失败');
-                });
+        // 最近一次通过“选择文件”或“选择文件夹”选中的文件
+        let pendingFiles = [];
+
+        async function uploadFiles() {
+            const uploadBtn = document.getElementById('uploadBtn');
+            
+            if (pendingFiles.length === 0) return;
+
+            const selected = pendingFiles;
+            const total = selected.reduce((n, file) => n + file.size, 0);
+            let finished = 0;
+            let current = 0;
+            const onProgress = loaded => {
+                current = loaded;
+                setProgress(finished + loaded, total);
+            };
+            const headers = {'X-Progress-ID': Date.now().toString(36) + Math.random().toString(36).slice(2)};
+            const stopWatch = watchUpload(headers['X-Progress-ID'], () => total - finished - current);
+
+            uploadBtn.disabled = true;
+            uploadBtn.textContent = '上传中...';
+            setProgress(0, total);
+
+            async function send(files) {
+                const small = files.filter(file => file.size < CHUNKED_THRESHOLD);
+                const large = files.filter(file => file.size >= CHUNKED_THRESHOLD);
+                for (const batch of makeBatches(small)) {
+                    await uploadMultipart(batch, onProgress, headers);
+                    finished += batch.reduce((n, file) => n + file.size, 0);
+                    current = 0;
+                }
+                for (const file of large) {
+                    await uploadChunked(file, onProgress, headers);
+                    finished += file.size;
+                    current = 0;
+                }
+            }
 
-                xhr.open('POST', '/upload');
-                xhr.send(formData);
-                
+            try {
+                // 计算摘要与其余文件的上传同时进行
+                const candidates = selected.filter(dedupCandidate);
+                const checking = publishExisting(candidates);
+                await send(selected.filter(file => !dedupCandidate(file)));
+                const remaining = await checking;
+                for (const file of candidates) {
+                    if (!remaining.includes(file)) finished += file.size;
+                }
+                setProgress(finished + current, total);
+                await send(remaining);
+                setProgress(total, total);
+                showStatus('上传成功！', 'success');
+                selectFiles([]);
+                refreshFileList();
             } catch (error) {
                 showStatus('上传失败：' + error.message, 'error');
             } finally {
+                stopWatch();
                 uploadBtn.disabled = false;
                 uploadBtn.textContent = '上传';
             }
@@ -540,72 +4438,1115 @@ HTML_TEMPLATE = '''
 
         async function downloadFile(fileId, fileName) {
             try {
-                window.location.href = `/download/${fileId}`;
+                window.location.href = fileUrl('/download', fileId);
             } catch (error) {
                 showStatus('下载失败：' + error.message, 'error');
             }
         }
 
+        function fileUrl(prefix, fileId) {
+            return prefix + '/' + fileId.split('/').map(encodeURIComponent).join('/');
+        }
+
+        // 预览：图片和视频显示缩略图，文本文件可展开开头几行；服务器无法生成时不显示
+        const IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff'];
+        const VIDEO_EXTENSIONS = ['mp4', 'm4v', 'mov', 'mkv', 'webm', 'avi', 'mpeg', 'mpg', '3gp'];
+        const TEXT_EXTENSIONS = ['txt', 'md', 'log', 'csv', 'json', 'xml', 'yaml', 'yml', 'ini', 'cfg', 'conf',
+                                 'toml', 'py', 'js', 'css', 'html', 'sh', 'c', 'h', 'java', 'go', 'rs'];
+
+        function previewKind(name) {
+            const ext = name.includes('.') ? name.split('.').pop().toLowerCase() : '';
+            if (IMAGE_EXTENSIONS.includes(ext) || VIDEO_EXTENSIONS.includes(ext)) return 'thumb';
+            if (TEXT_EXTENSIONS.includes(ext)) return 'text';
+            return null;
+        }
+
+        // 缩略图还在生成时服务器返回 503，稍后重试几次
+        function thumbError(img) {
+            const tries = Number(img.dataset.tries || 0);
+            if (tries >= 3) {
+                img.remove();
+                return;
+            }
+            img.dataset.tries = tries + 1;
+            setTimeout(() => img.src = img.src.split('&retry=')[0] + '&retry=' + (tries + 1), 2000);
+        }
+
+        async function togglePreview(link, fileId) {
+            const item = link.closest('.file-item');
+            const existing = item.querySelector('.text-preview');
+            if (existing) {
+                existing.remove();
+                return;
+            }
+            try {
+                const response = await fetch(fileUrl('/thumb', fileId));
+                if (!response.ok) throw new Error('无法预览');
+                const pre = document.createElement('pre');
+                pre.className = 'text-preview';
+                pre.textContent = await response.text();
+                item.appendChild(pre);
+            } catch (error) {
+                showStatus('预览失败：' + error.message, 'error');
+            }
+        }
+
+        function escapeHtml(text) {
+            return String(text).replace(/[&<>"']/g, c => ({
+                '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+            })[c]);
+        }
+
+        // 多选打包下载：选中的文件和目录通过表单 POST 提交，由浏览器直接接收流式 ZIP；
+        // 未选择时打包当前目录
+        const selectedIds = new Set();
+
+        function toggleSelect(fileId, checked) {
+            if (checked) {
+                selectedIds.add(fileId);
+            } else {
+                selectedIds.delete(fileId);
+            }
+            updateZipButton();
+        }
+
+        function toggleSelectAll(checked) {
+            for (const item of items) {
+                if (checked) {
+                    selectedIds.add(item.id);
+                } else {
+                    selectedIds.delete(item.id);
+                }
+            }
+            renderFileList();
+        }
+
+        function updateZipButton() {
+            document.getElementById('zipBtn').textContent =
+                selectedIds.size ? `打包下载所选 (${selectedIds.size})` : '打包下载当前目录';
+            document.getElementById('selectAll').checked =
+                items.length > 0 && items.every(item => selectedIds.has(item.id));
+        }
+
+        function downloadZip() {
+            const form = document.createElement('form');
+            form.method = 'POST';
+            form.action = '/download-zip';
+            const ids = selectedIds.size ? Array.from(selectedIds) : (currentDir ? [currentDir] : []);
+            for (const id of ids) {
+                const input = document.createElement('input');
+                input.type = 'hidden';
+                input.name = 'files';
+                input.value = id;
+                form.appendChild(input);
+            }
+            document.body.appendChild(form);
+            form.submit();
+            form.remove();
+        }
+
+        // 目录浏览：首次只取当前目录的一页，“加载更多”用服务器返回的游标取下一页。
+        // 之后的刷新用 /files?since= 取上次之后的增量合并到已加载的条目中，列表未变化时服务器返回 304
+        const PAGE_SIZE = 200;
+        let currentDir = '';
+        let currentSort = 'time';
+        let items = [];
+        let listTotal = 0;
+        let nextCursor = null;
+        let lastKey = null;
+        let listEpoch = null;
+        let listGeneration = 0;
+        let loadingPage = false;
+
+        function parentDir(path) {
+            const i = path.lastIndexOf('/');
+            return i < 0 ? '' : path.slice(0, i);
+        }
+
+        // 输入了搜索词时列表显示当前目录（含子目录）下的搜索结果，翻页方式相同
+        let searchQuery = '';
+
+        function listUrl(limit, cursor) {
+            const params = new URLSearchParams({dir: currentDir, sort: currentSort, limit: limit});
+            if (cursor) params.set('cursor', cursor);
+            if (searchQuery) {
+                params.set('q', searchQuery);
+                return `/search?${params}`;
+            }
+            return `/files?${params}`;
+        }
+
+        // 与服务器的排序键一致：目录浏览时子目录在前，相同时按名称；搜索结果相同时按路径
+        function sortKey(item) {
+            const tie = searchQuery ? item.id : item.name;
+            if (item.type === 'dir') return [0, item.name.toLowerCase(), item.name];
+            if (currentSort === 'time') return [1, -item.timestamp, tie];
+            if (currentSort === 'size') return [1, -item.size, tie];
+            return [1, item.name.toLowerCase(), tie];
+        }
+
+        function compareKeys(a, b) {
+            for (let i = 0; i < a.length; i++) {
+                if (a[i] < b[i]) return -1;
+                if (a[i] > b[i]) return 1;
+            }
+            return 0;
+        }
+
+        function searchMatches(info) {
+            if (currentDir && !info.id.startsWith(currentDir + '/')) return false;
+            const name = info.name.toLowerCase();
+            const exts = [];
+            for (const word of searchQuery.toLowerCase().split(/\s+/)) {
+                if (word.startsWith('ext:')) {
+                    exts.push(...word.slice(4).split(',').filter(ext => ext).map(ext => ext.replace(/^\.+/, '')));
+                } else if (word && !name.includes(word)) {
+                    return false;
+                }
+            }
+            const dot = name.lastIndexOf('.');
+            return exts.length === 0 || (dot > 0 && exts.includes(name.slice(dot + 1)));
+        }
+
+        // 排在已加载部分之后的条目留给“加载更多”取
+        function insertItem(item) {
+            const key = sortKey(item);
+            if (nextCursor && compareKeys(key, lastKey) > 0) return false;
+            const i = items.findIndex(other => compareKeys(key, sortKey(other)) < 0);
+            items.splice(i < 0 ? items.length : i, 0, item);
+            return true;
+        }
+
+        function applyDelta(data) {
+            if (data.dirs[currentDir] === null) {
+                // 当前目录已被删除，回到上一级
+                openDir(parentDir(currentDir));
+                return;
+            }
+            const changed = new Set(data.removed);
+            data.added.forEach(info => changed.add(info.id));
+            const before = items.length;
+            items = items.filter(item => item.type === 'dir' ? !(item.id in data.dirs) : !changed.has(item.id));
+            let removed = before - items.length;
+            let inserted = 0;
+            if (searchQuery) {
+                for (const info of data.added) {
+                    if (searchMatches(info) && insertItem(info)) inserted++;
+                }
+                if (listTotal !== null) listTotal += inserted - removed;
+            } else {
+                for (const [path, info] of Object.entries(data.dirs)) {
+                    if (info !== null && path !== currentDir && info.dir === currentDir) insertItem(info);
+                }
+                for (const info of data.added) {
+                    if (info.dir === currentDir) insertItem(info);
+                }
+                if (data.dirs[currentDir]) listTotal = data.dirs[currentDir].items;
+            }
+        }
+
+        async function loadFileList() {
+            const dir = currentDir;
+            const sort = currentSort;
+            const query = searchQuery;
+            try {
+                const response = await fetch(listUrl(PAGE_SIZE), {cache: 'no-store'});
+                if (dir !== currentDir || sort !== currentSort || query !== searchQuery) return;
+                if (response.status === 404 && currentDir) {
+                    openDir(parentDir(currentDir));
+                    return;
+                }
+                if (!response.ok) throw new Error(response.statusText);
+                const data = await response.json();
+                if (dir !== currentDir || sort !== currentSort || query !== searchQuery) return;
+                items = data.items;
+                listTotal = data.total;
+                nextCursor = data.next_cursor;
+                lastKey = items.length ? sortKey(items[items.length - 1]) : null;
+                listEpoch = data.epoch;
+                listGeneration = data.generation;
+                renderFileList();
+            } catch (error) {
+                console.error('获取文件列表失败：', error);
+            }
+        }
+
         async function refreshFileList() {
+            if (listEpoch === null) {
+                await loadFileList();
+                return;
+            }
+            const dir = currentDir;
+            const sort = currentSort;
+            const query = searchQuery;
+            const epoch = listEpoch;
             try {
-                const response = await fetch('/files');
-                const files = await response.json();
-                
-                const fileList = document.getElementById('fileList');
-                if (files.length === 0) {
-                    fileList.innerHTML = '<div style="text-align: center; color: #666;">暂无文件</div>';
+                const params = new URLSearchParams({since: listGeneration, epoch: epoch, files: 0});
+                const headers = {'If-None-Match': `"${epoch}-${listGeneration}"`};
+                const response = await fetch(`/files?${params}`, {headers: headers, cache: 'no-store'});
+                if (dir !== currentDir || sort !== currentSort || query !== searchQuery) return;
+                if (response.status === 304) return;
+                if (!response.ok) throw new Error(response.statusText);
+                const data = await response.json();
+                if (dir !== currentDir || sort !== currentSort || query !== searchQuery || epoch !== listEpoch) return;
+                if (data.full || data.epoch !== listEpoch) {
+                    // 服务器重启或变更日志已不覆盖上次的代数，从第一页重新加载。
+                    // 重启后的代数从重新扫描的文件数开始，可能不大于本页记录的代数，须先于下面的比较处理
+                    await loadFileList();
                     return;
                 }
-                
-                fileList.innerHTML = files.map(file => `
-                    <div class="file-item">
-                        <div class="file-info">
-                            <div class="file-name">${file.name}</div>
-                            <div class="file-details">
-                                大小: ${formatFileSize(file.size)} | 
-                                时间: ${new Date(file.timestamp).toLocaleString()}
-                            </div>
-                        </div>
-                        <div class="file-actions">
-                            <a href="javascript:void(0)" 
-                               onclick="downloadFile('${file.id}', '${file.name}')" 
-                               class="download-btn">下载</a>
-                        </div>
-                    </div>
-                `).join('');
+                // 已有更新的结果先到达
+                if (data.generation <= listGeneration) return;
+                listGeneration = data.generation;
+                applyDelta(data);
+                renderFileList();
+            } catch (error) {
+                console.error('获取文件列表失败：', error);
+            }
+        }
+
+        async function loadMore() {
+            if (!nextCursor || loadingPage) return;
+            const dir = currentDir;
+            const sort = currentSort;
+            const query = searchQuery;
+            loadingPage = true;
+            try {
+                const response = await fetch(listUrl(PAGE_SIZE, nextCursor), {cache: 'no-store'});
+                if (!response.ok) throw new Error(response.statusText);
+                const data = await response.json();
+                if (dir !== currentDir || sort !== currentSort || query !== searchQuery) return;
+                // 与增量刷新已合并进来的条目去重
+                const loaded = new Set(items.map(item => item.id));
+                items = items.concat(data.items.filter(item => !loaded.has(item.id)));
+                listTotal = data.total;
+                nextCursor = data.next_cursor;
+                if (data.items.length) lastKey = sortKey(data.items[data.items.length - 1]);
+                renderFileList();
             } catch (error) {
                 console.error('获取文件列表失败：', error);
+            } finally {
+                loadingPage = false;
             }
         }
 
-        refreshFileList();
-        setInterval(refreshFileList, 5000);
+        function resetView() {
+            items = [];
+            listTotal = 0;
+            nextCursor = null;
+            lastKey = null;
+            listEpoch = null;
+            renderFileList();
+            loadFileList();
+        }
 
-        // 添加文件选择监听器
-        document.getElementById('fileInput').addEventListener('change', function(e) {
-            const selectedFiles = e.target.files;
+        function openDir(path) {
+            currentDir = path;
+            resetView();
+        }
+
+        function setSort(sort) {
+            currentSort = sort;
+            resetView();
+        }
+
+        function renderBreadcrumbs() {
+            const parts = currentDir ? currentDir.split('/') : [];
+            const links = [`<a onclick="openDir('')">根目录</a>`];
+            parts.forEach((part, i) => {
+                const path = escapeHtml(JSON.stringify(parts.slice(0, i + 1).join('/')));
+                links.push(`<a onclick="openDir(${path})">${escapeHtml(part)}</a>`);
+            });
+            document.getElementById('breadcrumbs').innerHTML = links.join(' / ');
+        }
+
+        function renderFileList() {
+            renderBreadcrumbs();
+            updateZipButton();
+            const fileList = document.getElementById('fileList');
+            const loadMoreBtn = document.getElementById('loadMoreBtn');
+            loadMoreBtn.style.display = nextCursor ? 'block' : 'none';
+            loadMoreBtn.textContent = listTotal === null ? '加载更多' : `加载更多 (${items.length}/${listTotal})`;
+            if (items.length === 0) {
+                const empty = searchQuery ? '没有匹配的文件' : '暂无文件';
+                fileList.innerHTML = `<div style="text-align: center; color: #666;">${empty}</div>`;
+                return;
+            }
+
+            fileList.innerHTML = items.map(item => {
+                const id = escapeHtml(JSON.stringify(item.id));
+                const checkbox = `<input type="checkbox" class="file-select" ${selectedIds.has(item.id) ? 'checked' : ''}
+                           onchange="toggleSelect(${id}, this.checked)">`;
+                if (item.type === 'dir') {
+                    return `
+                <div class="file-item">
+                    ${checkbox}
+                    <div class="file-info dir-link" onclick="openDir(${id})">
+                        <div class="file-name">📁 ${escapeHtml(item.name)}</div>
+                        <div class="file-details">${item.items} 项</div>
+                    </div>
+                </div>
+            `;
+                }
+                const kind = previewKind(item.name);
+                const thumbUrl = `${fileUrl('/thumb', item.id)}?v=${item.size}-${item.timestamp}`;
+                const thumb = kind === 'thumb'
+                    ? `<img class="thumb" loading="lazy" alt="" src="${escapeHtml(thumbUrl)}" onerror="thumbError(this)">`
+                    : '';
+                const preview = kind === 'text'
+                    ? `<a href="javascript:void(0)" onclick="togglePreview(this, ${id})" class="download-btn">预览</a>`
+                    : '';
+                return `
+                <div class="file-item">
+                    ${checkbox}
+                    ${thumb}
+                    <div class="file-info">
+                        <div class="file-name">${escapeHtml(item.name)}</div>
+                        <div class="file-details">
+                            ${searchQuery && item.dir ? `位置: ${escapeHtml(item.dir)} | ` : ''}
+                            大小: ${formatFileSize(item.size)} | 
+                            时间: ${new Date(item.timestamp).toLocaleString()}
+                        </div>
+                    </div>
+                    <div class="file-actions">
+                        ${preview}
+                        <a href="javascript:void(0)" 
+                           onclick="downloadFile(${id})" 
+                           class="download-btn">下载</a>
+                    </div>
+                </div>
+            `;
+            }).join('');
+        }
+
+        // 当前目录之下有变化时合并短时间内的多个事件，只刷新一次
+        let changeTimer = null;
+
+        function applyChange(change) {
+            if (currentDir && change.id !== currentDir && !change.id.startsWith(currentDir + '/')) return;
+            if (changeTimer === null) {
+                changeTimer = setTimeout(() => {
+                    changeTimer = null;
+                    refreshFileList();
+                }, 300);
+            }
+        }
+
+        // 优先使用服务器推送，事件流不可用时退回 5 秒轮询
+        let pollTimer = null;
+
+        function startPolling() {
+            if (pollTimer === null) pollTimer = setInterval(refreshFileList, 5000);
+        }
+
+        function stopPolling() {
+            if (pollTimer !== null) {
+                clearInterval(pollTimer);
+                pollTimer = null;
+            }
+        }
+
+        function subscribeEvents() {
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+            const source = new EventSource('/events');
+            source.addEventListener('open', () => {
+                stopPolling();
+                refreshFileList();
+            });
+            source.addEventListener('change', e => applyChange(JSON.parse(e.data)));
+            source.addEventListener('error', () => {
+                startPolling();
+                // 浏览器不会对失败的首次连接自动重连，稍后重新订阅
+                if (source.readyState === EventSource.CLOSED) {
+                    setTimeout(subscribeEvents, 60000);
+                }
+            });
+        }
+
+        loadFileList();
+        subscribeEvents();
+
+        function selectFiles(selectedFiles) {
+            pendingFiles = Array.from(selectedFiles);
             const selectedFilesDiv = document.getElementById('selectedFiles');
             
-            if (selectedFiles.length > 0) {
-                if (selectedFiles.length === 1) {
-                    selectedFilesDiv.textContent = `已选择: ${selectedFiles[0].name}`;
+            if (pendingFiles.length > 0) {
+                const folder = pendingFiles[0].webkitRelativePath.split('/')[0];
+                if (folder) {
+                    selectedFilesDiv.textContent = `已选择文件夹: ${folder}（${pendingFiles.length} 个文件）`;
+                } else if (pendingFiles.length === 1) {
+                    selectedFilesDiv.textContent = `已选择: ${pendingFiles[0].name}`;
                 } else {
-                    selectedFilesDiv.textContent = `已选择 ${selectedFiles.length} 个文件`;
+                    selectedFilesDiv.textContent = `已选择 ${pendingFiles.length} 个文件`;
                 }
             } else {
                 selectedFilesDiv.textContent = '未选择文件';
+                document.getElementById('fileInput').value = '';
+                document.getElementById('folderInput').value = '';
             }
+        }
+
+        // 边输入边搜索，停止输入 200 毫秒后再请求
+        let searchTimer = null;
+        document.getElementById('searchInput').addEventListener('input', e => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => {
+                searchQuery = e.target.value.trim();
+                resetView();
+            }, 200);
         });
+
+        // 添加文件选择监听器
+        document.getElementById('fileInput').addEventListener('change', e => selectFiles(e.target.files));
+        document.getElementById('folderInput').addEventListener('change', e => selectFiles(e.target.files));
     </script>
 </body>
 </html>
 '''
 
+index_page = StaticPage(HTML_TEMPLATE)
+
+# fetch 子命令：按服务器的分块清单，用多个连接（可分布在多个内容相同的服务器上）并行下载各块，
+# 逐块校验 SHA-256，校验失败的块换一个来源重新请求。已校验的块记录在 <输出>.part.json 中，
+# 中断后再次运行同一命令只下载缺少的块
+def fetch_request(url, headers=None, timeout=30):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise ValueError(f'不支持的地址: {url}')
+    connection = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    conn = connection(parts.hostname, parts.port, timeout=timeout)
+    conn.request('GET', parts.path + (f'?{parts.query}' if parts.query else ''), headers=headers or {})
+    return conn, conn.getresponse()
+
+def fetch_manifest(url, wait=600):
+    parts = urllib.parse.urlsplit(url)
+    if not parts.path.startswith('/download/'):
+        raise ValueError(f'不是文件下载地址: {url}')
+    manifest_url = urllib.parse.urlunsplit(parts._replace(path='/manifest/' + parts.path[len('/download/'):]))
+    deadline = time.monotonic() + wait
+    while True:
+        conn, resp = fetch_request(manifest_url)
+        try:
+            body = resp.read()
+        finally:
+            conn.close()
+        # 服务器还在计算大文件的清单
+        if resp.status == 503 and time.monotonic() < deadline:
+            time.sleep(int(resp.getheader('Retry-After') or 5))
+            continue
+        if resp.status != 200:
+            raise OSError(f'获取清单失败: HTTP {resp.status}')
+        manifest = json.loads(body)
+        if manifest_root(manifest['chunks']) != manifest['root']:
+            raise ValueError('清单校验失败')
+        return manifest
+
+def fetch_range(url, start, end, digest, shaper=None):
+    # If-Range：服务器上的文件已变化时返回 200 而不是 206，不会混入新内容
+    conn, resp = fetch_request(url, {
+        'Range': f'bytes={start}-{end}',
+        'If-Range': quote_etag(digest),
+        'Accept-Encoding': 'identity'
+    })
+    try:
+        if resp.status != 206:
+            raise OSError(f'HTTP {resp.status}')
+        if shaper is None:
+            return resp.read(end - start + 1)
+        # 限速时按配额分段读取
+        parts = []
+        remaining = end - start + 1
+        while remaining > 0:
+            data = resp.read(shaper.acquire(None, remaining))
+            if not data:
+                break
+            parts.append(data)
+            remaining -= len(data)
+        return b''.join(parts)
+    finally:
+        conn.close()
+
+def fetch_file(urls, output=None, connections=FETCH_CONNECTIONS, quiet=False, shaper=None):
+    # 返回保存的路径；没有可用来源或某块多次校验失败时抛出 OSError（已下载的块保留，可续传）
+    manifest = None
+    sources = []
+    for url in urls:
+        try:
+            candidate = fetch_manifest(url)
+        except (OSError, ValueError, KeyError, http.client.HTTPException) as e:
+            print(f"跳过来源 {url}: {e}")
+            continue
+        if manifest is None:
+            manifest = candidate
+        if candidate['root'] != manifest['root']:
+            print(f"跳过来源 {url}: 内容与其他来源不同")
+            continue
+        sources.append(url)
+    if not sources:
+        raise OSError('没有可用的来源')
+
+    output = output or os.path.basename(manifest['name'])
+    part_path = f'{output}.part'
+    state_file = f'{part_path}.json'
+    size = manifest['size']
+    chunk_size = manifest['chunk_size']
+    chunks = manifest['chunks']
+    done = set()
+    try:
+        with open(state_file, encoding='utf-8') as f:
+            state = json.load(f)
+        if state['root'] == manifest['root'] and os.path.getsize(part_path) == size:
+            done = set(state['done'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    lock = threading.Lock()
+    pending = collections.deque(i for i in range(len(chunks)) if i not in done and size)
+    retries = collections.Counter()
+    source_errors = collections.Counter()
+    errors = []
+    started = time.monotonic()
+    fetched = 0
+    last_save = 0
+
+    def save_state():
+        with open(f'{state_file}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'root': manifest['root'], 'done': sorted(done)}, f)
+        os.replace(f'{state_file}.tmp', state_file)
+
+    def worker(n):
+        nonlocal fetched, last_save
+        while True:
+            with lock:
+                if not pending or errors:
+                    return
+                index = pending.popleft()
+                # 各连接轮流使用各来源；出错少的来源优先，重试时换下一个
+                ranked = sorted(sources, key=lambda url: source_errors[url])
+                url = ranked[(n + retries[index]) % len(ranked)]
+            start = index * chunk_size
+            end = min(size, start + chunk_size) - 1
+            try:
+                data = fetch_range(url, start, end, manifest['sha256'], shaper)
+                ok = len(data) == end - start + 1 and hashlib.sha256(data).hexdigest() == chunks[index]
+                if ok:
+                    write_at(fd, data, start)
+            except (OSError, http.client.HTTPException) as e:
+                if not quiet:
+                    print(f"\n块 {index} 下载失败（{url}）: {e}")
+                ok = False
+            with lock:
+                if ok:
+                    done.add(index)
+                    fetched += len(data)
+                    if time.monotonic() - last_save >= 1 or not pending:
+                        last_save = time.monotonic()
+                        save_state()
+                    if not quiet:
+                        rate = fetched / max(time.monotonic() - started, 1e-6)
+                        print(f"\r{output}: {len(done) * 100 // len(chunks)}%  {rate / 1e6:.1f} MB/s",
+                              end='', flush=True)
+                    continue
+                retries[index] += 1
+                source_errors[url] += 1
+                if retries[index] > FETCH_RETRIES:
+                    errors.append(f'块 {index} 多次下载或校验失败')
+                    return
+                pending.append(index)
+            time.sleep(min(10, 0.5 * 2 ** retries[index]))
+
+    parent = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+        threads = [threading.Thread(target=worker, args=(n,), daemon=True)
+                   for n in range(min(connections * len(sources), max(1, len(pending))))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with lock:
+            save_state()
+        if not quiet:
+            print()
+        if errors or len(done) < len(chunks) and size:
+            raise OSError(errors[0] if errors else '下载未完成')
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(part_path, output)
+    discard_file(state_file)
+    return output
+
+def fetch_main(argv):
+    parser = argparse.ArgumentParser(prog='localshare.py fetch',
+                                     description='按分块清单并行下载文件，逐块校验，可断点续传')
+    parser.add_argument('urls', nargs='+',
+                        help='下载地址（http://主机:端口/download/路径）；给出多个内容相同的服务器时同时从各服务器下载')
+    parser.add_argument('-o', '--output', help='保存路径，默认为原文件名')
+    parser.add_argument('-c', '--connections', type=int, default=FETCH_CONNECTIONS, help='每个来源的并行连接数')
+    parser.add_argument('--peers', action='store_true', help='同时从第一个服务器发现的、有同一文件的其他实例下载')
+    args = parser.parse_args(argv)
+    urls = list(args.urls)
+    if args.peers:
+        parts = urllib.parse.urlsplit(urls[0])
+        file_id = urllib.parse.unquote(parts.path[len('/download/'):])
+        peers_url = urllib.parse.urlunsplit(parts._replace(path='/peers', query=urllib.parse.urlencode({'file': file_id})))
+        try:
+            conn, resp = fetch_request(peers_url)
+            try:
+                urls += [url for url in json.loads(resp.read()).get('sources', []) if url not in urls]
+            finally:
+                conn.close()
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            print(f"查询其他实例失败: {e}")
+    try:
+        path = fetch_file(urls, args.output, max(1, args.connections))
+    except (OSError, ValueError) as e:
+        print(f"下载失败: {e}")
+        sys.exit(1)
+    print(f"已保存: {path}")
+
+# 其他实例：url 为其 HTTP 地址，files 为同步来的文件列表（文件 id -> 文件信息），
+# load 为其进行中的传输数，rtt 为最近一次同步的往返时间
+class Peer:
+    def __init__(self, url, static=False):
+        self.url = url
+        self.static = static
+        self.id = None
+        self.name = None
+        self.load = 0
+        self.rtt = None
+        self.last_seen = time.monotonic()
+        self.epoch = None
+        self.generation = 0
+        self.files = {}
+        self.error = None
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'id': self.id,
+            'name': self.name,
+            'static': self.static,
+            'files': len(self.files),
+            'load': self.load,
+            'rtt_ms': round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            'seen': round(time.monotonic() - self.last_seen, 1),
+            'error': self.error
+        }
+
+# 实例发现通告的格式：来自网络的数据包，各字段都要检查
+def valid_announce(message):
+    return (isinstance(message, dict) and message.get('app') == 'localshare' and
+            isinstance(message.get('id'), str) and
+            isinstance(message.get('port'), int) and not isinstance(message['port'], bool) and
+            0 < message['port'] < 65536 and
+            isinstance(message.get('load', 0), int) and isinstance(message.get('name', ''), str) and
+            isinstance(message.get('host') or '', str))
+
+# 局域网实例发现与镜像：一个线程收发 UDP 通告（广播 + 各网卡上的组播），
+# 一个线程定期用 /files?since 增量同步各实例的文件列表，开启镜像时再有一个线程逐个拉取本机没有的文件：
+# 相同内容本机已有时直接硬链接，否则用 fetch 客户端从所有有该文件的实例并行、限速、可续传地下载
+class PeerManager:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.node_id = os.urandom(8).hex()
+        self.host = None         # 只监听某个地址时为该地址，监听所有地址时为 None
+        self.port = None
+        self.peers = {}          # url -> Peer
+        self.mirrored = set()    # 已镜像过的文件 id，本机删除后不再重新镜像
+        self.retry_at = {}       # 镜像失败的文件 id -> 下次重试的时间
+        self.mirroring = None
+
+    def info(self):
+        return {
+            'id': self.node_id,
+            'name': socket.gethostname(),
+            'host': self.host,
+            'port': self.port,
+            'load': len(transfers.active),
+            'files': len(file_index.files)
+        }
+
+    def start(self, port, static_urls=(), host=None):
+        self.host = host if host not in (None, '', '0.0.0.0', '::') else None
+        self.port = port
+        for url in static_urls:
+            url = url.rstrip('/')
+            self.peers[url] = Peer(url, static=True)
+        if MIRROR_ENABLED:
+            try:
+                with open(state_path('mirror.json'), encoding='utf-8') as f:
+                    self.mirrored = set(json.load(f))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"读取镜像记录失败: {e}")
+            threading.Thread(target=self._mirror_loop, name='peer-mirror', daemon=True).start()
+        if DISCOVERY_ENABLED:
+            try:
+                sock = self._open_socket()
+            except OSError as e:
+                print(f"实例发现端口启动失败: {e}")
+            else:
+                threading.Thread(target=self._discovery_loop, args=(sock,), name='peer-discovery',
+                                 daemon=True).start()
+        threading.Thread(target=self._sync_loop, name='peer-sync', daemon=True).start()
+
+    def _open_socket(self):
+        # 同机多个实例共用同一发现端口
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.bind(('', DISCOVERY_PORT))
+        for ip in local_addresses():
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                socket.inet_aton(DISCOVERY_GROUP) + socket.inet_aton(ip))
+            except OSError:
+                pass
+        return sock
+
+    def _announce(self, sock):
+        message = json.dumps({'app': 'localshare', **self.info()}).encode()
+        targets = [('255.255.255.255', None)] + [(DISCOVERY_GROUP, ip) for ip in local_addresses()]
+        for address, interface in targets:
+            try:
+                if interface:
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+                sock.sendto(message, (address, DISCOVERY_PORT))
+            except OSError:
+                # 没有路由的网卡（如离线网络中的广播地址）
+                pass
+
+    def _discovery_loop(self, sock):
+        next_announce = 0
+        while True:
+            now = time.monotonic()
+            if now >= next_announce:
+                self._announce(sock)
+                next_announce = now + DISCOVERY_INTERVAL
+            sock.settimeout(max(0.1, next_announce - now))
+            try:
+                data, addr = sock.recvfrom(4096)
+                message = json.loads(data)
+            except socket.timeout:
+                continue
+            except (OSError, ValueError):
+                # 格式不对的数据包
+                continue
+            if valid_announce(message) and message['id'] != self.node_id:
+                self.on_announce(message, addr[0])
+
+    def on_announce(self, message, address):
+        host = message.get('host')
+        local = address in local_addresses()
+        if host:
+            # 只监听回环地址的实例只有同一台机器能访问
+            if (host.startswith('127.') or host in ('::1', 'localhost')) and not local:
+                return
+        else:
+            # 同一台机器上的实例经回环地址访问
+            host = '127.0.0.1' if local else address
+        url = f"http://{f'[{host}]' if ':' in host else host}:{message['port']}"
+        with self.lock:
+            # 同一实例可能经多个网卡被收到，已知的实例保留原地址
+            peer = next((p for p in self.peers.values() if p.id == message['id']), None) or self.peers.get(url)
+            if peer is None:
+                peer = self.peers[url] = Peer(url)
+            peer.id = message['id']
+            peer.name = message.get('name')
+            peer.load = message.get('load', 0)
+            peer.last_seen = time.monotonic()
+
+    def _sync_loop(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                for url, peer in list(self.peers.items()):
+                    if not peer.static and now - peer.last_seen > PEER_TIMEOUT:
+                        del self.peers[url]
+                peers = list(self.peers.values())
+            for peer in peers:
+                try:
+                    self.sync(peer)
+                    peer.error = None
+                except (OSError, ValueError, KeyError, TypeError, AttributeError, http.client.HTTPException) as e:
+                    peer.error = str(e)
+            time.sleep(PEER_SYNC_INTERVAL)
+
+    def sync(self, peer):
+        started = time.monotonic()
+        conn, resp = fetch_request(f'{peer.url}/peers/self')
+        try:
+            info = json.loads(resp.read())
+        finally:
+            conn.close()
+        if not (isinstance(info, dict) and isinstance(info.get('id'), str) and
+                isinstance(info.get('load'), int)):
+            raise ValueError('无效的实例信息')
+        if info['id'] == self.node_id:
+            # --peer 指向了本机
+            with self.lock:
+                self.peers.pop(peer.url, None)
+            return
+        peer.rtt = time.monotonic() - started
+        peer.id, peer.name, peer.load = info['id'], str(info.get('name')), info['load']
+        peer.last_seen = time.monotonic()
+        with self.lock:
+            # 通告与 --peer 指向同一实例时只保留一个
+            for url, other in list(self.peers.items()):
+                if other is not peer and other.id == peer.id and not other.static:
+                    del self.peers[url]
+
+        query = urllib.parse.urlencode({'since': peer.generation, 'epoch': peer.epoch or ''})
+        headers = {'If-None-Match': f'"{peer.epoch}-{peer.generation}"'} if peer.epoch else {}
+        conn, resp = fetch_request(f'{peer.url}/files?{query}', headers)
+        try:
+            # 对方列表没有变化
+            if resp.status == 304:
+                return
+            if resp.status != 200:
+                raise OSError(f'HTTP {resp.status}')
+            listing = json.loads(resp.read())
+        finally:
+            conn.close()
+        if not (isinstance(listing, dict) and isinstance(listing.get('epoch'), str) and
+                isinstance(listing.get('generation'), int)):
+            raise ValueError('无效的文件列表')
+        files = {} if listing.get('full') else dict(peer.files)
+        for info in list(listing.get('files') or []) + list(listing.get('added') or []):
+            # 只保留镜像和选择来源需要的字段；对方的本地路径对本机没有意义
+            if (isinstance(info, dict) and isinstance(info.get('id'), str) and
+                    isinstance(info.get('size'), int) and info['size'] >= 0):
+                files[info['id']] = {'id': info['id'], 'size': info['size'], 'timestamp': info.get('timestamp')}
+        for name in listing.get('removed') or []:
+            if isinstance(name, str):
+                files.pop(name, None)
+        peer.files = files
+        peer.epoch = listing['epoch']
+        peer.generation = listing['generation']
+
+    # 有该文件（大小相同）的实例的下载地址，进行中的传输少、往返时间短的在前；
+    # local 为本机的地址时本机（往返时间记为 0）一同参与排序
+    def sources(self, file_id, size=None, local=None):
+        with self.lock:
+            candidates = [(peer.load, peer.rtt if peer.rtt is not None else PEER_TIMEOUT, peer.url)
+                          for peer in self.peers.values() if file_id in peer.files and
+                          (size is None or peer.files[file_id]['size'] == size)]
+        if local is not None:
+            candidates.append((len(transfers.active), 0, local))
+        candidates.sort()
+        return [f"{url}/download/{urllib.parse.quote(file_id)}" for _, _, url in candidates]
+
+    def _mirror_loop(self):
+        while True:
+            time.sleep(PEER_SYNC_INTERVAL)
+            with self.lock:
+                candidates = {}
+                for peer in self.peers.values():
+                    for file_id, info in peer.files.items():
+                        candidates.setdefault(file_id, info)
+            now = time.monotonic()
+            with file_index.lock:
+                missing = [(file_id, info) for file_id, info in candidates.items()
+                           if file_id not in file_index.files and file_id not in self.mirrored and
+                           self.retry_at.get(file_id, 0) <= now]
+            for file_id, info in missing:
+                try:
+                    self.mirror(file_id, info)
+                    self.retry_at.pop(file_id, None)
+                except (OSError, ValueError, KeyError, TypeError, http.client.HTTPException) as e:
+                    print(f"镜像文件失败: {file_id}: {e}")
+                    self.retry_at[file_id] = time.monotonic() + PEER_TIMEOUT
+                except (StorageFull, RequestEntityTooLarge):
+                    # 配额不足，留待以后空间释放后再试
+                    self.retry_at[file_id] = time.monotonic() + PEER_TIMEOUT
+
+    def mirror(self, file_id, info):
+        name = safe_path(file_id)
+        sources = self.sources(file_id, info['size'])
+        if name is None or not sources:
+            return
+        self.mirroring = file_id
+        storage.check_file_size(info['size'])
+        storage.reserve(info['size'])
+        try:
+            manifest = fetch_manifest(sources[0], wait=0)
+            final_name = None
+            # 本机已有相同内容时直接硬链接，不再传输
+            if DEDUP_ENABLED and verify_blob(manifest['sha256']):
+                with publish_lock:
+                    ensure_parent(name)
+                    final_name = link_blob(manifest['sha256'], name)
+                if final_name is not None:
+                    file_index.set_timestamp(final_name, time.time())
+                    storage.uploaded(final_name)
+            if final_name is None:
+                key = hashlib.sha1(f"{file_id}:{manifest['root']}".encode()).hexdigest()
+                tmp_path = fetch_file(sources, state_path('mirror', key), MIRROR_CONNECTIONS, quiet=True,
+                                      shaper=mirror_shaper)
+                # 摘要在本机重新计算，不信任对方给出的整体摘要
+                publish_file(tmp_path, name, hash_file(tmp_path))
+            print(f"已镜像: {file_id}")
+        finally:
+            storage.release(info['size'])
+            self.mirroring = None
+        self.mirrored.add(file_id)
+        path = state_path('mirror.json')
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(sorted(self.mirrored), f)
+        os.replace(f'{path}.tmp', path)
+
+    def to_dict(self):
+        with self.lock:
+            peers = [peer.to_dict() for peer in self.peers.values()]
+        return {'self': self.info(), 'mirroring': self.mirroring, 'peers': peers}
+
+mirror_shaper = TrafficShaper(MIRROR_RATE_LIMIT)
+peer_manager = PeerManager()
+
+# 已知的其他实例；?file= 时返回有该文件的各实例（含本机）的下载地址，负载低、延迟小的在前
+@app.route('/peers')
+def list_peers():
+    file_id = request.args.get('file')
+    if file_id is None:
+        return jsonify(peer_manager.to_dict())
+    file_name = safe_path(file_id)
+    if file_name is None:
+        return jsonify({'error': '无效的文件名'}), 400
+    with file_index.lock:
+        local = file_index.files.get(file_name)
+    if local is None:
+        sources = peer_manager.sources(file_name)
+    else:
+        sources = peer_manager.sources(file_name, local['size'], request.host_url.rstrip('/'))
+    return jsonify({'sources': sources})
+
+@app.route('/peers/self')
+def peer_self():
+    return jsonify(peer_manager.info())
+
+def set_upload_folder(folder):
+    global UPLOAD_FOLDER
+    UPLOAD_FOLDER = os.path.abspath(folder)
+    if not os.path.exists(UPLOAD_FOLDER):
+        os.makedirs(UPLOAD_FOLDER)
+    file_index.folder = UPLOAD_FOLDER
+
 def main():
-    host = '0.0.0.0'
-    port = 5000
-    print(f"服务器运行在: http://{get_local_ip()}:{port}")
-    app.run(host=host, port=port)
+    global EVENTS_PORT, SENDFILE_ENABLED, DEDUP_ENABLED, COMPRESS_ENABLED, SERVER_MODE, SERVER_WORKERS
+    global SERVER_MAX_CONNECTIONS, SERVER_BACKLOG, SOCKET_SNDBUF, SOCKET_RCVBUF, REQUEST_TIMEOUT, ACCESS_LOG
+    global THUMB_ENABLED, THUMB_WORKERS, METRICS_ENABLED, QUOTA_TOTAL, QUOTA_FILE, FILE_TTL, MANIFEST_ENABLED
+    global DISCOVERY_ENABLED, DISCOVERY_PORT, MIRROR_ENABLED, WRITE_BEHIND_BYTES, DURABILITY, SYNC_INTERVAL
+    if len(sys.argv) > 1 and sys.argv[1] == 'fetch':
+        return fetch_main(sys.argv[2:])
+    parser = argparse.ArgumentParser(description='局域网文件共享')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+    parser.add_argument('--port', type=int, default=5000, help='监听端口')
+    parser.add_argument('--folder', default=UPLOAD_FOLDER, help='共享文件目录')
+    parser.add_argument('--events-port', type=int, default=EVENTS_PORT,
+                        help='SSE 推送端口，默认为端口 + 1，0 表示不启用')
+    parser.add_argument('--no-sendfile', action='store_true', help='下载不使用 sendfile，逐块读取发送')
+    parser.add_argument('--no-dedup', action='store_true', help='不按内容去重')
+    parser.add_argument('--no-compress', action='store_true', help='下载不进行压缩')
+    parser.add_argument('--no-thumbnails', action='store_true', help='不生成预览缩略图')
+    parser.add_argument('--thumb-workers', type=int, default=THUMB_WORKERS, help='生成预览的后台线程数')
+    parser.add_argument('--server', choices=['threaded', 'dev', 'waitress'], default=SERVER_MODE,
+                        help='服务模式：threaded 内置线程池（默认），dev 为 Flask 开发服务器，waitress 需另行安装')
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help='工作线程数')
+    parser.add_argument('--max-connections', type=int, default=SERVER_MAX_CONNECTIONS, help='最大并发连接数')
+    parser.add_argument('--backlog', type=int, default=SERVER_BACKLOG, help='监听队列长度')
+    parser.add_argument('--sndbuf', type=int, default=SOCKET_SNDBUF, help='socket 发送缓冲区（字节），0 为系统默认')
+    parser.add_argument('--rcvbuf', type=int, default=SOCKET_RCVBUF, help='socket 接收缓冲区（字节），0 为系统默认')
+    parser.add_argument('--timeout', type=float, default=REQUEST_TIMEOUT, help='socket 读写超时（秒），0 为不超时')
+    parser.add_argument('--no-access-log', action='store_true', help='不输出访问日志')
+    parser.add_argument('--quota', type=parse_rate, default=QUOTA_TOTAL,
+                        help='上传目录中文件总大小上限（可写 500G），超过高水位时淘汰最久未下载的文件；0 为不限')
+    parser.add_argument('--file-quota', type=parse_rate, default=QUOTA_FILE, help='单个文件大小上限，0 为不限')
+    parser.add_argument('--ttl', type=parse_duration, default=FILE_TTL,
+                        help='上传文件的默认保留时间（秒，可写 12h、7d），到期后删除；0 为永久')
+    parser.add_argument('--write-behind', type=parse_rate, default=WRITE_BEHIND_BYTES,
+                        help='上传写盘队列上限（可写 64M），0 为同步写入')
+    parser.add_argument('--durability', choices=DURABILITY_MODES, default=DURABILITY,
+                        help='上传文件的持久化方式：none 不主动 fsync，commit 发布前 fsync，periodic 定期 fsync')
+    parser.add_argument('--sync-interval', type=float, default=SYNC_INTERVAL, help='periodic 模式的 fsync 间隔（秒）')
+    parser.add_argument('--no-discovery', action='store_true', help='不通过 UDP 广播发现局域网中的其他实例')
+    parser.add_argument('--discovery-port', type=int, default=DISCOVERY_PORT, help='实例发现使用的 UDP 端口')
+    parser.add_argument('--peer', action='append', default=[], metavar='URL',
+                        help='其他实例的地址（如 http://192.168.1.11:5000），可重复；用于广播不可达的网络')
+    parser.add_argument('--mirror', action='store_true', help='在后台把其他实例上本机没有的文件镜像过来')
+    parser.add_argument('--mirror-rate-limit', type=parse_rate, default=MIRROR_RATE_LIMIT,
+                        help='镜像下载的速率上限（可写 10M），默认不限')
+    parser.add_argument('--no-manifest', action='store_true', help='不生成分块摘要清单（/manifest）')
+    parser.add_argument('--no-metrics', action='store_true', help='不统计性能指标（/metrics）')
+    parser.add_argument('--rate-limit', type=parse_rate, default=RATE_LIMIT_DOWN,
+                        help='下载总速率上限（字节/秒，可写 10M、512K），0 为不限')
+    parser.add_argument('--upload-rate-limit', type=parse_rate, default=RATE_LIMIT_UP, help='上传总速率上限')
+    parser.add_argument('--client-rate-limit', type=parse_rate, default=CLIENT_RATE_LIMIT_DOWN,
+                        help='单个客户端的下载速率上限')
+    parser.add_argument('--client-upload-rate-limit', type=parse_rate, default=CLIENT_RATE_LIMIT_UP,
+                        help='单个客户端的上传速率上限')
+    args = parser.parse_args()
+
+    host = args.host
+    port = args.port
+    EVENTS_PORT = args.events_port
+    SENDFILE_ENABLED = not args.no_sendfile
+    DEDUP_ENABLED = not args.no_dedup
+    COMPRESS_ENABLED = not args.no_compress
+    THUMB_ENABLED = not args.no_thumbnails
+    THUMB_WORKERS = max(1, args.thumb_workers)
+    METRICS_ENABLED = not args.no_metrics
+    MANIFEST_ENABLED = not args.no_manifest
+    DISCOVERY_ENABLED = not args.no_discovery
+    DISCOVERY_PORT = args.discovery_port
+    MIRROR_ENABLED = args.mirror
+    WRITE_BEHIND_BYTES = args.write_behind
+    DURABILITY = args.durability
+    SYNC_INTERVAL = max(0.1, args.sync_interval)
+    mirror_shaper.configure(args.mirror_rate_limit, 0)
+    QUOTA_TOTAL = args.quota
+    QUOTA_FILE = args.file_quota
+    FILE_TTL = args.ttl
+    download_shaper.configure(args.rate_limit, args.client_rate_limit)
+    upload_shaper.configure(args.upload_rate_limit, args.client_upload_rate_limit)
+    SERVER_MODE = args.server
+    SERVER_WORKERS = max(1, args.workers)
+    SERVER_MAX_CONNECTIONS = max(SERVER_WORKERS, args.max_connections)
+    SERVER_BACKLOG = args.backlog
+    SOCKET_SNDBUF = args.sndbuf
+    SOCKET_RCVBUF = args.rcvbuf
+    REQUEST_TIMEOUT = args.timeout
+    ACCESS_LOG = not args.no_access_log
+    set_upload_folder(args.folder)
+    storage.load()
+    file_index.start()
+    load_upload_sessions()
+    storage.start()
+    peer_manager.start(port, args.peer, host)
+    threading.Thread(target=run_blob_gc, name='blob-gc', daemon=True).start()
+    if EVENTS_PORT != 0:
+        try:
+            event_hub.start(host, EVENTS_PORT or port + 1)
+        except OSError as e:
+            print(f"事件推送端口启动失败，页面将退回轮询: {e}")
+    if host in ('0.0.0.0', ''):
+        urls = [f'http://{ip}:{port}' for ip in local_addresses()]
+    else:
+        urls = [f'http://{host}:{port}']
+    print("服务器运行在: " + '  '.join(urls))
+    serve(host, port)
 
 if __name__ == '__main__':
     main()
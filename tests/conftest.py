@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import localshare
+
+
+# 每个测试使用独立的上传目录和文件索引，索引的监听器沿用模块中注册的
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    index = localshare.FileIndex(str(tmp_path))
+    index.listeners = list(localshare.file_index.listeners)
+    monkeypatch.setattr(localshare, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(localshare, 'file_index', index)
+    index.rescan()
+    return tmp_path
+
+
+@pytest.fixture
+def client(folder):
+    return localshare.app.test_client()
@@ -0,0 +1,58 @@
+import hashlib
+import io
+import os
+import time
+
+import localshare
+
+
+def upload(client, name, data):
+    response = client.post('/upload', data={'files': (io.BytesIO(data), name)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['files'][0]
+
+
+def test_duplicate_upload_keeps_other_names_mtime(client, folder):
+    upload(client, 'sub/dir/nums.txt', b'1234567890')
+    path = folder / 'sub' / 'dir' / 'nums.txt'
+    old_mtime = os.stat(path).st_mtime_ns
+    time.sleep(0.05)
+
+    upload(client, 'x.txt', b'1234567890')
+
+    assert os.path.samefile(path, folder / 'x.txt')
+    assert os.stat(path).st_mtime_ns == old_mtime
+    files = localshare.file_index.files
+    assert files['sub/dir/nums.txt']['timestamp'] == old_mtime // 1000000
+    assert files['x.txt']['timestamp'] > files['sub/dir/nums.txt']['timestamp']
+
+
+def test_modified_blob_is_not_reused(client, folder):
+    upload(client, 'a.txt', b'original content')
+    # 在上传目录外原地修改（大小不变），blob 随之改变
+    with open(folder / 'a.txt', 'r+b') as f:
+        f.write(b'ORIGINAL')
+
+    upload(client, 'b.txt', b'original content')
+
+    assert (folder / 'b.txt').read_bytes() == b'original content'
+    assert not os.path.samefile(folder / 'a.txt', folder / 'b.txt')
+
+
+def test_batch_check_publishes_known_content(client, folder):
+    upload(client, 'a.bin', b'shared content')
+    known = hashlib.sha256(b'shared content').hexdigest()
+    unknown = hashlib.sha256(b'other content').hexdigest()
+
+    response = client.post('/check', json={'files': [
+        {'digest': known, 'name': 'copy/a.bin'},
+        {'digest': unknown, 'name': 'b.bin'},
+        {'digest': 'not-a-digest', 'name': 'c.bin'},
+    ]})
+
+    assert response.status_code == 200
+    assert response.get_json()['results'] == [
+        {'exists': True, 'name': 'copy/a.bin'}, {'exists': False}, {'exists': False}]
+    assert (folder / 'copy' / 'a.bin').read_bytes() == b'shared content'
+    assert not (folder / 'b.bin').exists()
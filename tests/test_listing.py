@@ -0,0 +1,49 @@
+import io
+import shutil
+
+import localshare
+
+
+def upload(client, name, data=b'x'):
+    response = client.post('/upload', data={'files': (io.BytesIO(data), name)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+
+
+def test_delta_reports_touched_directories(client, folder):
+    upload(client, 'a.txt')
+    page = client.get('/files?dir=').get_json()
+
+    upload(client, 'sub/b.txt')
+    upload(client, 'sub/deep/c.txt')
+    delta = client.get(f'/files?since={page["generation"]}&epoch={page["epoch"]}').get_json()
+
+    assert not delta['full']
+    assert sorted(info['id'] for info in delta['added']) == ['sub/b.txt', 'sub/deep/c.txt']
+    assert delta['dirs']['']['items'] == 2
+    assert delta['dirs']['sub']['items'] == 2
+    assert delta['dirs']['sub/deep']['items'] == 1
+
+
+def test_delta_marks_removed_directories(client, folder):
+    upload(client, 'sub/b.txt')
+    page = client.get('/files?dir=sub').get_json()
+
+    shutil.rmtree(folder / 'sub')
+    localshare.file_index.rescan()
+    delta = client.get(f'/files?since={page["generation"]}&epoch={page["epoch"]}').get_json()
+
+    assert delta['removed'] == ['sub/b.txt']
+    assert delta['dirs']['sub'] is None
+    assert delta['dirs']['']['items'] == 0
+
+
+def test_page_fallback_omits_the_full_listing(client, folder):
+    upload(client, 'a.txt')
+    page = client.get('/files?dir=').get_json()
+
+    stale = client.get(f'/files?since={page["generation"]}&epoch=other&files=0').get_json()
+    assert stale == {'epoch': page['epoch'], 'generation': page['generation'], 'full': True}
+
+    full = client.get(f'/files?since={page["generation"]}&epoch=other').get_json()
+    assert full['full'] and [info['id'] for info in full['files']] == ['a.txt']
@@ -0,0 +1,33 @@
+import localshare
+
+
+def test_valid_announce():
+    good = {'app': 'localshare', 'id': 'ab12', 'port': 5000, 'name': 'pc', 'load': 0}
+    assert localshare.valid_announce(good)
+    for bad in (
+        {'app': 'localshare', 'id': 'zz'},
+        {**good, 'port': '5000'},
+        {**good, 'port': True},
+        {**good, 'port': 0},
+        {**good, 'port': 70000},
+        {**good, 'id': 12},
+        {**good, 'app': 'other'},
+        {**good, 'load': 'busy'},
+        ['localshare'],
+        None,
+    ):
+        assert not localshare.valid_announce(bad)
+
+
+def test_announce_uses_advertised_or_loopback_host(monkeypatch):
+    monkeypatch.setattr(localshare, 'local_addresses', lambda: ['192.168.1.10', '127.0.0.1'])
+    manager = localshare.PeerManager()
+    announce = {'app': 'localshare', 'port': 5000, 'name': 'pc', 'load': 0}
+    # 同一台机器上监听 127.0.0.1 的实例
+    manager.on_announce({**announce, 'id': 'a', 'host': '127.0.0.1'}, '192.168.1.10')
+    # 同一台机器上监听所有地址的实例
+    manager.on_announce({**announce, 'id': 'b', 'port': 5010}, '192.168.1.10')
+    # 其他机器上只监听回环地址的实例无法访问
+    manager.on_announce({**announce, 'id': 'c', 'host': '127.0.0.1'}, '192.168.1.20')
+    manager.on_announce({**announce, 'id': 'd', 'port': 5020}, '192.168.1.20')
+    assert sorted(manager.peers) == ['http://127.0.0.1:5000', 'http://127.0.0.1:5010', 'http://192.168.1.20:5020']
@@ -0,0 +1,114 @@
+import hashlib
+import re
+
+import pytest
+
+import localshare
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=1000-', [(1000, 1023)]),
+    ('bytes=-100', [(924, 1023)]),
+    ('bytes=-5000', [(0, 1023)]),
+    ('bytes=0-99999', [(0, 1023)]),
+    ('bytes=500-599, 0-9', [(0, 9), (500, 599)]),
+    # 重叠与相邻的区间合并
+    ('bytes=0-10,5-20,21-30', [(0, 30)]),
+    ('BYTES = 0-0', [(0, 0)]),
+    ('bytes=2000-3000', []),
+    ('bytes=-0', []),
+    ('bytes=10-5', None),
+    ('bytes=abc', None),
+    ('bytes=²-', None),
+    ('bytes=0-²', None),
+    ('bytes=-²', None),
+    ('bytes=1-2-3', None),
+    ('items=0-1', None),
+    ('bytes=', None),
+    ('bytes=' + ','.join(f'{i * 2}-{i * 2}' for i in range(localshare.MAX_RANGES + 1)), None),
+])
+def test_parse_ranges(header, expected):
+    assert localshare.parse_ranges(header, len(DATA)) == expected
+
+
+def test_parse_ranges_empty_file():
+    assert localshare.parse_ranges('bytes=0-', 0) == []
+    assert localshare.parse_ranges('bytes=-10', 0) == []
+
+
+@pytest.fixture
+def data_file(folder):
+    (folder / 'data.bin').write_bytes(DATA)
+    return '/download/data.bin'
+
+
+def test_single_range(client, data_file):
+    response = client.get(data_file, headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(DATA)}'
+    assert response.headers['Content-Length'] == '10'
+    assert response.get_data() == DATA[10:20]
+
+
+def test_suffix_range(client, data_file):
+    response = client.get(data_file, headers={'Range': 'bytes=-24'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 1000-1023/{len(DATA)}'
+    assert response.get_data() == DATA[-24:]
+
+
+def test_multiple_ranges(client, data_file):
+    response = client.get(data_file, headers={'Range': 'bytes=100-109,0-4'})
+    assert response.status_code == 206
+    content_type = response.headers['Content-Type']
+    assert content_type.startswith('multipart/byteranges; boundary=')
+    boundary = content_type.split('boundary=')[1]
+    body = response.get_data()
+    assert int(response.headers['Content-Length']) == len(body)
+    parts = re.findall(rb'Content-Range: bytes (\d+)-(\d+)/(\d+)\r\n\r\n(.*?)\r\n--' + boundary.encode(),
+                       body, re.S)
+    assert [(int(s), int(e), int(n), d) for s, e, n, d in parts] == [
+        (0, 4, len(DATA), DATA[0:5]), (100, 109, len(DATA), DATA[100:110])]
+    assert body.endswith(f'\r\n--{boundary}--\r\n'.encode())
+
+
+def test_unsatisfiable_range(client, data_file):
+    response = client.get(data_file, headers={'Range': f'bytes={len(DATA)}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+
+def test_invalid_range_is_ignored(client, data_file):
+    response = client.get(data_file, headers={'Range': 'bytes=5-1', 'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.get_data() == DATA
+
+
+def test_non_ascii_digits_are_ignored(client, data_file):
+    response = client.get(data_file, headers={'Range': 'bytes=²-', 'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.get_data() == DATA
+
+
+def test_if_range_matching_etag(client, data_file):
+    digest = hashlib.sha256(DATA).hexdigest()
+    response = client.get(data_file, headers={'Range': 'bytes=0-9', 'If-Range': f'"{digest}"'})
+    assert response.status_code == 206
+    assert response.get_data() == DATA[:10]
+
+
+def test_if_range_stale_etag_sends_full_file(client, data_file):
+    response = client.get(data_file, headers={'Range': 'bytes=0-9', 'If-Range': '"0123"',
+                                              'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.get_data() == DATA
+
+
+def test_if_range_weak_etag_never_matches(client, data_file):
+    digest = hashlib.sha256(DATA).hexdigest()
+    response = client.get(data_file, headers={'Range': 'bytes=0-9', 'If-Range': f'W/"{digest}"',
+                                              'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
@@ -0,0 +1,57 @@
+import io
+import os
+
+import pytest
+
+import localshare
+
+
+@pytest.fixture
+def storage(client, monkeypatch):
+    manager = localshare.StorageManager()
+    localshare.file_index.listeners.append(manager.on_change)
+    monkeypatch.setattr(localshare, 'storage', manager)
+    return manager
+
+
+def upload(client, name, data):
+    response = client.post('/upload', data={'files': (io.BytesIO(data), name)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+
+
+def downloads(storage, name):
+    return storage.stats[name][1]
+
+
+def test_only_transfers_from_the_start_count_as_downloads(client, storage):
+    upload(client, 'a.bin', bytes(range(256)) * 4)
+
+    response = client.get('/download/a.bin')
+    assert response.status_code == 200
+    assert downloads(storage, 'a.bin') == 1
+
+    client.get('/download/a.bin', headers={'If-None-Match': response.headers['ETag']})
+    client.get('/download/a.bin', headers={'Range': 'bytes=512-'})
+    client.get('/download/a.bin', headers={'Range': 'bytes=-10'})
+    client.head('/download/a.bin')
+    assert downloads(storage, 'a.bin') == 1
+
+    assert client.get('/download/a.bin', headers={'Range': 'bytes=0-99'}).status_code == 206
+    assert downloads(storage, 'a.bin') == 2
+
+
+def test_hard_linked_names_count_once(client, folder, storage):
+    data = b'0123456789' * 100
+    upload(client, 'a.bin', data)
+    upload(client, 'dir/b.bin', data)
+    assert os.path.samefile(folder / 'a.bin', folder / 'dir' / 'b.bin')
+    assert storage.total == len(data)
+    assert storage.freed_by('a.bin') == 0
+
+    storage.delete('a.bin')
+    assert storage.total == len(data)
+    assert storage.freed_by('dir/b.bin') == len(data)
+
+    storage.delete('dir/b.bin')
+    assert storage.total == 0
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+import localshare
+
+
+@pytest.fixture
+def storage(client, monkeypatch):
+    manager = localshare.StorageManager()
+    localshare.file_index.listeners.append(manager.on_change)
+    monkeypatch.setattr(localshare, 'storage', manager)
+    monkeypatch.setattr(localshare, 'upload_sessions', {})
+    monkeypatch.setattr(localshare, 'upload_sessions_loaded', True)
+    return manager
+
+
+def init(client, name, size, chunk_size=localshare.UPLOAD_CHUNK_MIN):
+    response = client.post('/upload/init', json={'name': name, 'size': size, 'chunk_size': chunk_size})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_expired_sessions_are_discarded(client, storage, monkeypatch):
+    old = init(client, 'old.bin', 3 * localshare.UPLOAD_CHUNK_MIN)
+    new = init(client, 'new.bin', localshare.UPLOAD_CHUNK_MIN)
+    session = localshare.upload_sessions[old['upload_id']]
+    part_path = session.part_path
+    session.created -= localshare.UPLOAD_SESSION_TTL + 1
+
+    localshare.expire_upload_sessions()
+
+    assert not os.path.exists(part_path)
+    assert client.get(f'/upload/{old["upload_id"]}').status_code == 404
+    assert client.get(f'/upload/{new["upload_id"]}').status_code == 200
+    assert storage.reserved == localshare.UPLOAD_CHUNK_MIN
+
+
+def test_failed_chunk_resend_is_not_committed(client, folder, storage):
+    size = localshare.UPLOAD_CHUNK_MIN
+    session = init(client, 'a.bin', 2 * size)
+    url = f'/upload/{session["upload_id"]}'
+    assert client.put(f'{url}/0', data=b'a' * size).status_code == 200
+    assert client.put(f'{url}/1', data=b'b' * size).status_code == 200
+
+    assert client.put(f'{url}/0', data=b'c' * 10).status_code == 400
+    assert client.get(url).get_json()['received'] == [1]
+    assert client.post(f'{url}/commit').status_code == 409
+
+    assert client.put(f'{url}/0', data=b'c' * size).status_code == 200
+    assert client.post(f'{url}/commit').status_code == 200
+    assert (folder / 'a.bin').read_bytes() == b'c' * size + b'b' * size
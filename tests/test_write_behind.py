@@ -0,0 +1,124 @@
+import io
+import os
+import threading
+import time
+
+import localshare
+
+
+def run_with_timeout(func, timeout=10):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('value', func()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), '调用没有返回'
+    return result.get('value')
+
+
+def test_close_while_write_in_flight_returns():
+    started = threading.Event()
+    written = []
+
+    def slow_write(fd, data, offset):
+        started.set()
+        time.sleep(0.3)
+        written.append(offset)
+
+    writer = localshare.WriteBehind(1024)
+    writer.submit(slow_write, -1, b'a' * 512, 0)
+    started.wait(5)
+    writer.submit(slow_write, -1, b'b' * 512, 512)
+    run_with_timeout(writer.close)
+    # 正在进行的写入完成，排队的写入被放弃
+    assert written == [0]
+    assert not writer.thread.is_alive()
+
+
+def test_drain_raises_write_error():
+    def failing_write(fd, data, offset):
+        raise OSError('disk full')
+
+    writer = localshare.WriteBehind(1024)
+    writer.submit(failing_write, -1, b'x', 0)
+    try:
+        writer.drain()
+    except OSError as e:
+        assert str(e) == 'disk full'
+    else:
+        raise AssertionError('drain 没有抛出写盘错误')
+    writer.close()
+
+
+class AbortingStream(io.RawIOBase):
+    # 发送 limit 字节后模拟客户端断开
+    def __init__(self, data, limit):
+        self.data = data
+        self.position = 0
+        self.limit = limit
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = offset + (len(self.data) if whence == io.SEEK_END else 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.limit:
+            raise OSError('connection reset')
+        size = min(len(buffer), self.limit - self.position)
+        buffer[:size] = self.data[self.position:self.position + size]
+        self.position += size
+        return size
+
+
+def test_aborted_slow_upload_releases_everything(client, folder, monkeypatch):
+    write_at = localshare.write_at
+
+    def slow_write_at(fd, data, offset):
+        time.sleep(0.05)
+        write_at(fd, data, offset)
+
+    monkeypatch.setattr(localshare, 'write_at', slow_write_at)
+    payload = os.urandom(12 * 1024 * 1024)
+    body = (b'--XX\r\nContent-Disposition: form-data; name="files"; filename="big.bin"\r\n\r\n' +
+            payload + b'\r\n--XX--\r\n')
+    reserved = localshare.storage.reserved
+
+    response = run_with_timeout(lambda: client.post(
+        '/upload', input_stream=AbortingStream(body, 9 * 1024 * 1024), content_length=len(body),
+        content_type='multipart/form-data; boundary=XX'))
+
+    assert response.status_code == 500
+    assert localshare.storage.reserved == reserved
+    assert os.listdir(folder / '.localshare' / 'tmp') == []
+    assert not (folder / 'big.bin').exists()
+
+
+def test_preallocation_follows_received_data(client, folder, monkeypatch):
+    allocations = []
+    preallocate = localshare.preallocate
+
+    def record_preallocate(fd, size):
+        allocations.append((os.fstat(fd).st_size, size))
+        preallocate(fd, size)
+
+    monkeypatch.setattr(localshare, 'preallocate', record_preallocate)
+    sent = 40 * 1024 * 1024
+    head = b'--XX\r\nContent-Disposition: form-data; name="files"; filename="big.bin"\r\n\r\n'
+    body = head + os.urandom(sent)
+    # 声明 4 GB，只发送 40 MB 就结束请求体
+    response = run_with_timeout(lambda: client.post(
+        '/upload', input_stream=AbortingStream(body, len(body)), content_length=4 * 1024 ** 3,
+        content_type='multipart/form-data; boundary=XX'))
+
+    assert response.status_code == 400
+    assert allocations
+    assert max(size for _, size in allocations) <= 2 * sent
+    assert os.listdir(folder / '.localshare' / 'tmp') == []